@@ -0,0 +1,264 @@
+"""Headless batch runs of the geovision pipelines, without the HTTP API.
+
+Runs terrain analysis over DEMs, or spectral indices over Sentinel-2 granules, found in
+directories (searched recursively), glob patterns or @list files (one path or glob per
+line), in parallel worker processes. Every finished item is appended to a JSON Lines
+manifest in the output directory, so a rerun skips the items that completed with unchanged
+inputs and options, and retries the rest.
+
+    python batch.py terrain /data/dems --output /data/terrain --workers 8
+    python batch.py indices '/data/s2/**/*.jp2' --output /data/indices --indices ndbi,ndvi
+    python batch.py indices @granules.txt --output /data/indices --aois aois.json --resolution 40
+
+The pipeline modules are imported lazily, by each worker on its first item (and by the parent
+only to plan index scenes); the Flask app is never imported, so startup and worker spawn stay
+cheap. The pipelines are configured through the app's usual environment variables
+(COG_STORAGE, NDBI_GDAL_THREADS, ...).
+"""
+import argparse
+import base64
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DEM_EXTENSIONS = ('.tif', '.tiff', '.img', '.asc')
+BAND_EXTENSIONS = ('.jp2',)
+MANIFEST_NAME = 'manifest.jsonl'
+DONE_STATUSES = ('completed', 'skipped')  # skipped: the AOIs miss the scene, which a rerun will not change
+
+
+# --- Inputs and manifest
+def expand_inputs(specs, extensions):
+    """Sorted absolute paths of the files with one of extensions named by directories, globs and @list files"""
+    paths = set()
+    for spec in specs:
+        if spec.startswith('@'):
+            with open(spec[1:]) as f:
+                listed = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+            paths.update(expand_inputs(listed, extensions))
+            continue
+        if os.path.isdir(spec):
+            matches = [os.path.join(root, name) for root, _, names in os.walk(spec) for name in names]
+        else:
+            matches = glob.glob(spec, recursive=True)
+        matches = [path for path in matches if path.lower().endswith(extensions) and os.path.isfile(path)]
+        if not matches:
+            print(f"warning: no input files match {spec}", file=sys.stderr)
+        paths.update(os.path.abspath(path) for path in matches)
+    return sorted(paths)
+
+
+def fingerprint(paths, options):
+    """Changes when any input file is rewritten or the options differ"""
+    parts = []
+    for path in paths:
+        stat = os.stat(path)
+        parts.append([path, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(json.dumps([parts, options], sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    """Append-only JSON Lines record of finished items; the last line for an item wins.
+
+    Each line is flushed as it is written, so an interrupted run loses only the items that
+    were still running, and a torn last line is ignored when the manifest is read back.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[record['item']] = record
+        self._file = open(path, 'a')
+
+    def done(self, item, item_fingerprint):
+        """True when item finished with this fingerprint and its outputs still exist"""
+        record = self.records.get(item)
+        return record is not None and record['status'] in DONE_STATUSES and \
+            record['fingerprint'] == item_fingerprint and all(os.path.exists(path) for path in record['outputs'])
+
+    def append(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self.records[record['item']] = record
+
+    def close(self):
+        self._file.close()
+
+
+# --- Workers (run in spawned processes; items and outcomes are plain data)
+def run_terrain_item(item):
+    """Terrain analysis of one DEM into item['output_dir']; returns (status, output paths)"""
+    from geovision import terrain
+    output_dir = item['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    results = terrain.run_terrain_analysis(item['path'], item['clip_bounds'], output_dir, item['render'],
+                                           remove_input=False)
+    outputs = [os.path.join(output_dir, f'{name}.tif') for name in terrain.TERRAIN_RASTERS]
+    figure = results.pop('visualization', None)
+    if figure is not None:
+        outputs.append(os.path.join(output_dir, 'visualization.png'))
+        with open(outputs[-1], 'wb') as f:
+            f.write(base64.b64decode(figure))
+    outputs += [os.path.join(output_dir, 'images', filename) for filename in results.get('images', {}).values()]
+    outputs.append(os.path.join(output_dir, 'results.json'))
+    with open(outputs[-1], 'w') as f:
+        json.dump(results, f, indent=2)
+    return 'completed', [path for path in outputs if os.path.exists(path)]
+
+
+def run_index_item(item):
+    """Spectral indices of one scene into item['output_dir']; returns (status, output paths)"""
+    from geovision import indices
+    outputs = indices.run_index_scene(item['scene'], item['expressions'], item['output_dir'],
+                                      [tuple(aoi) for aoi in item['aois']], item['resolution'],
+                                      decode_cache=False)  # each granule is read once; cached tiles would never be reused
+    if outputs is None:
+        return 'skipped', []
+    return 'completed', sorted(path for paths in outputs.values() if paths for path in paths.values())
+
+
+# --- Planning
+def plan_terrain(args):
+    """Terrain items, one per DEM, each written to a directory mirroring the input tree under --output"""
+    try:
+        clip_bounds = [float(value) for value in args.clip_bounds.split(',')] if args.clip_bounds else None
+    except ValueError:
+        clip_bounds = None
+    if args.clip_bounds and (clip_bounds is None or len(clip_bounds) != 4):
+        raise SystemExit('error: --clip-bounds takes min_x,min_y,max_x,max_y')
+    paths = expand_inputs(args.inputs, DEM_EXTENSIONS)
+    root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ''
+    options = {'clip_bounds': clip_bounds, 'render': args.render}
+    items = []
+    for path in paths:
+        relative = os.path.splitext(os.path.relpath(path, root))[0]
+        items.append({'item': path, 'fingerprint': fingerprint([path], options), 'path': path,
+                      'clip_bounds': clip_bounds, 'render': args.render,
+                      'output_dir': os.path.join(args.output, relative)})
+    return run_terrain_item, items
+
+
+def plan_indices(args):
+    """Index items, one per scene having every band the indices need, each written under --output/<scene_id>"""
+    from geovision import indices as pipeline
+    form = {'aoi': args.aoi, 'aois': args.aois, 'resolution': args.resolution}
+    if args.aois and os.path.isfile(args.aois):
+        with open(args.aois) as f:
+            form['aois'] = f.read()
+    try:
+        indices = pipeline.parse_index_specs(args.indices)
+        aois = pipeline.parse_aois(form)
+        resolution = pipeline.parse_resolution(form)
+    except ValueError as e:
+        raise SystemExit(f'error: {e}')
+    expressions = {name: expression.expression for name, expression in indices.items()}
+    needed = sorted(set().union(*(expression.bands for expression in indices.values())))
+
+    catalogue = pipeline.SceneCatalogue()
+    for path in expand_inputs(args.inputs, BAND_EXTENSIONS):
+        try:
+            catalogue.ingest(path)
+        except pipeline.rasterio.errors.RasterioIOError as e:
+            print(f"warning: skipping unreadable band file {path}: {e}", file=sys.stderr)
+    options = {'expressions': expressions, 'aois': aois, 'resolution': resolution}
+    items = []
+    for scene in catalogue.scenes():
+        missing = [band for band in needed if band not in scene['bands']]
+        if missing:
+            print(f"warning: scene {scene['scene_id']} lacks bands {', '.join(missing)}", file=sys.stderr)
+            continue
+        bands = {band: scene['bands'][band]['path'] for band in needed}
+        items.append({'item': scene['scene_id'], 'fingerprint': fingerprint(sorted(bands.values()), options),
+                      'scene': {'scene_id': scene['scene_id'], 'year': scene['year'], 'bands': bands},
+                      'expressions': expressions, 'aois': aois, 'resolution': resolution,
+                      'output_dir': os.path.join(args.output, scene['scene_id'])})
+    return run_index_item, items
+
+
+# --- Running
+def run_items(worker, items, manifest, workers):
+    """Runs items in a spawned process pool, appending each outcome to the manifest; returns the failure count"""
+    failures = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        started = {}
+        futures = {}
+        for item in items:
+            started[item['item']] = time.time()
+            futures[pool.submit(worker, item)] = item
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                item = futures[future]
+                record = {'item': item['item'], 'fingerprint': item['fingerprint'], 'outputs': [],
+                          'finished': time.time()}
+                try:
+                    record['status'], record['outputs'] = future.result()
+                except Exception as e:
+                    record.update(status='failed', error=f'{type(e).__name__}: {e}')
+                    failures += 1
+                record['seconds'] = round(record['finished'] - started[item['item']], 3)
+                manifest.append(record)
+                detail = f" {record['error']}" if 'error' in record else ''
+                print(f"[{done}/{len(items)}] {record['status']} {item['item']}{detail}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(subparser):
+        subparser.add_argument('inputs', nargs='+', help='Directories, glob patterns or @files listing them')
+        subparser.add_argument('--output', required=True, help='Output directory; holds the manifest')
+        subparser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        subparser.add_argument('--manifest', help=f'Manifest path (default: <output>/{MANIFEST_NAME})')
+        subparser.add_argument('--force', action='store_true', help='Rerun items the manifest records as done')
+
+    terrain = subparsers.add_parser('terrain', help='Terrain analysis of DEMs')
+    add_common(terrain)
+    terrain.add_argument('--clip-bounds', help='min_x,min_y,max_x,max_y in the DEM CRS')
+    terrain.add_argument('--render', choices=('none', 'direct', 'figure'), default='none',
+                         help="'direct' writes one image per product, 'figure' the 2x2 panel; default rasters only")
+
+    indices = subparsers.add_parser('indices', help='Spectral indices of Sentinel-2 granules')
+    add_common(indices)
+    indices.add_argument('--indices', default='ndbi', help="Built-in names and/or name=expression, e.g. 'ndvi,ndbi'")
+    indices.add_argument('--aoi', help='One min_lon,min_lat,max_lon,max_lat area written to the scene directory')
+    indices.add_argument('--aois', help='Named areas as JSON ({name: box} or [box, ...]) or a file holding it')
+    indices.add_argument('--resolution', help='Read resolution in metres (overview levels); default full resolution')
+
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+    worker, items = plan_terrain(args) if args.command == 'terrain' else plan_indices(args)
+
+    manifest = Manifest(args.manifest or os.path.join(args.output, MANIFEST_NAME))
+    pending = [item for item in items if args.force or not manifest.done(item['item'], item['fingerprint'])]
+    print(f"{len(items)} items, {len(items) - len(pending)} already done, {len(pending)} to run", file=sys.stderr)
+    try:
+        failures = run_items(worker, pending, manifest, args.workers) if pending else 0
+    except KeyboardInterrupt:
+        print('interrupted; rerun to resume', file=sys.stderr)
+        return 130
+    finally:
+        manifest.close()
+    if failures:
+        print(f"{failures} items failed; rerun to retry them", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,429 @@
+"""Benchmarks for the terrain and NDBI hot paths of the geovision package.
+
+Generates synthetic DEMs and B11/B8A band pairs (GeoTIFF and JPEG2000), times and
+memory-profiles each pipeline stage, drives the Flask endpoints with concurrent clients
+over HTTP, and writes the results as JSON. Pass --baseline to compare against an earlier
+run; the exit status is 1 when any benchmark is slower than the baseline by more than
+--threshold.
+
+    python benchmark.py --sizes 1024,2048 --output bench.json
+    python benchmark.py --sizes 1024,2048 --baseline bench.json --threshold 0.15
+    python benchmark.py --sizes 10240 --stages terrain --repeat 1 --output bench-tiled.json
+
+The default sizes fit in memory; the tiled terrain path only runs for sizes whose DEM
+exceeds MAX_IN_MEMORY_PIXELS (above 10000 per side), so pass one explicitly, as in the
+last line, to benchmark it.
+
+The app is configured through its usual environment variables (ANALYSIS_EXECUTOR,
+COG_STORAGE, ...), so the same settings can be benchmarked as are deployed.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+import rasterio.warp
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+try:
+    import resource
+except ImportError:  # not available on Windows; max_rss_mb is then reported as None
+    resource = None
+
+from geovision import indices, terrain
+from geovision.scheduler import ANALYSIS_EXECUTOR
+
+GENERATION_BLOCK = 1024
+SCENE_NAME = 'T31NEJ_20230115T101301'
+BAND_EXTENSIONS = {'JP2OpenJPEG': 'jp2', 'GTiff': 'tif'}
+
+
+# --- Synthetic data
+def synthetic_dem(path, size, seed=0):
+    """size x size float32 DEM of rolling hills plus noise, with a nodata corner, written block by block"""
+    rng = np.random.default_rng(seed)
+    phases = rng.uniform(0, 2 * np.pi, 4)
+    profile = dict(
+        driver='GTiff', width=size, height=size, count=1, dtype='float32', crs='EPSG:32631',
+        transform=from_origin(500000, 900000, 30, 30), nodata=-9999, tiled=True,
+        blockxsize=256, blockysize=256, compress='deflate', bigtiff='IF_SAFER'
+    )
+    x = np.arange(size, dtype=np.float32)
+    with rasterio.open(path, 'w', **profile) as dst:
+        for row in range(0, size, GENERATION_BLOCK):
+            height = min(GENERATION_BLOCK, size - row)
+            y = np.arange(row, row + height, dtype=np.float32)[:, None]
+            elevation = (500 + 200 * np.sin(x / size * 6 + phases[0]) * np.cos(y / size * 4 + phases[1])
+                         + 30 * np.sin(x / 57 + phases[2]) + 20 * np.cos(y / 43 + phases[3]))
+            elevation += rng.normal(0, 1, (height, size)).astype(np.float32)
+            if row == 0:
+                elevation[:min(16, height), :16] = -9999
+            dst.write(elevation.astype(np.float32), 1, window=Window(0, row, size, height))
+    return path
+
+
+def synthetic_bands(directory, size, driver, seed=0):
+    """B11/B8A uint16 pair at 20 m named like Sentinel-2 granules, placed over the app's default AOI; returns their paths"""
+    rng = np.random.default_rng(seed)
+    extension = BAND_EXTENSIONS[driver]
+    x = np.arange(size, dtype=np.float32)
+    paths = []
+    for band, base in (('B11', 1800), ('B8A', 2200)):
+        path = os.path.join(directory, f'{SCENE_NAME}_{band}_20m.{extension}')
+        # JPEG2000 is written in one go (the driver does not take windowed writes), so it is capped by memory
+        data = np.empty((size, size), dtype=np.uint16)
+        for row in range(0, size, GENERATION_BLOCK):
+            height = min(GENERATION_BLOCK, size - row)
+            y = np.arange(row, row + height, dtype=np.float32)[:, None]
+            values = base + 600 * np.sin(x / 61 + y / 97) + rng.integers(0, 300, (height, size))
+            data[row:row + height] = values.astype(np.uint16)
+        options = {'QUALITY': 100, 'REVERSIBLE': True} if driver == 'JP2OpenJPEG' else \
+            {'tiled': True, 'compress': 'deflate', 'bigtiff': 'IF_SAFER'}
+        with rasterio.open(path, 'w', driver=driver, width=size, height=size, count=1, dtype='uint16',
+                           crs='EPSG:32631', transform=from_origin(654000, 874000, 20, 20), **options) as dst:
+            dst.write(data, 1)
+        paths.append(path)
+    return paths
+
+
+# --- Measurement
+class Report:
+    """Collects benchmark records keyed by 'group/variant/size/stage' names"""
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.benchmarks = {}
+
+    def measure(self, name, fn, *args, repeat=None):
+        """Times fn(*args) over repeat runs; the first run also records the tracemalloc peak. Returns the last result"""
+        runs, peak, result = [], 0, None
+        for run in range(repeat or self.repeat):
+            result = None
+            gc.collect()
+            if run == 0:
+                tracemalloc.start()
+            start = time.perf_counter()
+            result = fn(*args)
+            runs.append(time.perf_counter() - start)
+            if run == 0:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        self.benchmarks[name] = {
+            'seconds': statistics.median(runs), 'min': min(runs), 'runs': runs,
+            'peak_mb': peak / 2 ** 20, 'max_rss_mb': max_rss_mb()
+        }
+        print(f"  {name:<44} {self.benchmarks[name]['seconds']:9.4f} s  peak {peak / 2 ** 20:9.1f} MB", flush=True)
+        return result
+
+    def record(self, name, metrics):
+        self.benchmarks[name] = metrics
+        print(f"  {name:<44} p50 {metrics['seconds']:7.4f} s  p95 {metrics['p95']:7.4f} s  "
+              f"{metrics['throughput_rps']:7.2f} req/s  errors {metrics['errors']}", flush=True)
+
+
+def max_rss_mb():
+    """High-water resident set size of this process in MB, or None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024  # macOS reports bytes, Linux kilobytes
+
+
+# --- Stage benchmarks
+def bench_terrain(report, size, workdir):
+    dem_path = synthetic_dem(os.path.join(workdir, f'dem_{size}.tif'), size)
+    output_dir = os.path.join(workdir, f'terrain_{size}')
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = f'terrain/{size}'
+
+    if terrain.TerrainAnalyzer(dem_path).needs_tiling():
+        report.measure(f'{prefix}/tiled', lambda: terrain.TerrainAnalyzer(dem_path).analyze_tiled(output_dir), repeat=1)
+
+    def load():
+        analyzer = terrain.TerrainAnalyzer(dem_path)
+        if not analyzer.load_dem():
+            raise RuntimeError(f'Could not load {dem_path}')
+        return analyzer
+    analyzer = report.measure(f'{prefix}/load', load)
+
+    report.measure(f'{prefix}/gradients', lambda: terrain.compute_derivatives(analyzer.elevation, analyzer.pixel_size))
+
+    def products():
+        analyzer.release_derivatives()
+        analyzer.calculate_slope()
+        analyzer.calculate_aspect()
+        analyzer.calculate_hillshade()
+        analyzer.calculate_curvature()
+    report.measure(f'{prefix}/products', products)
+    analyzer.release_derivatives()
+
+    report.measure(f'{prefix}/stats', analyzer.get_statistics)
+    report.measure(f'{prefix}/render_direct', lambda: analyzer.render_images(output_dir))
+    report.measure(f'{prefix}/render_figure', analyzer.generate_visualization)
+    report.measure(f'{prefix}/write', lambda: analyzer.save_products(output_dir))
+
+
+def bench_ndbi(report, size, workdir, drivers):
+    for driver in drivers:
+        variant = BAND_EXTENSIONS[driver]
+        directory = os.path.join(workdir, f'bands_{variant}_{size}')
+        os.makedirs(directory, exist_ok=True)
+        b11, b8a = synthetic_bands(directory, size, driver)
+        prefix = f'ndbi/{variant}/{size}'
+
+        def decode():
+            with rasterio.open(b11) as swir_src, rasterio.open(b8a) as nir_src:
+                return swir_src.read(1), nir_src.read(1), swir_src.transform, swir_src.crs
+        swir, nir, transform, crs = report.measure(f'{prefix}/decode', decode)
+
+        # Arrays go in as arguments, not closures, so each can be freed before the next stage
+        ndbi = report.measure(f'{prefix}/compute', indices.calculate_ndbi, swir, nir)
+        del swir, nir
+        ndbi_path = report.measure(
+            f'{prefix}/write', indices.save_ndbi_raster, ndbi, directory, 'bench', transform, size, size, crs)
+        del ndbi
+        report.measure(f'{prefix}/warp', lambda: indices.reproject_raster(
+            ndbi_path, os.path.join(directory, 'bench_warped.tif'), indices.TARGET_CRS))
+
+        if driver == 'JP2OpenJPEG':
+            # The production path: windowed decode, compute, warp and COG write in one pass over the whole scene
+            with rasterio.open(b11) as src:
+                aoi = rasterio.warp.transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+            expressions = {'ndbi': indices.BandExpression(indices.SPECTRAL_INDICES['ndbi'])}
+
+            def pipeline(band_ids):
+                return indices.process_index_scene_aois({'B11': b11, 'B8A': b8a}, expressions, 'bench',
+                                                        [(None, aoi, directory)], write_unprojected=False,
+                                                        band_ids=band_ids, decode_cache=True)
+            # Fresh band identities miss the decoded-tile cache every run; fixed ones hit it after the first
+            report.measure(f'{prefix}/pipeline', lambda: pipeline({'B11': uuid.uuid4().hex, 'B8A': uuid.uuid4().hex}))
+            cached_ids = {'B11': uuid.uuid4().hex, 'B8A': uuid.uuid4().hex}
+            pipeline(cached_ids)
+            report.measure(f'{prefix}/pipeline_cached', lambda: pipeline(cached_ids))
+
+
+# --- Endpoint benchmarks
+def http_request(url, method='GET', fields=None, files=None, headers=None):
+    """(status, body bytes, headers) using only the standard library; files is a list of (field, filename, bytes)"""
+    data = None
+    headers = dict(headers or {})
+    if files or fields:
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in (fields or {}).items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, filename, content in files or []:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                         f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        data = b''.join(parts)
+        headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=600) as response:
+            return response.status, response.read(), response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), e.headers
+
+
+def wait_for_job(status_url, poll=0.05):
+    while True:
+        status, body, _ = http_request(status_url)
+        state = json.loads(body).get('status') if status == 200 else 'failed'
+        if state in ('completed', 'failed'):
+            return state
+        time.sleep(poll)
+
+
+def run_clients(report, name, fn, requests, clients):
+    """Runs fn(i) for i in range(requests) on concurrent client threads; fn returns True on success"""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def client(i):
+        nonlocal errors
+        start = time.perf_counter()
+        ok = fn(i)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            errors += 0 if ok else 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, range(requests)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    report.record(f'endpoint/{name}', {
+        'seconds': statistics.median(latencies), 'p95': latencies[max(0, math.ceil(0.95 * len(latencies)) - 1)],
+        'max': latencies[-1], 'requests': requests, 'clients': clients,
+        'throughput_rps': requests / wall, 'errors': errors
+    })
+
+
+def bench_endpoints(report, workdir, size, clients, requests):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from geovision.app import create_app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app = create_app({'OUTPUT_FOLDER': os.path.join(workdir, 'output')})
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    dem_bytes = open(synthetic_dem(os.path.join(workdir, f'endpoint_dem_{size}.tif'), size, seed=1), 'rb').read()
+    nonce = time.time_ns() % 10 ** 6
+    completed = []
+
+    def terrain(i, cached):
+        # Distinct clip bounds miss the result cache; repeating one set measures cache hits
+        offset = 0 if cached else (nonce * requests + i) * 1e-3
+        fields = {'render': 'direct', 'clip_bounds': f'{500000 + offset},{900000 - size * 30},'
+                                                     f'{500000 + size * 30},{900000 - offset}'}
+        status, body, _ = http_request(f'{base}/api/analysis/upload', 'POST', fields,
+                                       [('file', 'dem.tif', dem_bytes)])
+        if status != 200:
+            return False
+        analysis_id = json.loads(body)['analysis_id']
+        ok = wait_for_job(f'{base}/api/analysis/{analysis_id}/status') == 'completed'
+        if ok:
+            completed.append(analysis_id)
+        return ok
+
+    run_clients(report, 'terrain_cold', lambda i: terrain(i, False), requests, clients)
+    terrain(0, True)
+    run_clients(report, 'terrain_cached', lambda i: terrain(i, True), requests, clients)
+
+    if completed:
+        lon, lat = rasterio.warp.transform('EPSG:32631', 'EPSG:4326', [500000 + size * 15], [900000 - size * 15])
+        z = 12
+        x = int((lon[0] + 180) / 360 * 2 ** z)
+        y = int((1 - np.arcsinh(np.tan(np.radians(lat[0]))) / np.pi) / 2 * 2 ** z)
+        tiles = [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+        def tile(i):
+            tx, ty = tiles[i % len(tiles)]
+            status, _, _ = http_request(f'{base}/tiles/{completed[0]}/slope/{z}/{tx}/{ty}.png')
+            return status == 200
+        run_clients(report, 'tiles', tile, requests * 4, clients)
+
+    band_dir = os.path.join(workdir, 'endpoint_bands')
+    os.makedirs(band_dir, exist_ok=True)
+    band_files = [('files', os.path.basename(path), open(path, 'rb').read())
+                  for path in synthetic_bands(band_dir, min(size, 2048), 'JP2OpenJPEG')]
+
+    def ndbi_job(i):
+        status, body, _ = http_request(f'{base}/ndbi/jobs', 'POST', files=band_files)
+        if status != 200:
+            return False
+        return wait_for_job(f'{base}/ndbi/jobs/{json.loads(body)["job_id"]}') == 'completed'
+    run_clients(report, 'ndbi_job', ndbi_job, max(1, requests // 2), clients)
+
+    def ndbi_plot(i):
+        status, _, _ = http_request(f'{base}/ndbi/plot')
+        return status == 200
+    run_clients(report, 'ndbi_plot', ndbi_plot, requests, clients)
+
+    server.shutdown()
+
+
+# --- Baseline comparison
+def compare(current, baseline, threshold):
+    """Prints current against baseline; returns the names slower than baseline by more than threshold"""
+    regressions = []
+    print(f"\n{'benchmark':<48} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name in sorted(set(current) & set(baseline)):
+        before, after = baseline[name]['seconds'], current[name]['seconds']
+        ratio = after / before if before else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print(f'{name:<48} {before:10.4f} {after:10.4f} {ratio:7.2f}{flag}')
+    for name in sorted(set(baseline) - set(current)):
+        print(f'{name:<48} not run')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1024,2048',
+                        help='comma-separated raster sizes in pixels per side; sizes above 10000 add the tiled '
+                             'terrain stage, which the defaults never reach')
+    parser.add_argument('--stages', default='terrain,ndbi,endpoints', help='any of terrain, ndbi, endpoints')
+    parser.add_argument('--formats', default='jp2,tif', help='band formats for the NDBI stages')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the median is reported')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent HTTP clients')
+    parser.add_argument('--requests', type=int, default=8, help='requests per endpoint scenario')
+    parser.add_argument('--endpoint-size', type=int, default=1024, help='DEM size for the endpoint scenarios')
+    parser.add_argument('--workdir', help='where synthetic data is written (default: a temporary directory)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    stages = set(args.stages.split(','))
+    drivers = [driver for driver, extension in BAND_EXTENSIONS.items() if extension in args.formats.split(',')]
+    workdir = args.workdir or tempfile.mkdtemp(prefix='geo-vision-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    report = Report(args.repeat)
+
+    for size in sizes:
+        print(f'size {size}', flush=True)
+        if 'terrain' in stages:
+            bench_terrain(report, size, workdir)
+        if 'ndbi' in stages:
+            bench_ndbi(report, size, workdir, drivers)
+    if 'endpoints' in stages:
+        print('endpoints', flush=True)
+        bench_endpoints(report, workdir, args.endpoint_size, args.clients, args.requests)
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'rasterio': rasterio.__version__, 'gdal': rasterio.__gdal_version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'sizes': sizes,
+            'repeat': args.repeat, 'executor': ANALYSIS_EXECUTOR, 'max_rss_mb': max_rss_mb()
+        },
+        'benchmarks': report.benchmarks
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ('executor', 'cpu_count', 'gdal', 'repeat'):
+            if baseline['meta'].get(key) != results['meta'][key]:
+                print(f"warning: baseline {key} {baseline['meta'].get(key)!r} differs from this run's "
+                      f"{results['meta'][key]!r}")
+        regressions = compare(report.benchmarks, baseline['benchmarks'], args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
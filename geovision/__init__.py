@@ -0,0 +1,8 @@
+"""Terrain analysis and Sentinel-2 spectral indices.
+
+geovision.app.create_app builds the HTTP API (python geo-vision.py); batch.py runs them
+headless. The compute modules (terrain, indices, change, zonal) do not import Flask, and
+importing any module creates no folders, job store or caches: those are made on first use.
+"""
+import warnings
+warnings.filterwarnings('ignore')
@@ -0,0 +1,1042 @@
+"""The HTTP API: terrain analysis, spectral index and change detection jobs, tiles and metrics"""
+from flask import Blueprint, Flask, current_app, request, jsonify, send_file, send_from_directory, g
+from werkzeug.utils import secure_filename
+import rasterio
+from PIL import Image
+import os
+import uuid
+import base64
+import io
+from io import BytesIO
+import json
+import time
+from flask_cors import CORS
+import re
+from rasterio.errors import CRSError
+import shutil
+import functools
+import csv
+
+from .caches import get_result_cache
+from .change import (CHANGE_BUILT_UP_THRESHOLD, CHANGE_MIN_DIFFERENCE, CHANGE_PRODUCTS, available_index_years,
+                     run_change_detection)
+from .config import OUTPUT_FOLDER, RESULTS_FOLDER, UPLOAD_FOLDER
+from .events import JOB_EVENTS_KEEPALIVE, JOB_EVENTS_POLL, JOB_TERMINAL_EVENTS, job_events, job_results_path
+from .indices import (AOI_NAME_PATTERN, INDEX_NAME_PATTERN, REQUEST_ID_PATTERN, SPECTRAL_INDICES, SceneCatalogue,
+                      aoi_output_folder, extract_year_from_jp2_filename, index_output_path, parse_aois,
+                      parse_index_specs, parse_resolution, process_index_scenes)
+from .jobs import (aoi_results, finish_analysis_job, finish_index_batch, mark_job_running, run_index_batch,
+                   schedule_analysis)
+from .metrics import metrics, peak_rss_bytes
+from .plots import (NDBI_PLOT_DPI, PLOT_CACHE_FOLDER, ndbi_plot_etag, plot_cache_scope, remove_stale,
+                    render_ndbi_composite, write_atomic)
+from .rasters import PRODUCT_VALUE_RANGES, RENDER_FORMAT, RENDER_MAX_SIZE, RENDER_MODE
+from .scheduler import QueueFullError, current_scheduler, get_scheduler
+from .stores import get_job_store
+from .terrain import TERRAIN_ANALYSIS_PARAMS, TERRAIN_PRODUCTS, TERRAIN_PROGRESSIVE, TERRAIN_RASTERS, analysis_cache_key
+from .tiles import TILE_MAX_AGE, render_tile, terrain_value_range, tile_cache, tile_etag
+from .uploads import UploadRangeError, UploadSession, save_upload
+from .zonal import (ZONAL_MAX_ZONES, ZONAL_STATISTICS, ZONE_EXTENSIONS, load_zones, zonal_statistics, zonal_table,
+                    zone_ids)
+
+# --- Flask App Configuration ---
+api = Blueprint('geovision', __name__)
+
+ALLOWED_EXTENSIONS = {'tif', 'tiff', 'img', 'asc', 'png', 'jpg', 'jpeg', 'jp2'}
+
+def create_app(config=None):
+    """Builds the Flask app serving the API; config overrides the defaults below.
+
+    The folders are created here rather than on import, so importing the package (as batch
+    workers and spawned analysis workers do) leaves the filesystem alone.
+    """
+    app = Flask(__name__)
+    CORS(app)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['RESULTS_FOLDER'] = RESULTS_FOLDER
+    app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
+    app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024 * 1024  # 1GB max file size
+    app.config.update(config or {})
+    for folder in ('UPLOAD_FOLDER', 'RESULTS_FOLDER', 'OUTPUT_FOLDER'):
+        os.makedirs(app.config[folder], exist_ok=True)
+    app.register_blueprint(api)
+    return app
+
+def allowed_file(filename):
+    """Check if file has an allowed extension"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# --- API Endpoints ---
+@api.route('/')
+def index():
+    return jsonify({
+        'name': 'Combined Terrain & NDBI Analysis API', 'version': '1.0.0',
+        'endpoints': {
+            'POST /api/analysis/upload': 'Upload DEM and run terrain analysis (progressive=1 publishes a quick preview first)',
+            'GET /api/analysis/<id>/status': 'Get terrain analysis status and the available result tier',
+            'GET /api/analysis/<id>/results': 'Get terrain analysis results (the preview tier, with 202, until complete)',
+            'GET /api/analysis/<id>/events': 'Server-Sent Events stream of job progress (also under /ndbi/change/<id>, /indices/jobs/<id>)',
+            'GET /api/analysis/<id>/images/<file>': 'Get one rendered terrain product image (render=direct)',
+            'GET /api/analysis/cache': 'Get terrain result cache hit/miss counters',
+            'POST /api/uploads': 'Start a resumable chunked upload',
+            'PUT /api/uploads/<id>': 'Send the next chunk of an upload',
+            'GET /api/uploads/<id>': 'Get how many bytes of an upload were received',
+            'POST /api/uploads/<id>/complete': 'Finalise an upload, optionally starting terrain analysis',
+            'POST /ndbi/upload': 'Upload Sentinel-2 bands and calculate NDBI over one or many areas of interest (aoi, aois)',
+            'GET /ndbi/<year>': 'Download NDBI GeoTIFF for a given year (?aoi=<name>&request=<id> for a named AOI)',
+            'GET /ndbi/plot': 'Get a combined NDBI plot as a Base64 image (?dpi= for a lighter one)',
+            'POST /ndbi/upload-multiple': 'Alternative endpoint for NDBI upload',
+            'POST /ndbi/jobs': 'Upload Sentinel-2 bands and calculate NDBI as a background job',
+            'GET /ndbi/jobs/<id>': 'Get NDBI job status, per-scene progress and results',
+            'POST /indices/jobs': 'Upload Sentinel-2 bands and calculate spectral indices (built-in or band math) as a job',
+            'GET /indices/jobs/<id>': 'Get spectral index job status, per-scene progress and results',
+            'GET /indices/<name>/<year>': 'Download a spectral index GeoTIFF for a given year',
+            'POST /ndbi/change': 'Run change detection (difference, trend, change classes) over the NDBI years',
+            'GET /ndbi/change/<id>': 'Get change detection status, statistics and class areas',
+            'GET /ndbi/change/<id>/<product>.tif': 'Download a change detection GeoTIFF',
+            'POST /api/analysis/<id>/zonal': 'Per-zone terrain statistics for uploaded GeoJSON/GeoPackage polygons',
+            'POST /indices/<name>/zonal': 'Per-zone statistics of a spectral index (POST /ndbi/zonal for NDBI) by year',
+            'GET /tiles/<analysis_id>/<product>/<z>/<x>/<y>.png': 'XYZ map tile of a terrain product',
+            'GET /tiles/<index>/<year>/<z>/<x>/<y>.png': 'XYZ map tile of a built-in spectral index (ndbi, ndvi, ndwi) year',
+            'GET /metrics': 'Prometheus metrics: request and job latencies, queue depth, cache hit rates, active jobs'
+        }
+    })
+
+# --- Terrain Analysis Endpoints ---
+@api.route('/api/analysis/upload', methods=['POST'])
+def upload_terrain():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    if file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file'}), 400
+    
+    try:
+        clip_bounds = parse_clip_bounds(request.form)
+    except ValueError:
+        return jsonify({'error': 'Invalid clip_bounds format. Use: min_x,min_y,max_x,max_y'}), 400
+    
+    try:
+        priority = int(request.form.get('priority', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid priority. Use an integer; higher runs first'}), 400
+    
+    try:
+        render_mode = parse_render_mode(request.form)
+    except ValueError:
+        return jsonify({'error': "Invalid render mode. Use 'figure' or 'direct'"}), 400
+    progressive = parse_progressive(request.form)
+    
+    analysis_id = str(uuid.uuid4())
+    filename = secure_filename(file.filename)
+    # Queued jobs may wait a while, so keep same-named uploads from overwriting each other
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f'{analysis_id}_{filename}')
+    
+    try:
+        content_hash = save_upload(file, file_path)
+    except Exception as e:
+        return jsonify({'error': f'Failed to save file: {str(e)}'}), 500
+
+    return start_terrain_analysis(analysis_id, file_path, content_hash, clip_bounds, priority, render_mode, progressive)
+
+def parse_clip_bounds(form):
+    """clip_bounds form field as [min_x, min_y, max_x, max_y], or None; raises ValueError"""
+    if 'clip_bounds' not in form:
+        return None
+    clip_bounds = [float(x.strip()) for x in form['clip_bounds'].split(',')]
+    if len(clip_bounds) != 4:
+        raise ValueError
+    return clip_bounds
+
+def parse_render_mode(form):
+    """render form field ('figure' or 'direct'), defaulting to RENDER_MODE; raises ValueError"""
+    render_mode = form.get('render', RENDER_MODE)
+    if render_mode not in ('figure', 'direct'):
+        raise ValueError
+    return render_mode
+
+def parse_progressive(form):
+    """progressive form field: '1' publishes a preview tier before the full results (default TERRAIN_PROGRESSIVE)"""
+    return form.get('progressive', '1' if TERRAIN_PROGRESSIVE else '0') == '1'
+
+def start_terrain_analysis(analysis_id, file_path, content_hash, clip_bounds, priority=0, render_mode=RENDER_MODE,
+                           progressive=False):
+    """Answers from the result cache or queues the analysis; returns the Flask response"""
+    get_job_store().create(analysis_id)
+    
+    params = dict(TERRAIN_ANALYSIS_PARAMS, render=render_mode)
+    if render_mode == 'direct':
+        params.update(format=RENDER_FORMAT, max_size=RENDER_MAX_SIZE)
+    cache_key = analysis_cache_key(content_hash, clip_bounds, params)
+    cached_results = get_result_cache().get(cache_key, get_job_store().job_dir(analysis_id))
+    if cached_results is not None:
+        os.remove(file_path)
+        get_job_store().set_results(analysis_id, cached_results)
+        return jsonify({
+            'analysis_id': analysis_id,
+            'status': 'completed',
+            'cached': True,
+            'message': 'Identical analysis found in cache. Results are available now.'
+        }), 200
+    
+    try:
+        schedule_analysis(analysis_id, file_path, clip_bounds, priority, cache_key, render_mode, content_hash, progressive)
+    except QueueFullError as e:
+        get_job_store().delete(analysis_id)
+        os.remove(file_path)
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    
+    return jsonify({
+        'analysis_id': analysis_id,
+        'status': 'accepted',
+        'cached': False,
+        'progressive': progressive,
+        'message': 'Analysis request accepted. Use the status endpoint to check progress.'
+    }), 200
+
+@api.route('/api/analysis/cache', methods=['GET'])
+def get_analysis_cache_stats():
+    return jsonify(get_result_cache().stats()), 200
+
+@api.route('/api/analysis/<analysis_id>/status', methods=['GET'])
+def get_analysis_status(analysis_id):
+    job = get_job_store().get(analysis_id)
+    if job is None:
+        return jsonify({'error': 'Analysis not found'}), 404
+        
+    job_status = job['status']
+    response = {'analysis_id': analysis_id, 'status': job_status}
+    
+    if job_status == 'pending':
+        scheduler = get_scheduler()
+        response['queue_position'] = scheduler.queue_position(analysis_id)
+        response['queue_depth'] = scheduler.queue_depth()
+    elif job_status == 'failed':
+        response['error'] = job['error'] or 'Unknown error'
+    if job_status in ('completed', 'failed') and job['progress']:
+        response['instrumentation'] = job['progress']
+    # Resolution tier the results endpoint serves: 'preview' (decimated) until the 'full' results replace it
+    if job_status == 'completed':
+        response['tier'] = 'full'
+    elif job_status != 'failed' and get_job_store().has_preview(analysis_id):
+        response['tier'] = 'preview'
+    else:
+        response['tier'] = None
+        
+    return jsonify(response), 200
+
+@api.route('/api/analysis/<analysis_id>/results', methods=['GET'])
+def get_analysis_results(analysis_id):
+    job = get_job_store().get(analysis_id)
+    if job is None:
+        return jsonify({'error': 'Analysis not found'}), 404
+    
+    if job['status'] != 'completed':
+        response = {
+            'analysis_id': analysis_id,
+            'status': job['status'],
+            'message': 'Analysis is not yet complete. Check the status endpoint.'
+        }
+        preview = get_job_store().get_preview(analysis_id) if job['status'] != 'failed' else None
+        if preview is not None:
+            # Still 202, so pollers keep waiting for the full tier
+            response.update(preview)
+            response['message'] = 'Preview from a decimated read; full-resolution results will replace it.'
+            if 'images' in preview:
+                response['images'] = analysis_image_urls(analysis_id, preview['images'], 'preview')
+        return jsonify(response), 202
+    
+    results = get_job_store().get_results(analysis_id)
+    if results is None:
+        return jsonify({'error': 'Analysis results have expired'}), 404
+    results['tier'] = 'full'
+    if os.path.exists(os.path.join(get_job_store().job_dir(analysis_id), f'{TERRAIN_PRODUCTS[0]}.tif')):
+        results['tiles'] = f"{request.host_url}tiles/{analysis_id}/{{product}}/{{z}}/{{x}}/{{y}}.png"
+    if 'images' in results:
+        results['images'] = analysis_image_urls(analysis_id, results['images'])
+    return jsonify(results), 200
+
+def analysis_image_urls(analysis_id, images, tier=None):
+    query = f'?tier={tier}' if tier else ''
+    return {product: f"{request.host_url}api/analysis/{analysis_id}/images/{filename}{query}"
+            for product, filename in images.items()}
+
+@api.route('/api/analysis/<analysis_id>/images/<filename>', methods=['GET'])
+def get_analysis_image(analysis_id, filename):
+    """One rendered product image; ?size=N returns a thumbnail no larger than N pixels, ?tier=preview a preview image"""
+    if get_job_store().get(analysis_id) is None:
+        return jsonify({'error': 'Analysis not found'}), 404
+    job_dir = get_job_store().job_dir(analysis_id)
+    images_dir = os.path.join(job_dir, 'preview', 'images') if request.args.get('tier') == 'preview' else \
+        os.path.join(job_dir, 'images')
+    if not os.path.isfile(os.path.join(images_dir, secure_filename(filename))):
+        return jsonify({'error': 'Image not found'}), 404
+    size = request.args.get('size', type=int)
+    if size:
+        with Image.open(os.path.join(images_dir, secure_filename(filename))) as image:
+            image_format = image.format
+            image.thumbnail((size, size))
+            buffer = BytesIO()
+            image.save(buffer, format=image_format)
+        buffer.seek(0)
+        return send_file(buffer, mimetype=f'image/{image_format.lower()}', max_age=86400)
+    return send_from_directory(images_dir, secure_filename(filename), max_age=86400)
+
+# --- Chunked Upload Endpoints ---
+@api.route('/api/uploads', methods=['POST'])
+def create_upload():
+    filename = request.form.get('filename', '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid filename'}), 400
+    try:
+        total_size = int(request.form['total_size']) if 'total_size' in request.form else None
+    except ValueError:
+        return jsonify({'error': 'Invalid total_size'}), 400
+    session = UploadSession.create(current_app.config['UPLOAD_FOLDER'], filename, total_size)
+    return jsonify({'upload_id': session.upload_id, 'received': 0}), 201
+
+@api.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    session = UploadSession.load(current_app.config['UPLOAD_FOLDER'], upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'upload_id': upload_id, 'received': session.received, 'total_size': session.total_size}), 200
+
+@api.route('/api/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+def upload_chunk(upload_id):
+    """Raw chunk body; 'Content-Range: bytes start-end/total' places it, otherwise it is appended"""
+    session = UploadSession.load(current_app.config['UPLOAD_FOLDER'], upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = session.received
+    length = None
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range.strip())
+        if not match:
+            return jsonify({'error': 'Invalid Content-Range. Use: bytes start-end/total'}), 400
+        offset, end = int(match.group(1)), int(match.group(2))
+        total = None if match.group(3) == '*' else int(match.group(3))
+        if end < offset:
+            return jsonify({'error': 'Invalid Content-Range: end is before start'}), 400
+        length = end - offset + 1
+        if request.content_length is not None and request.content_length != length:
+            return jsonify({'error': f'Content-Range covers {length} bytes but Content-Length is '
+                                     f'{request.content_length}'}), 400
+        if total is not None and session.total_size is not None and total != session.total_size:
+            return jsonify({'error': f'Content-Range total {total} differs from the declared total_size '
+                                     f'{session.total_size}'}), 416
+        limit = session.total_size if session.total_size is not None else total
+        if limit is not None and end >= limit:
+            return jsonify({'error': f'Content-Range ends past the {limit}-byte upload'}), 416
+    elif session.total_size is not None and request.content_length is not None and \
+            offset + request.content_length > session.total_size:
+        return jsonify({'error': f'Chunk runs past the {session.total_size}-byte upload'}), 416
+    try:
+        received = session.write_chunk(request.stream, offset, length)
+    except FileNotFoundError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except UploadRangeError as e:
+        return jsonify({'error': str(e), 'received': session.received}), 400 if length is not None else 416
+    except ValueError as e:
+        return jsonify({'error': str(e), 'received': session.received}), 409
+    return jsonify({'upload_id': upload_id, 'received': received}), 200
+
+@api.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Finalises an upload; with analysis=terrain the terrain analysis starts on the file immediately"""
+    session = UploadSession.load(current_app.config['UPLOAD_FOLDER'], upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    if session.total_size is not None and session.received != session.total_size:
+        return jsonify({'error': 'Upload is incomplete', 'received': session.received,
+                        'total_size': session.total_size}), 409
+
+    analysis = request.form.get('analysis')
+    if analysis not in (None, 'terrain'):
+        return jsonify({'error': f'Unknown analysis type: {analysis}'}), 400
+    try:
+        clip_bounds = parse_clip_bounds(request.form)
+    except ValueError:
+        return jsonify({'error': 'Invalid clip_bounds format. Use: min_x,min_y,max_x,max_y'}), 400
+    try:
+        priority = int(request.form.get('priority', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid priority. Use an integer; higher runs first'}), 400
+    try:
+        render_mode = parse_render_mode(request.form)
+    except ValueError:
+        return jsonify({'error': "Invalid render mode. Use 'figure' or 'direct'"}), 400
+    progressive = parse_progressive(request.form)
+
+    try:
+        file_path, content_hash = session.finalize()
+    except FileNotFoundError:
+        return jsonify({'error': 'Upload not found'}), 404
+    expected = request.form.get('sha256')
+    if expected and expected.lower() != content_hash:
+        os.remove(file_path)
+        return jsonify({'error': 'Checksum mismatch', 'sha256': content_hash}), 422
+
+    if analysis == 'terrain':
+        return start_terrain_analysis(str(uuid.uuid4()), file_path, content_hash, clip_bounds, priority, render_mode,
+                                      progressive)
+    return jsonify({'upload_id': upload_id, 'filename': session.filename,
+                    'size': os.path.getsize(file_path), 'sha256': content_hash}), 200
+
+# --- NDBI Endpoints ---
+def request_band_files():
+    """The uploaded files of an NDBI request ('files' or 'file'), or None when none were selected"""
+    if 'files' in request.files:
+        files = request.files.getlist('files')
+    else:
+        files = [request.files['file']]
+    if not files or all(file.filename == '' for file in files):
+        return None
+    return files
+
+def save_band_uploads(files, upload_folder):
+    """Saves the .jp2 files of an upload into upload_folder; returns {path: SHA-256 of the content}"""
+    uploaded_files = {}
+    for file in files:
+        if file and file.filename.endswith('.jp2'):
+            temp_file_path = os.path.join(upload_folder, secure_filename(file.filename))
+            uploaded_files[temp_file_path] = save_upload(file, temp_file_path)
+    return uploaded_files
+
+def plan_index_scenes(uploaded_files, indices):
+    """Scenes of an upload having every band the indices need; raises ValueError with a message for the client.
+
+    uploaded_files is the {path: content hash} of save_band_uploads; the hashes go into each
+    scene's band_ids so decoded pixels are shared with later uploads of the same granule.
+    """
+    catalogue = SceneCatalogue()
+    for file_path in uploaded_files:
+        try:
+            catalogue.ingest(file_path)
+        except rasterio.errors.RasterioIOError:
+            raise ValueError(f"Unreadable band file: {os.path.basename(file_path)}")
+
+    needed = sorted(set().union(*(expression.bands for expression in indices.values())))
+    scenes = [
+        {'scene_id': scene['scene_id'], 'year': scene['year'],
+         'bands': {band: scene['bands'][band]['path'] for band in needed}}
+        for scene in catalogue.scenes() if all(band in scene['bands'] for band in needed)
+    ]
+    if scenes:
+        return [dict(scene, band_ids=band_ids(scene['bands'], uploaded_files)) for scene in scenes]
+
+    band_files = {band: catalogue.files(band) for band in needed}
+    index_names = ', '.join(name.upper() for name in indices)
+    
+    if not any(band_files.values()):
+        raise ValueError(f"No {' or '.join(needed)} bands found. {index_names} requires these specific bands.")
+    
+    if all(len(files) == 1 for files in band_files.values()):
+        year = extract_year_from_jp2_filename(os.path.basename(band_files[needed[0]][0]))
+        bands = {band: files[0] for band, files in band_files.items()}
+        return [{
+            'scene_id': f'manual_{year}',
+            'year': year,
+            'bands': bands,
+            'band_ids': band_ids(bands, uploaded_files)
+        }]
+    raise ValueError(f"Please upload matching {', '.join(needed)} band files for {index_names} calculation.")
+
+def band_ids(bands, uploaded_files):
+    return {band: uploaded_files[path] for band, path in bands.items() if path in uploaded_files}
+
+def index_folder(aoi=None, request_id=None):
+    """Output folder of an AOI named by a request (None for the default AOI); raises ValueError for a bad name"""
+    if aoi is not None and not AOI_NAME_PATTERN.fullmatch(aoi):
+        raise ValueError(f"Invalid AOI name: {aoi}")
+    if request_id is not None and not REQUEST_ID_PATTERN.fullmatch(request_id):
+        raise ValueError(f"Invalid request id: {request_id}")
+    return aoi_output_folder(current_app.config['OUTPUT_FOLDER'], aoi, request_id)
+
+def index_download_url(name, year, aoi=None, request_id=None):
+    query = f"?aoi={aoi}&request={request_id}" if aoi else ''
+    if name == 'ndbi':
+        return f"{request.host_url}ndbi/{year}{query}"
+    return f"{request.host_url}indices/{name}/{year}{query}"
+
+@api.route('/ndbi/upload', methods=['POST'])
+def process_data():
+    if 'file' not in request.files and 'files' not in request.files:
+        return jsonify({"error": "No file part in the request"}), 400
+
+    files = request_band_files()
+    if files is None:
+        return jsonify({"error": "No selected files"}), 400
+    try:
+        aois = parse_aois(request.form)
+        resolution = parse_resolution(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # A directory per request keeps same-named uploads of concurrent requests apart
+    request_id = str(uuid.uuid4())
+    upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], f'ndbi_{request_id}')
+    os.makedirs(upload_dir)
+    try:
+        uploaded_files = save_band_uploads(files, upload_dir)
+        if not uploaded_files:
+            return jsonify({"error": "No valid JP2 files uploaded"}), 400
+
+        indices = parse_index_specs('ndbi')
+        try:
+            scenes = plan_index_scenes(uploaded_files, indices)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        outcomes = process_index_scenes(scenes, indices, current_app.config['OUTPUT_FOLDER'], aois=aois,
+                                        resolution=resolution, request_id=request_id)
+        processed_years = [scene['year'] for scene, outputs, error in outcomes if outputs is not None]
+        errors = [error for scene, outputs, error in outcomes if error is not None]
+
+        if processed_years:
+            aoi_entries = aoi_results(aois, outcomes)
+            response = {
+                "message": f"Processing complete for years: {', '.join(processed_years)}.",
+                "processed_years": processed_years,
+                "request_id": request_id,
+                "aois": aoi_entries,
+                "download_urls": [index_download_url('ndbi', year, entry['name'], request_id)
+                                  for entry in aoi_entries for year in entry['processed_years']]
+            }
+            if errors:
+                response["failed_scenes"] = {scene['scene_id']: str(error) for scene, _, error in outcomes if error is not None}
+            return jsonify(response), 200
+        elif errors:
+            return jsonify({"error": str(errors[0])}), 500
+        else:
+            return jsonify({"error": "No valid band pairs could be processed"}), 500
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+@api.route('/ndbi/jobs', methods=['POST'])
+@api.route('/indices/jobs', methods=['POST'])
+def create_index_job():
+    """Queues a batch job computing spectral indices for every scene in the upload; scenes run in parallel.
+
+    The indices form field lists built-in names and/or name=expression band math, e.g.
+    'ndvi,ndbi,ratio=B11/B8A'; it defaults to ndbi. Jobs wait in the analysis scheduler's
+    queue (optional priority field); a full queue is refused with 429.
+    """
+    if 'file' not in request.files and 'files' not in request.files:
+        return jsonify({"error": "No file part in the request"}), 400
+
+    files = request_band_files()
+    if files is None:
+        return jsonify({"error": "No selected files"}), 400
+
+    try:
+        indices = parse_index_specs(request.form.get('indices', 'ndbi'))
+        aois = parse_aois(request.form)
+        resolution = parse_resolution(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        priority = int(request.form.get('priority', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid priority"}), 400
+
+    job_id = str(uuid.uuid4())
+    upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], f'ndbi_{job_id}')
+    os.makedirs(upload_dir)
+    try:
+        uploaded_files = save_band_uploads(files, upload_dir)
+        if not uploaded_files:
+            raise ValueError("No valid JP2 files uploaded")
+        scenes = plan_index_scenes(uploaded_files, indices)
+    except ValueError as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return jsonify({"error": f"Failed to save files: {str(e)}"}), 500
+
+    get_job_store().create(job_id)
+    try:
+        # The batch fans its scenes out to the scene pool, so it holds a scheduler slot in this process
+        get_scheduler().submit(
+            job_id, run_index_batch,
+            (job_id, scenes, indices, upload_dir, current_app.config['OUTPUT_FOLDER'], aois, resolution),
+            priority=priority, on_done=finish_index_batch, local=True
+        )
+    except QueueFullError as e:
+        get_job_store().delete(job_id)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+
+    return jsonify({
+        'job_id': job_id,
+        'status': 'accepted',
+        'scenes': len(scenes),
+        'indices': list(indices),
+        'aois': [name for name, _ in aois],
+        'message': 'Index job accepted. Use the job endpoint to check progress.'
+    }), 200
+
+@api.route('/ndbi/jobs/<job_id>', methods=['GET'])
+@api.route('/indices/jobs/<job_id>', methods=['GET'])
+def get_index_job(job_id):
+    job = get_job_store().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    response = {'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'pending':
+        response['queue_position'] = get_scheduler().queue_position(job_id)
+    if job['progress'] is not None:
+        response['progress'] = job['progress']
+    if job['status'] == 'failed':
+        response['error'] = job['error'] or 'Unknown error'
+    elif job['status'] == 'completed':
+        results = get_job_store().get_results(job_id)
+        if results is None:
+            return jsonify({'error': 'Job results have expired'}), 404
+        response.update(results)
+        # Jobs stored before AOIs existed only wrote the default one
+        aoi_entries = results.get('aois') or [{'name': None, 'processed_years': results['processed_years']}]
+        response['download_urls'] = [
+            index_download_url(name, year, entry['name'], job_id)
+            for entry in aoi_entries for name in results['indices'] for year in entry['processed_years']
+        ]
+    return jsonify(response), 200
+
+@api.route('/ndbi/<year>', methods=['GET'])
+def get_ndbi_file(year):
+    return get_index_file('ndbi', year)
+
+@api.route('/indices/<name>/<year>', methods=['GET'])
+def get_index_file(name, year):
+    if not INDEX_NAME_PATTERN.fullmatch(name):
+        return jsonify({"error": "File not found."}), 404
+    try:
+        folder = index_folder(request.args.get('aoi'), request.args.get('request'))
+    except ValueError:
+        return jsonify({"error": "File not found."}), 404
+    filename = os.path.basename(index_output_path(folder, name, secure_filename(year)))
+    file_path = os.path.join(folder, filename)
+    
+    if os.path.exists(file_path):
+        return send_from_directory(folder, filename, as_attachment=True, mimetype='image/tiff')
+    else:
+        return jsonify({"error": "File not found."}), 404
+
+@api.route('/ndbi/plot', methods=['GET'])
+def plot_all_ndbi_data():
+    """Combined NDBI plot as Base64; served from cache and answered with 304 while no year has changed.
+
+    The optional aoi and request query parameters plot a named AOI instead of the default one;
+    dpi lowers the resolution from NDBI_PLOT_DPI.
+    """
+    aoi = request.args.get('aoi')
+    request_id = request.args.get('request')
+    try:
+        folder = index_folder(aoi, request_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    dpi = request.args.get('dpi', str(NDBI_PLOT_DPI))
+    if not dpi.isdigit() or not 10 <= int(dpi) <= NDBI_PLOT_DPI:
+        return jsonify({"error": f"dpi must be an integer from 10 to {NDBI_PLOT_DPI}"}), 400
+    dpi = int(dpi)
+    ndbi_data_list = [
+        {'year': year, 'reprojected_path': path}
+        for year, path in available_index_years(folder, 'ndbi').items()
+    ]
+
+    if not ndbi_data_list:
+        return jsonify({"error": "No NDBI files found to plot. Please upload and process data first."}), 404
+
+    etag = ndbi_plot_etag(ndbi_data_list, aoi, dpi)
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        prefix = f"composite_{plot_cache_scope(aoi, request_id)}_{dpi}"
+        composite_path = os.path.join(PLOT_CACHE_FOLDER, f'{prefix}_{etag}.png')
+        try:
+            with open(composite_path, 'rb') as f:
+                composite = f.read()
+            metrics.inc('geovision_cache_requests_total', cache='ndbi_plot', result='hit')
+        except FileNotFoundError:
+            metrics.inc('geovision_cache_requests_total', cache='ndbi_plot', result='miss')
+            composite = render_ndbi_composite(ndbi_data_list, aoi, request_id, dpi)
+            write_atomic(composite_path, composite)
+            remove_stale(os.path.join(PLOT_CACHE_FOLDER, f'{prefix}_*.png'), composite_path)
+        base64_image = base64.b64encode(composite).decode('utf-8')
+        response = jsonify({"image": base64_image, "message": "Plot generated successfully."})
+    response.set_etag(etag)
+    # Clients may keep the plot but must revalidate, since a new upload changes it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@api.route('/ndbi/change', methods=['POST'])
+def create_change_detection():
+    """Queues change detection over the stored per-year rasters of an index (ndbi by default).
+
+    Optional form fields: years (comma-separated, at least two; default all), index, aoi and
+    request (a named AOI and the request that wrote it), built_up_threshold, min_difference and priority.
+    """
+    index_name = request.form.get('index', 'ndbi').lower()
+    if not INDEX_NAME_PATTERN.fullmatch(index_name):
+        return jsonify({'error': 'Invalid index name'}), 400
+    try:
+        folder = index_folder(request.form.get('aoi') or None, request.form.get('request') or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    available = available_index_years(folder, index_name)
+    years = [year.strip() for year in request.form['years'].split(',')] if 'years' in request.form else list(available)
+    missing = [year for year in years if year not in available]
+    if missing:
+        return jsonify({'error': f"No {index_name.upper()} raster for years: {', '.join(missing)}",
+                        'available_years': list(available)}), 404
+    years = sorted(set(years))
+    if len(years) < 2:
+        return jsonify({'error': 'Change detection needs at least two years', 'available_years': list(available)}), 400
+    try:
+        built_up_threshold = float(request.form.get('built_up_threshold', CHANGE_BUILT_UP_THRESHOLD))
+        min_difference = float(request.form.get('min_difference', CHANGE_MIN_DIFFERENCE))
+        priority = int(request.form.get('priority', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid threshold or priority'}), 400
+
+    job_id = str(uuid.uuid4())
+    get_job_store().create(job_id)
+    rasters = [(year, available[year]) for year in years]
+    try:
+        get_scheduler().submit(
+            job_id, run_change_detection,
+            (rasters, get_job_store().job_dir(job_id), built_up_threshold, min_difference, job_id),
+            priority=priority, on_start=mark_job_running,
+            on_done=functools.partial(finish_analysis_job, kind='change')
+        )
+    except QueueFullError as e:
+        get_job_store().delete(job_id)
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+
+    return jsonify({
+        'job_id': job_id,
+        'status': 'accepted',
+        'years': years,
+        'message': 'Change detection accepted. Use the change endpoint to check progress.'
+    }), 200
+
+@api.route('/ndbi/change/<job_id>', methods=['GET'])
+def get_change_detection(job_id):
+    job = get_job_store().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Change detection job not found'}), 404
+
+    response = {'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'pending':
+        response['queue_position'] = get_scheduler().queue_position(job_id)
+    elif job['status'] == 'failed':
+        response['error'] = job['error'] or 'Unknown error'
+        if job['progress']:
+            response['instrumentation'] = job['progress']
+    elif job['status'] == 'completed':
+        results = get_job_store().get_results(job_id)
+        if results is None:
+            return jsonify({'error': 'Change detection results have expired'}), 404
+        response.update(results)
+        response['download_urls'] = {
+            product: f"{request.host_url}ndbi/change/{job_id}/{product}.tif" for product in results['products']
+        }
+    return jsonify(response), 200
+
+@api.route('/ndbi/change/<job_id>/<product>.tif', methods=['GET'])
+def get_change_product(job_id, product):
+    job = get_job_store().get(job_id)
+    if job is None or product not in CHANGE_PRODUCTS:
+        return jsonify({'error': 'File not found.'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'error': 'Change detection is not yet complete'}), 409
+    return send_from_directory(get_job_store().job_dir(job_id), f'{product}.tif', as_attachment=True,
+                               mimetype='image/tiff')
+
+# --- Zonal Statistics Endpoints ---
+ZONAL_TERRAIN_PRODUCTS = ('elevation', 'slope', 'aspect', 'curvature')  # hillshade is a rendering, not a measure
+
+@api.route('/api/analysis/<analysis_id>/zonal', methods=['POST'])
+def get_terrain_zonal_statistics(analysis_id):
+    """Zonal statistics of a completed terrain analysis; optional products field (default: elevation, slope, aspect, curvature)"""
+    job = get_job_store().get(analysis_id)
+    if job is None:
+        return jsonify({'error': 'Analysis not found'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'error': 'Analysis is not yet complete'}), 409
+    job_dir = get_job_store().job_dir(analysis_id)
+    available = [product for product in TERRAIN_RASTERS if os.path.exists(os.path.join(job_dir, f'{product}.tif'))]
+    if 'products' in request.form:
+        products = [product.strip() for product in request.form['products'].split(',') if product.strip()]
+        missing = [product for product in products if product not in available]
+        if missing:
+            return jsonify({'error': f"Products not available: {', '.join(missing)}", 'available_products': available}), 404
+    else:
+        products = [product for product in ZONAL_TERRAIN_PRODUCTS if product in available]
+    if not products:
+        return jsonify({'error': 'Analysis has no product rasters'}), 404
+    return zonal_statistics_response({product: os.path.join(job_dir, f'{product}.tif') for product in products})
+
+@api.route('/ndbi/zonal', methods=['POST'])
+@api.route('/indices/<name>/zonal', methods=['POST'])
+def get_index_zonal_statistics(name='ndbi'):
+    """Zonal statistics of a spectral index; optional years (comma-separated, default all years), aoi and request fields"""
+    if not INDEX_NAME_PATTERN.fullmatch(name):
+        return jsonify({'error': 'Invalid index name'}), 400
+    try:
+        folder = index_folder(request.form.get('aoi') or None, request.form.get('request') or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    available = available_index_years(folder, name)
+    years = [year.strip() for year in request.form['years'].split(',')] if 'years' in request.form else list(available)
+    missing = [year for year in years if year not in available]
+    if missing or not years:
+        return jsonify({'error': f"No {name.upper()} raster for years: {', '.join(missing) or 'any'}",
+                        'available_years': list(available)}), 404
+    return zonal_statistics_response({f'{name}_{year}': available[year] for year in years})
+
+def zonal_statistics_response(sources):
+    """Reads the uploaded zones and answers with per-zone statistics of each source raster.
+
+    Form fields: zones (GeoJSON or GeoPackage file), layer (GeoPackage table), id_field,
+    all_touched ('1' counts every pixel a zone touches, for zones smaller than a pixel)
+    and format ('json' or 'csv').
+    """
+    file = request.files.get('zones')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No zones file provided'}), 400
+    extension = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if extension not in ZONE_EXTENSIONS:
+        return jsonify({'error': 'Zones must be a .geojson, .json or .gpkg file'}), 400
+    output_format = request.form.get('format', 'json').lower()
+    if output_format not in ('json', 'csv'):
+        return jsonify({'error': "Invalid format. Use 'json' or 'csv'"}), 400
+    all_touched = request.form.get('all_touched', '0') == '1'
+
+    zones_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f'zones_{uuid.uuid4().hex}.{extension}')
+    try:
+        file.save(zones_path)
+        geometries, properties, zone_crs = load_zones(zones_path, request.form.get('layer'))
+        ids = zone_ids(properties, request.form.get('id_field'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        if os.path.exists(zones_path):
+            os.remove(zones_path)
+    if not geometries:
+        return jsonify({'error': 'The zones file has no features'}), 400
+    if len(geometries) > ZONAL_MAX_ZONES:
+        return jsonify({'error': f'Too many zones ({len(geometries)}); the limit is {ZONAL_MAX_ZONES}'}), 400
+
+    try:
+        accumulators = zonal_statistics(geometries, zone_crs, sources, all_touched)
+    except (CRSError, ValueError) as e:
+        return jsonify({'error': f'Could not project zones onto the rasters: {e}'}), 400
+
+    if output_format == 'csv':
+        columns, rows = zonal_table(ids, accumulators)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        writer.writerows(['' if value is None else value for value in row] for row in rows)
+        response = current_app.response_class(buffer.getvalue(), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename=zonal_statistics.csv'
+        return response
+
+    per_source = {name: accumulator.rows() for name, accumulator in accumulators.items()}
+    return jsonify({
+        'zone_count': len(ids),
+        'sources': list(sources),
+        'statistics': list(ZONAL_STATISTICS),
+        'zones': [
+            {'zone': zone, **{name: rows[index] for name, rows in per_source.items()}}
+            for index, zone in enumerate(ids)
+        ]
+    }), 200
+
+# --- Map Tile Endpoints ---
+@api.route('/tiles/<source>/<product>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_tile(source, product, z, x, y):
+    """XYZ tile; source is a built-in index ('ndbi', 'ndvi', ...) with a year as product, or a terrain analysis_id with a product name.
+
+    Index tiles of a named AOI take aoi and request query parameters.
+    """
+    if z > 24 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Invalid tile coordinates'}), 400
+
+    value_range = None
+    if source in SPECTRAL_INDICES:
+        if not re.fullmatch(r'\d{4}', product):
+            return jsonify({'error': 'Invalid year'}), 404
+        try:
+            path = index_output_path(index_folder(request.args.get('aoi'), request.args.get('request')), source, product)
+        except ValueError:
+            return jsonify({'error': 'Tile source not found'}), 404
+        style = source
+    else:
+        job = get_job_store().get(source)
+        if job is None or product not in TERRAIN_RASTERS:
+            return jsonify({'error': 'Tile source not found'}), 404
+        if job['status'] != 'completed':
+            return jsonify({'error': 'Analysis is not yet complete'}), 409
+        path = os.path.join(get_job_store().job_dir(source), f'{product}.tif')
+        style = product
+
+    if not os.path.exists(path):
+        return jsonify({'error': 'Raster not found'}), 404
+    if style not in SPECTRAL_INDICES and style not in PRODUCT_VALUE_RANGES:
+        value_range = terrain_value_range(source, product, path)
+
+    etag = tile_etag(path, z, x, y)
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(render_tile(path, style, z, x, y, etag, value_range),
+                                              mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={TILE_MAX_AGE}'
+    return response
+
+@api.route('/ndbi/upload-multiple', methods=['POST'])
+def upload_multiple_files():
+    if 'files' not in request.files:
+        return jsonify({"error": "No files in the request"}), 400
+
+    files = request.files.getlist('files')
+    
+    if not files or all(file.filename == '' for file in files):
+        return jsonify({"error": "No files selected"}), 400
+
+    return process_data()
+
+# --- Job Event Endpoints ---
+@api.route('/api/analysis/<analysis_id>/events', methods=['GET'])
+def stream_analysis_events(analysis_id):
+    return stream_job_events(analysis_id, 'terrain')
+
+@api.route('/ndbi/change/<job_id>/events', methods=['GET'])
+def stream_change_events(job_id):
+    return stream_job_events(job_id, 'change')
+
+@api.route('/ndbi/jobs/<job_id>/events', methods=['GET'])
+@api.route('/indices/jobs/<job_id>/events', methods=['GET'])
+def stream_index_events(job_id):
+    return stream_job_events(job_id, 'index')
+
+def stream_job_events(job_id, kind):
+    """Server-Sent Events stream of a job's progress, replacing status polling.
+
+    Opens with a 'status' event from the job store, replays the job's events so far and
+    then pushes each new one ('queued', 'running', 'stage', 'tiles', 'blocks', 'scene',
+    'preview'), ending with 'completed' (carrying the results path) or 'failed'. A client
+    reconnecting with Last-Event-ID gets only what it missed. Between events the stream
+    sends a keep-alive comment every JOB_EVENTS_KEEPALIVE seconds and re-reads the job
+    store, so a job finished by another API process still ends it; a job with no events in
+    this process is followed through the job store every JOB_EVENTS_POLL seconds.
+    """
+    job = get_job_store().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        after = int(request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+    def stream():
+        metrics.inc('geovision_event_streams')
+        try:
+            last, current = after, job
+            if not after:
+                yield sse_frame('status', {'status': current['status']})
+            sent = time.monotonic()
+            while True:
+                if current['status'] in JOB_TERMINAL_EVENTS:
+                    yield sse_frame(current['status'], stored_job_event(kind, job_id, current))
+                    return
+                events = job_events.wait(job_id, last, JOB_EVENTS_KEEPALIVE)
+                if events is None:
+                    time.sleep(JOB_EVENTS_POLL)
+                    events = []
+                for number, event in events:
+                    yield sse_frame(event['event'], event, number)
+                    sent, last = time.monotonic(), number
+                    if event['event'] in JOB_TERMINAL_EVENTS:
+                        return
+                if not events:
+                    current = get_job_store().get(job_id)
+                    if current is None:
+                        return
+                    if time.monotonic() - sent >= JOB_EVENTS_KEEPALIVE:
+                        yield ': keep-alive\n\n'
+                        sent = time.monotonic()
+        finally:
+            metrics.inc('geovision_event_streams', -1)
+
+    response = current_app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # stop nginx from holding events back
+    return response
+
+def stored_job_event(kind, job_id, job):
+    """The terminal event of a job that finished before (or outside) this stream"""
+    if job['status'] == 'failed':
+        return {'event': 'failed', 'error': job['error'] or 'Unknown error'}
+    return {'event': 'completed', 'results': job_results_path(kind, job_id)}
+
+def sse_frame(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+# --- Metrics Endpoints ---
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The route template rather than the path, so ids don't multiply the series
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('geovision_http_request_duration_seconds', time.perf_counter() - started,
+                        method=request.method, endpoint=endpoint, status=str(response.status_code))
+    return response
+
+@metrics.collector
+def collect_runtime_metrics():
+    scheduler = current_scheduler()  # read without creating it, so a scrape starts no workers
+    yield 'geovision_queue_depth', {}, scheduler.queue_depth() if scheduler else 0
+    yield 'geovision_active_jobs', {'pool': 'analysis'}, scheduler.active_jobs() if scheduler else 0
+    # Index batches run as local scheduler jobs, fanning out to the scene pool
+    yield 'geovision_active_jobs', {'pool': 'index'}, scheduler.active_jobs(local=True) if scheduler else 0
+    yield 'geovision_cache_bytes', {'cache': 'tile'}, tile_cache.size
+    yield 'geovision_process_peak_rss_bytes', {}, peak_rss_bytes() or 0
+    result_cache = get_result_cache()
+    lookups = {'result': (result_cache.hits, result_cache.misses), 'tile': (tile_cache.hits, tile_cache.misses)}
+    for cache in ('dem_array', 'ndbi_plot'):
+        lookups[cache] = (metrics.value('geovision_cache_requests_total', cache=cache, result='hit'),
+                          metrics.value('geovision_cache_requests_total', cache=cache, result='miss'))
+    for cache, (hits, misses) in lookups.items():
+        if cache in ('result', 'tile'):
+            yield 'geovision_cache_requests_total', {'cache': cache, 'result': 'hit'}, hits
+            yield 'geovision_cache_requests_total', {'cache': cache, 'result': 'miss'}, misses
+        yield 'geovision_cache_hit_ratio', {'cache': cache}, hits / (hits + misses) if hits + misses else 0.0
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
@@ -0,0 +1,318 @@
+"""On-disk caches: finished terrain results, and decoded arrays shared by worker processes"""
+import numpy as np
+import rasterio
+import os
+import uuid
+import json
+import threading
+import time
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+from .config import RESULTS_FOLDER
+from .rasters import read_band
+
+# Content-addressed cache of finished terrain results
+RESULT_CACHE_FOLDER = os.path.join(RESULTS_FOLDER, 'cache')
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+CACHE_ATTACHMENT_SKIP = ('results.json', 'results.json.tmp')  # job files owned by the job store
+
+def link_tree(source_dir, dest_dir, skip=()):
+    """Hard-links the files under source_dir into dest_dir, copying where links are not possible"""
+    os.makedirs(dest_dir, exist_ok=True)
+    for entry in os.scandir(source_dir):
+        if entry.name in skip:
+            continue
+        target = os.path.join(dest_dir, entry.name)
+        if entry.is_dir():
+            link_tree(entry.path, target, skip)
+            continue
+        try:
+            if os.path.exists(target):
+                os.remove(target)
+            os.link(entry.path, target)
+        except OSError:
+            shutil.copy2(entry.path, target)
+
+class ResultCache:
+    """Finished analysis results keyed by analysis_cache_key, evicted least recently used past max_bytes.
+
+    Each entry is a JSON file plus an optional directory of attachments (rendered images
+    and product rasters), hard-linked in and out of job directories so a hit copies no data. The JSON
+    file's mtime doubles as the last-use time, so every worker process can share one
+    cache directory.
+    """
+    def __init__(self, directory, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _attachments_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, attachments_dir=None):
+        """Cached results, with their attachments linked into attachments_dir; None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                results = json.load(f)
+            if attachments_dir and os.path.isdir(self._attachments_dir(key)):
+                link_tree(self._attachments_dir(key), attachments_dir, skip=CACHE_ATTACHMENT_SKIP)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return results
+
+    def put(self, key, results, attachments_dir=None):
+        if attachments_dir and os.path.isdir(attachments_dir):
+            link_tree(attachments_dir, self._attachments_dir(key), skip=CACHE_ATTACHMENT_SKIP)
+        # The JSON file is written last: its presence marks a complete entry
+        temp_path = f'{self._path(key)}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(results, f)
+        os.replace(temp_path, self._path(key))
+        self.evict()
+
+    def _entry_size(self, key, json_size):
+        size = json_size
+        for root, _, files in os.walk(self._attachments_dir(key)):
+            size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return size
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                key = entry.name[:-len('.json')]
+                try:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, self._entry_size(key, stat.st_size), key))
+                except FileNotFoundError:
+                    continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(self._attachments_dir(key), ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'max_bytes': self.max_bytes
+            }
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """Creates the shared result cache on first use, so importing the module touches no files"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(RESULT_CACHE_FOLDER)
+        return _result_cache
+
+# Decoded-raster cache: analysis-ready arrays as .npy files that every worker process can memory-map
+ARRAY_CACHE_FOLDER = os.path.join(RESULTS_FOLDER, 'arrays')
+ARRAY_CACHE_MAX_BYTES = int(os.environ.get('ARRAY_CACHE_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+ARRAY_CACHE_SEEN_TTL = int(os.environ.get('ARRAY_CACHE_SEEN_TTL', 24 * 60 * 60))  # how long a first sighting is remembered
+
+class ArrayCache:
+    """Decoded arrays stored as .npy files and opened with np.load(mmap_mode='r').
+
+    Any thread or worker process maps the same file zero-copy, so a repeat read is served
+    from the page cache instead of decoding the JP2/GeoTIFF again. Each entry is a
+    <key>.npy array with a <key>.json metadata file; like ResultCache, the array's mtime is
+    its last-use time. A reader holds a lease (a <key>.<pid>.<id>.lease file) while it uses
+    a mapped array, and eviction skips leased arrays unless the holding process has died.
+    seen() records first sightings as empty <key>.seen files, for entries worth writing
+    only once they are asked for again.
+    """
+    def __init__(self, directory, max_bytes=ARRAY_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts, **params):
+        return hashlib.sha256(json.dumps([parts, params], sort_keys=True, default=str).encode()).hexdigest()
+
+    @classmethod
+    def file_key(cls, path, *parts, **params):
+        """Key tied to a file's identity, so rewriting the file invalidates its entries"""
+        stat = os.stat(path)
+        return cls.key(os.path.realpath(path), stat.st_mtime_ns, stat.st_size, *parts, **params)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        """(read-only memmap, metadata) or None on a miss"""
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+            array = np.load(self._path(key), mmap_mode='r')
+            os.utime(self._path(key))
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return array, meta
+
+    def put(self, key, array, meta=None):
+        """Stores an array; returns it memory-mapped from the cache, with its metadata"""
+        # Both files are written aside and renamed into place, so a concurrent reader never
+        # sees a partial one; the .npy goes last, as its presence marks a complete entry
+        temp_path = f'{self._meta_path(key)}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(meta or {}, f)
+        os.replace(temp_path, self._meta_path(key))
+        temp_path = f'{self._path(key)}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(temp_path, self._path(key))
+        self.evict(keep=key)
+        return np.load(self._path(key), mmap_mode='r'), meta or {}
+
+    def seen(self, key):
+        """True when key was asked for before (within ARRAY_CACHE_SEEN_TTL); otherwise records this sighting"""
+        path = os.path.join(self.directory, f'{key}.seen')
+        try:
+            if time.time() - os.stat(path).st_mtime <= ARRAY_CACHE_SEEN_TTL:
+                return True
+        except FileNotFoundError:
+            pass
+        open(path, 'w').close()
+        return False
+
+    def acquire(self, key):
+        """Takes a lease that keeps key from being evicted; returns a token for release()"""
+        lease_path = os.path.join(self.directory, f'{key}.{os.getpid()}.{uuid.uuid4().hex}.lease')
+        open(lease_path, 'w').close()
+        return lease_path
+
+    def release(self, lease):
+        try:
+            os.remove(lease)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def open(self, key, loader):
+        """Leased (array, metadata) for key, calling loader() -> (array, metadata) on a miss"""
+        lease = self.acquire(key)
+        try:
+            cached = self.get(key)
+            if cached is None:
+                cached = self.put(key, *loader())
+            yield cached
+        finally:
+            self.release(lease)
+
+    def _leased_keys(self):
+        leased = set()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.lease'):
+                continue
+            key, pid, _ = entry.name[:-len('.lease')].split('.')
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                self.release(entry.path)  # the holder died without releasing
+                continue
+            except PermissionError:
+                pass
+            leased.add(key)
+        return leased
+
+    def evict(self, keep=None):
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.seen'):
+                try:
+                    if now - entry.stat().st_mtime > ARRAY_CACHE_SEEN_TTL:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+            elif entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.name[:-len('.npy')]))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        leased = self._leased_keys() | {keep}
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key in leased:
+                continue
+            # Unlinking is safe for processes that still map the file; the pages live until they unmap
+            for path in (self._path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'max_bytes': self.max_bytes
+            }
+
+_array_cache = None
+_array_cache_lock = threading.Lock()
+
+def get_array_cache():
+    """Creates the shared array cache on first use, so importing the module touches no files"""
+    global _array_cache
+    with _array_cache_lock:
+        if _array_cache is None:
+            _array_cache = ArrayCache(ARRAY_CACHE_FOLDER)
+        return _array_cache
+
+@contextmanager
+def cached_band(path):
+    """Band 1 of a raster via read_band, memory-mapped from the array cache; yields (array, metadata)"""
+    def decode():
+        with rasterio.open(path) as src:
+            return read_band(src), {'transform': list(src.transform)[:6], 'crs': src.crs.to_wkt() if src.crs else None}
+    with get_array_cache().open(ArrayCache.file_key(path, 'band1'), decode) as cached:
+        yield cached
@@ -0,0 +1,162 @@
+"""Change detection over the stored per-year rasters of a spectral index"""
+import numpy as np
+import rasterio
+import os
+import re
+from rasterio.crs import CRS
+import glob
+from contextlib import ExitStack
+
+from .events import report_progress
+from .indices import AlignedBand, iter_block_windows, nan_divide
+from .metrics import JobProfile
+from .rasters import CogWriter
+from .stats import StatsAccumulator
+
+CHANGE_PRODUCTS = ('difference', 'trend', 'change_class')
+CHANGE_BUILT_UP_THRESHOLD = float(os.environ.get('CHANGE_BUILT_UP_THRESHOLD', 0.0))  # index value counted as built-up
+CHANGE_MIN_DIFFERENCE = float(os.environ.get('CHANGE_MIN_DIFFERENCE', 0.1))  # smaller first-to-last moves are stable
+CHANGE_CLASSES = {1: 'stable_non_built', 2: 'stable_built_up', 3: 'built_up_gain', 4: 'built_up_loss'}
+CHANGE_STATISTICS_CONFIG = {
+    'difference': {'bins': np.linspace(-2, 2, 81)},
+    'trend': {'bins': np.linspace(-0.1, 0.1, 81)},
+}
+EARTH_RADIUS = 6371008.8  # metres, mean radius
+
+def available_index_years(output_folder, name='ndbi'):
+    """{year: path} of the reprojected rasters produced so far for one index"""
+    pattern = re.compile(rf'Reprojected_{re.escape(name.upper())}_(\d{{4}})\.tif$')
+    years = {}
+    for path in glob.glob(os.path.join(output_folder, f'Reprojected_{name.upper()}_*.tif')):
+        match = pattern.search(os.path.basename(path))
+        if match:
+            years[match.group(1)] = path
+    return dict(sorted(years.items()))
+
+def common_grid(datasets):
+    """Grid covering every dataset at the finest resolution, in the first dataset's CRS, as dataset_grid returns it"""
+    crs = datasets[0].crs
+    bounds = [rasterio.warp.transform_bounds(ds.crs, crs, *ds.bounds) if ds.crs != crs else ds.bounds for ds in datasets]
+    x_res = min(abs(ds.res[0]) for ds in datasets if ds.crs == crs)
+    y_res = min(abs(ds.res[1]) for ds in datasets if ds.crs == crs)
+    left, top = min(b[0] for b in bounds), max(b[3] for b in bounds)
+    right, bottom = max(b[2] for b in bounds), min(b[1] for b in bounds)
+    width = int(np.ceil((right - left) / x_res - 1e-6))
+    height = int(np.ceil((top - bottom) / y_res - 1e-6))
+    return (crs.to_wkt(), tuple(rasterio.Affine(x_res, 0, left, 0, -y_res, top))[:6], width, height)
+
+def pixel_areas(crs, transform, height):
+    """Area in square metres of a pixel in each row; geographic grids are measured on a spherical Earth"""
+    if crs.is_geographic:
+        latitudes = np.radians(transform.f + transform.e * np.arange(height + 1))
+        return EARTH_RADIUS ** 2 * np.radians(abs(transform.a)) * np.abs(np.diff(np.sin(latitudes)))
+    return np.full(height, abs(transform.a * transform.e))
+
+def trend_slope(stack, years):
+    """Per-pixel least-squares slope of a (years, rows, cols) stack per year, skipping NaNs; needs two valid years"""
+    valid = np.isfinite(stack)
+    t = np.asarray(years, dtype=np.float64)
+    t = (t - t.mean()).astype(np.float32)[:, None, None]
+    n = valid.sum(axis=0, dtype=np.float32)
+    t_valid = np.where(valid, t, np.float32(0))
+    y_valid = np.where(valid, stack, np.float32(0))
+    sum_t, sum_y = t_valid.sum(axis=0), y_valid.sum(axis=0)
+    numerator = n * (t_valid * y_valid).sum(axis=0) - sum_t * sum_y
+    slope = nan_divide(numerator, n * (t_valid * t_valid).sum(axis=0) - sum_t * sum_t)
+    slope[n < 2] = np.nan
+    return slope
+
+def classify_change(first, last, built_up_threshold=CHANGE_BUILT_UP_THRESHOLD, min_difference=CHANGE_MIN_DIFFERENCE):
+    """CHANGE_CLASSES codes from the first and last year; 0 where either year has no data"""
+    with np.errstate(invalid='ignore'):
+        first_built = first >= built_up_threshold
+        last_built = last >= built_up_threshold
+        significant = np.abs(last - first) >= min_difference
+    classes = np.where(last_built, 2, 1).astype(np.uint8)
+    classes[~first_built & last_built & significant] = 3
+    classes[first_built & ~last_built & significant] = 4
+    classes[~(np.isfinite(first) & np.isfinite(last))] = 0
+    return classes
+
+def run_change_detection(rasters, output_dir, built_up_threshold=CHANGE_BUILT_UP_THRESHOLD,
+                         min_difference=CHANGE_MIN_DIFFERENCE, job_id=None):
+    """Change detection over a stack of per-year index rasters, [(year, path), ...] in year order.
+
+    Every year is aligned onto a common grid (see AlignedBand) and the stack is streamed
+    block by block, so memory grows with the number of years times one block rather than
+    with the raster size. Writes difference (last minus first year), trend (least-squares
+    slope per year) and change_class COGs to output_dir and returns their statistics and
+    per-stage timings. Touches no shared state, so it can execute in a worker process. With
+    a job_id, stages and blocks are reported as job events.
+    """
+    profile = JobProfile(job_id=job_id)
+    years = [int(year) for year, _ in rasters]
+    statistics = {name: StatsAccumulator(**config) for name, config in CHANGE_STATISTICS_CONFIG.items()}
+    year_statistics = [StatsAccumulator() for _ in years]
+    class_pixels = np.zeros(len(CHANGE_CLASSES) + 1, dtype=np.int64)
+    class_areas = np.zeros(len(CHANGE_CLASSES) + 1, dtype=np.float64)
+    os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        with ExitStack() as stack:
+            datasets = [stack.enter_context(rasterio.open(path)) for _, path in rasters]
+            grid = common_grid(datasets)
+            aligned = [stack.enter_context(AlignedBand(dataset, grid)) for dataset in datasets]
+            crs_wkt, transform, width, height = grid
+            crs, transform = CRS.from_wkt(crs_wkt), rasterio.Affine(*transform)
+            row_areas = pixel_areas(crs, transform, height)
+            writers = {name: stack.enter_context(CogWriter(os.path.join(output_dir, f'{name}.tif'), name,
+                                                           width, height, crs, transform))
+                       for name in CHANGE_PRODUCTS}
+
+            blocks = list(iter_block_windows(width, height))
+            for done, block in enumerate(blocks, start=1):
+                with profile.stage('read'):
+                    values = np.stack([band.read(block) for band in aligned])
+                with profile.stage('compute'):
+                    with np.errstate(invalid='ignore'):
+                        difference = values[-1] - values[0]
+                    trend = trend_slope(values, years)
+                    classes = classify_change(values[0], values[-1], built_up_threshold, min_difference)
+                with profile.stage('write'):
+                    writers['difference'].write(difference, window=block)
+                    writers['trend'].write(trend, window=block)
+                    writers['change_class'].write(classes, window=block)
+
+                with profile.stage('statistics'):
+                    statistics['difference'].update(difference)
+                    statistics['trend'].update(trend)
+                    for accumulator, year_values in zip(year_statistics, values):
+                        accumulator.update(year_values)
+                    areas = np.broadcast_to(row_areas[block.row_off:block.row_off + block.height, None], classes.shape)
+                    class_pixels += np.bincount(classes.ravel(), minlength=len(class_pixels))
+                    class_areas += np.bincount(classes.ravel(), weights=areas.ravel(), minlength=len(class_areas))
+                report_progress(job_id, 'blocks', done=done, total=len(blocks))
+            # Closing the writers builds the overviews and the final COGs
+            with profile.stage('finalize'):
+                stack.close()
+    except Exception as e:
+        e.instrumentation = profile.report()
+        raise
+
+    classified = class_pixels[1:].sum()
+    return {
+        'years': [str(year) for year in years],
+        'grid': {'crs': crs.to_string(), 'width': width, 'height': height, 'transform': list(transform)[:6]},
+        'thresholds': {'built_up': built_up_threshold, 'min_difference': min_difference},
+        'statistics': {
+            'difference': statistics['difference'].summary(),
+            'trend': statistics['trend'].summary(),
+            'years': {str(year): accumulator.summary() for year, accumulator in zip(years, year_statistics)}
+        },
+        'classes': {
+            name: {
+                'pixels': int(class_pixels[code]),
+                'area_km2': float(class_areas[code] / 1e6),
+                'percentage': float(class_pixels[code] / classified * 100) if classified else 0.0
+            }
+            for code, name in CHANGE_CLASSES.items()
+        },
+        'products': list(CHANGE_PRODUCTS),
+        'instrumentation': profile.report()
+    }
@@ -0,0 +1,7 @@
+"""Folders shared by the API, the job store and the caches; created by their users, not on import"""
+import os
+import tempfile
+
+UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'uploads')
+RESULTS_FOLDER = os.path.join(tempfile.gettempdir(), 'results')
+OUTPUT_FOLDER = os.path.join(tempfile.gettempdir(), 'output')
@@ -0,0 +1,99 @@
+"""Job progress events: in-process publish/subscribe, and the relay from worker processes"""
+import os
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict, deque
+
+JOB_EVENTS_HISTORY = 256  # events kept per job, so a reconnecting stream can resume from Last-Event-ID
+JOB_EVENTS_MAX_JOBS = int(os.environ.get('JOB_EVENTS_MAX_JOBS', 4096))
+JOB_EVENTS_KEEPALIVE = float(os.environ.get('JOB_EVENTS_KEEPALIVE', 15))  # seconds between SSE keep-alive comments
+JOB_EVENTS_POLL = 1.0  # seconds between job store reads for a job with no events in this process
+JOB_TERMINAL_EVENTS = ('completed', 'failed')
+JOB_RESULT_PATHS = {'terrain': '/api/analysis/{job_id}/results', 'change': '/ndbi/change/{job_id}',
+                    'index': '/indices/jobs/{job_id}'}
+
+class JobEvents:
+    """In-process publish/subscribe of job progress events.
+
+    Each job keeps its latest events, numbered from 1, so a subscriber can ask for everything
+    after the last one it saw. Subscribers block on a per-job condition variable until an
+    event arrives, so idle streams cost no CPU and a publish only wakes that job's subscribers.
+    """
+    def __init__(self, history=JOB_EVENTS_HISTORY, max_jobs=JOB_EVENTS_MAX_JOBS):
+        self.history = history
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job_id -> {'sequence', 'events', 'condition'}
+
+    def publish(self, job_id, event, **fields):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                # Only publishing creates history, so subscribers to unknown jobs cannot evict live ones
+                entry = {'sequence': 0, 'events': deque(maxlen=self.history),
+                         'condition': threading.Condition(self._lock)}
+                self._jobs[job_id] = entry
+                while len(self._jobs) > self.max_jobs:
+                    _, evicted = self._jobs.popitem(last=False)
+                    evicted['condition'].notify_all()
+            entry['sequence'] += 1
+            entry['events'].append((entry['sequence'], dict(fields, event=event, time=time.time())))
+            entry['condition'].notify_all()
+
+    def wait(self, job_id, after=0, timeout=None):
+        """[(id, event)] of job_id numbered above after, blocking up to timeout for the first.
+
+        Returns [] on timeout, and None straight away when this process holds no events for
+        the job (none published yet, or its history was evicted).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while True:
+                entry = self._jobs.get(job_id)
+                if entry is None:
+                    return None
+                events = [(number, event) for number, event in entry['events'] if number > after]
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if events or (remaining is not None and remaining <= 0):
+                    return events
+                entry['condition'].wait(remaining)
+
+job_events = JobEvents()
+
+# Worker processes cannot reach job_events, so their events travel over this queue to a relay thread
+_progress_queue = None
+_progress_queue_lock = threading.Lock()
+_worker_progress_queue = None  # set in worker processes by init_progress_worker
+
+def get_progress_queue():
+    """Creates the worker-to-API event queue and its relay thread on first use"""
+    global _progress_queue
+    with _progress_queue_lock:
+        if _progress_queue is None:
+            _progress_queue = multiprocessing.get_context('spawn').Queue()
+            threading.Thread(target=_relay_progress, args=(_progress_queue,), daemon=True).start()
+        return _progress_queue
+
+def _relay_progress(queue):
+    while True:
+        job_id, event, fields = queue.get()
+        job_events.publish(job_id, event, **fields)
+
+def init_progress_worker(queue):
+    """ProcessPoolExecutor initializer: report_progress in this worker goes over queue"""
+    global _worker_progress_queue
+    _worker_progress_queue = queue
+
+def report_progress(job_id, event, **fields):
+    """Publishes a job event from the API process or a worker process; a no-op without a job_id"""
+    if job_id is None:
+        return
+    if _worker_progress_queue is not None:
+        _worker_progress_queue.put((job_id, event, fields))
+    else:
+        job_events.publish(job_id, event, **fields)
+
+def job_results_path(kind, job_id):
+    """Where a finished job's results are served, for the 'completed' job event"""
+    return JOB_RESULT_PATHS[kind].format(job_id=job_id)
@@ -0,0 +1,733 @@
+"""Spectral indices of Sentinel-2 scenes: scene catalogues, band math and the per-scene pipeline"""
+import numpy as np
+import rasterio
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor, as_completed
+import re
+from rasterio.windows import from_bounds, Window
+from rasterio.warp import reproject, calculate_default_transform, Resampling
+from rasterio.crs import CRS
+from rasterio.vrt import WarpedVRT
+import functools
+import ast
+import json
+from contextlib import ExitStack
+from collections import defaultdict, OrderedDict
+
+from .caches import ArrayCache, get_array_cache
+from .rasters import CogWriter, read_band
+from .scheduler import ANALYSIS_EXECUTOR
+
+# --- NDBI Specific Functions 
+TARGET_CRS = 'EPSG:4326'
+# Default area of interest as min lon, min lat, max lon, max lat; requests may pass their own (aoi, aois)
+NDBI_AOI = os.environ.get('NDBI_AOI', '4.4,7.7,4.6,7.9')
+lon_min, lat_min, lon_max, lat_max = (float(value) for value in NDBI_AOI.split(','))
+DEFAULT_AOI = (lon_min, lat_min, lon_max, lat_max)
+NDBI_MAX_AOIS = int(os.environ.get('NDBI_MAX_AOIS', 64))
+AOI_NAME_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9_-]{0,63}')
+REQUEST_ID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')  # uuid4 of a request
+# Decoded band pixels of API uploads are kept in the array cache in tiles of this many target
+# pixels a side, so later requests for other AOIs of the same granule skip the JPEG2000 decode.
+# Callers that read each granule once (batch runs, scripts) leave the cache off
+NDBI_DECODE_CACHE = os.environ.get('NDBI_DECODE_CACHE', '1') == '1'
+NDBI_DECODE_TILE = int(os.environ.get('NDBI_DECODE_TILE', 512))
+NDBI_BLOCK_SIZE = 1024
+# The unprojected NDBI_<year>.tif costs a second read of the bands, so it is only written on request
+NDBI_WRITE_UNPROJECTED = os.environ.get('NDBI_WRITE_UNPROJECTED', '0') == '1'
+# Scenes of one upload are processed in parallel; each worker decodes JPEG2000 with its own GDAL threads and cache
+NDBI_WORKERS = int(os.environ.get('NDBI_WORKERS', os.cpu_count() or 1))
+NDBI_GDAL_THREADS = int(os.environ.get('NDBI_GDAL_THREADS', max(1, (os.cpu_count() or 1) // NDBI_WORKERS)))
+NDBI_GDAL_CACHEMAX = int(os.environ.get('NDBI_GDAL_CACHEMAX', 256))  # MB per worker
+# Bands at mixed resolutions (10 m B04 with 20 m B11) are resampled onto the 'coarsest' or 'finest' band's grid
+INDEX_TARGET_RESOLUTION = os.environ.get('INDEX_TARGET_RESOLUTION', 'coarsest')
+
+def extract_year_from_jp2_filename(filename):
+    try:
+        date_match = re.search(r'(\d{8})', filename)
+        if date_match:
+            date_str = date_match.group(1)
+            year = date_str[:4]
+            return year
+        
+        year_match = re.search(r'(20\d{2})', filename)
+        if year_match:
+            return year_match.group(1)
+        
+        from datetime import datetime
+        return str(datetime.now().year)
+    except:
+        from datetime import datetime
+        return str(datetime.now().year)
+
+# Sentinel-2 granule file names, e.g. T31NEJ_20230115T101301_B11_20m.jp2
+S2_BAND_PATTERN = re.compile(r'_(B(?:\d{2}|8A))(?:_(\d{2})m)?(?:_[^.]*)?\.jp2$', re.IGNORECASE)
+S2_TILE_PATTERN = re.compile(r'(?:^|_)(T\d{2}[A-Z]{3})(?=_|$)')
+S2_DATETIME_PATTERN = re.compile(r'(\d{8})T\d{6}')
+
+class SceneCatalogue:
+    """Index of uploaded band files by scene (tile and sensing time), tile, date and band.
+
+    Each file is parsed and its raster metadata read once, at ingest; pairing bands and
+    looking up a scene's year are then dictionary lookups. A catalogue only knows the files
+    ingested into it, so building one per request keeps concurrent uploads apart.
+    """
+    def __init__(self, paths=()):
+        self._scenes = {}
+        self._by_tile = defaultdict(set)
+        self._by_date = defaultdict(set)
+        for path in paths:
+            self.ingest(path)
+
+    @staticmethod
+    def parse_filename(filename):
+        """(scene_id, tile, date, band, resolution) for a band file name, or None if it names no band"""
+        band_match = S2_BAND_PATTERN.search(filename)
+        if not band_match:
+            return None
+        prefix = filename[:band_match.start()]
+        tile_match = S2_TILE_PATTERN.search(prefix)
+        datetime_match = S2_DATETIME_PATTERN.search(prefix)
+        tile = tile_match.group(1) if tile_match else None
+        date = datetime_match.group(1) if datetime_match else None
+        scene_id = f'{tile}_{datetime_match.group(0)}' if tile and date else prefix
+        resolution = int(band_match.group(2)) if band_match.group(2) else None
+        return scene_id, tile, date, band_match.group(1).upper(), resolution
+
+    def ingest(self, path):
+        """Adds one band file; returns its record, or None if the name is not a band file"""
+        filename = os.path.basename(path)
+        parsed = self.parse_filename(filename)
+        if parsed is None:
+            return None
+        scene_id, tile, date, band, resolution = parsed
+        with rasterio.open(path) as src:
+            record = {
+                'path': path, 'band': band, 'crs': src.crs, 'transform': src.transform,
+                'width': src.width, 'height': src.height, 'resolution': resolution or abs(src.res[0])
+            }
+        scene = self._scenes.setdefault(scene_id, {
+            'scene_id': scene_id, 'tile': tile, 'date': date,
+            'year': date[:4] if date else extract_year_from_jp2_filename(filename), 'bands': {}
+        })
+        existing = scene['bands'].get(band)
+        # With the same band at several resolutions, keep the finest
+        if existing is None or record['resolution'] < existing['resolution']:
+            scene['bands'][band] = record
+        if tile:
+            self._by_tile[tile].add(scene_id)
+        if date:
+            self._by_date[date].add(scene_id)
+        return record
+
+    def scene(self, scene_id):
+        return self._scenes.get(scene_id)
+
+    def band(self, scene_id, band):
+        """Record of one band of a scene, or None"""
+        scene = self._scenes.get(scene_id)
+        return scene['bands'].get(band.upper()) if scene else None
+
+    def scenes(self, tile=None, date=None):
+        """Scenes, optionally limited to one tile and/or sensing date (YYYYMMDD), in time order"""
+        scene_ids = set(self._scenes)
+        if tile is not None:
+            scene_ids &= self._by_tile.get(tile, set())
+        if date is not None:
+            scene_ids &= self._by_date.get(date, set())
+        return sorted((self._scenes[scene_id] for scene_id in scene_ids),
+                      key=lambda scene: (scene['date'] or '', scene['scene_id']))
+
+    def files(self, band):
+        """Paths of every file of one band, across scenes"""
+        return [scene['bands'][band]['path'] for scene in self.scenes() if band in scene['bands']]
+
+# --- Spectral Index Functions ---
+# Band-math definitions of the built-in indices. NIR is B8A so every index is available from the 20 m product
+SPECTRAL_INDICES = {
+    'ndbi': '(B11 - B8A) / (B11 + B8A)',
+    'ndvi': '(B8A - B04) / (B8A + B04)',
+    'ndwi': '(B03 - B8A) / (B03 + B8A)',
+}
+S2_BAND_NAME_PATTERN = re.compile(r'B(?:\d{2}|8A)', re.IGNORECASE)
+INDEX_NAME_PATTERN = re.compile(r'[a-z][a-z0-9_]{0,31}')
+
+def nan_divide(numerator, denominator):
+    """Elementwise float32 division where a zero denominator gives NaN rather than inf"""
+    numerator = np.asarray(numerator, dtype=np.float32)
+    denominator = np.asarray(denominator, dtype=np.float32)
+    out = np.full(np.broadcast_shapes(numerator.shape, denominator.shape), np.nan, dtype=np.float32)
+    return np.divide(numerator, denominator, out=out, where=denominator != 0)
+
+class BandExpression:
+    """A band-math expression over Sentinel-2 band names, e.g. '(B11 - B8A) / (B11 + B8A)'.
+
+    The expression is parsed once into a tree of NumPy operations and the bands it
+    references are collected, so callers read exactly those bands. Only arithmetic
+    (+ - * / **), numbers and band names are accepted. Evaluation is float32 throughout.
+    """
+    OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: nan_divide, ast.Pow: np.power}
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.bands = set()
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError:
+            raise ValueError(f"Invalid band expression: {expression}")
+        self._evaluate = self._compile(tree.body)
+        if not self.bands:
+            raise ValueError(f"Band expression references no bands: {expression}")
+
+    def _compile(self, node):
+        if isinstance(node, ast.BinOp) and type(node.op) in self.OPERATORS:
+            operator = self.OPERATORS[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            return lambda bands: operator(left(bands), right(bands))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            operand = self._compile(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            return lambda bands: np.negative(operand(bands))
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            value = np.float32(node.value)
+            return lambda bands: value
+        if isinstance(node, ast.Name) and S2_BAND_NAME_PATTERN.fullmatch(node.id):
+            band = node.id.upper()
+            self.bands.add(band)
+            return lambda bands: bands[band]
+        raise ValueError(f"Unsupported term in band expression: {ast.unparse(node)}")
+
+    def evaluate(self, bands):
+        """Evaluates over {band name: float32 array}; returns a float32 array"""
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            result = self._evaluate(bands)
+        return np.asarray(result, dtype=np.float32)
+
+def parse_index_specs(spec):
+    """{name: BandExpression} from 'ndvi,ndbi,ratio=B11/B8A'; raises ValueError"""
+    indices = {}
+    for item in spec.split(','):
+        name, _, expression = item.strip().partition('=')
+        name = name.strip().lower()
+        if not INDEX_NAME_PATTERN.fullmatch(name):
+            raise ValueError(f"Invalid index name: {name!r}")
+        if not expression:
+            if name not in SPECTRAL_INDICES:
+                raise ValueError(f"Unknown index {name!r}. Built-in indices: {', '.join(SPECTRAL_INDICES)}")
+            expression = SPECTRAL_INDICES[name]
+        elif name in SPECTRAL_INDICES:
+            # Rasters, tiles and plots of a built-in name are styled and shared as that index
+            raise ValueError(f"{name!r} is a built-in index and cannot take a custom expression; choose another name")
+        indices[name] = BandExpression(expression)
+    return indices
+
+def calculate_ndbi(swir_data, nir_data):
+    """(SWIR - NIR) / (SWIR + NIR) in float32; zero-sum pixels become NaN"""
+    return BandExpression(SPECTRAL_INDICES['ndbi']).evaluate({
+        'B11': np.asarray(swir_data, dtype=np.float32), 'B8A': np.asarray(nir_data, dtype=np.float32)
+    })
+
+def save_ndbi_raster(ndbi_data, output_path, year, transform, width, height, crs):
+    output_filename = os.path.join(output_path, f'NDBI_{year}.tif')
+    
+    with CogWriter(output_filename, 'ndbi', width, height, crs, transform) as dst:
+        dst.write(ndbi_data)
+    
+    return output_filename
+
+def reproject_raster(source_path, dest_path, dest_crs):
+    with rasterio.open(source_path) as src:
+        transform, width, height = calculate_default_transform(
+            src.crs, dest_crs, src.width, src.height, *src.bounds
+        )
+        destination = np.full((height, width), np.nan, dtype=np.float32)
+        reproject(
+            source=read_band(src),
+            destination=destination,
+            src_transform=src.transform,
+            src_crs=src.crs,
+            src_nodata=np.nan,
+            dst_transform=transform,
+            dst_crs=dest_crs,
+            dst_nodata=np.nan,
+            resampling=Resampling.bilinear
+        )
+    with CogWriter(dest_path, 'ndbi', width, height, dest_crs, transform) as dst:
+        dst.write(destination)
+    return dest_path
+
+def aoi_window(dataset, aoi, aoi_crs='EPSG:4326'):
+    """Whole-pixel window of dataset covering the (min_x, min_y, max_x, max_y) AOI, or None if they miss"""
+    return grid_window(dataset_grid(dataset), aoi, aoi_crs)
+
+def grid_window(grid, aoi, aoi_crs='EPSG:4326'):
+    """Whole-pixel window of a dataset_grid covering the (min_x, min_y, max_x, max_y) AOI, or None if they miss"""
+    crs_wkt, transform, width, height = grid
+    xs, ys = rasterio.warp.transform(aoi_crs, CRS.from_wkt(crs_wkt), [aoi[0], aoi[2]], [aoi[1], aoi[3]])
+    window = from_bounds(min(xs), min(ys), max(xs), max(ys), rasterio.Affine(*transform))
+    window = window.round_offsets(op='floor').round_lengths(op='ceil')
+    try:
+        window = window.intersection(Window(0, 0, width, height))
+    except rasterio.errors.WindowError:
+        return None
+    return window if window.width > 0 and window.height > 0 else None
+
+def overview_factor(dataset, resolution=None):
+    """Decimation of the coarsest overview level whose pixels are no larger than resolution (CRS units); 1 for native"""
+    if not resolution:
+        return 1
+    adequate = [factor for factor in dataset.overviews(1) if abs(dataset.res[0]) * factor <= resolution * (1 + 1e-9)]
+    return max(adequate, default=1)
+
+def coarsen_grid(grid, factor):
+    """dataset_grid with pixels factor times larger, as an overview level of that grid has"""
+    if factor == 1:
+        return grid
+    crs_wkt, (a, b, c, d, e, f), width, height = grid
+    return (crs_wkt, (a * factor, b * factor, c, d * factor, e * factor, f), -(-width // factor), -(-height // factor))
+
+def iter_block_windows(width, height, block_size=None):
+    block_size = block_size or NDBI_BLOCK_SIZE
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+def dataset_grid(dataset):
+    """Hashable description of a dataset's pixel grid: (CRS WKT, transform coefficients, width, height)"""
+    return (dataset.crs.to_wkt(), tuple(dataset.transform)[:6], dataset.width, dataset.height)
+
+@functools.lru_cache(maxsize=256)
+def grid_alignment(src_grid, dst_grid):
+    """How to bring pixels of src_grid onto dst_grid, worked out once per grid pair.
+
+    Returns ('identical',), ('scaled', x_factor, y_factor, col_offset, row_offset) when the
+    grids share a CRS and orientation and the target pixels are whole multiples or fractions
+    of the source pixels, so a target window maps to a plain source window; otherwise
+    ('warp',), for which GDAL's warper does the resampling.
+    """
+    if src_grid == dst_grid:
+        return ('identical',)
+    src_crs, (sa, sb, sc, sd, se, sf), src_width, src_height = src_grid
+    dst_crs, (da, db, dc, dd, de, df), _, _ = dst_grid
+    if src_crs != dst_crs or sb or sd or db or dd:
+        return ('warp',)
+    x_factor, y_factor = da / sa, de / se
+    col_offset, row_offset = (dc - sc) / sa, (df - sf) / se
+    # Whole-pixel origins and a rational scale (e.g. 10 m -> 20 m) keep every window mapping exact
+    exact = lambda value: abs(value - round(value)) < 1e-6
+    if x_factor > 0 and y_factor > 0 and exact(col_offset) and exact(row_offset) and \
+            (exact(x_factor) or exact(1 / x_factor)) and (exact(y_factor) or exact(1 / y_factor)):
+        return ('scaled', x_factor, y_factor, round(col_offset), round(row_offset))
+    return ('warp',)
+
+class AlignedBand:
+    """Band 1 of a dataset presented on a target grid.
+
+    Reads are windows of the target grid and come back as float32 arrays of the window's
+    shape. Coarser targets are averaged from the source pixels, finer ones bilinearly
+    interpolated; each read decodes just the source pixels under the window. With
+    use_overviews, coarser targets are read from the dataset's overview (JPEG2000
+    resolution) levels instead, which decodes far fewer pixels but is only close to the average.
+    """
+    def __init__(self, dataset, target_grid, use_overviews=False):
+        self.dataset = dataset
+        self.use_overviews = use_overviews
+        self.alignment = grid_alignment(dataset_grid(dataset), target_grid)
+        crs_wkt, transform, width, height = target_grid
+        target_resolution = abs(transform[0])
+        self.resampling = Resampling.average if target_resolution > abs(dataset.res[0]) else Resampling.bilinear
+        self.vrt = None
+        if self.alignment[0] == 'warp':
+            self.vrt = WarpedVRT(dataset, crs=CRS.from_wkt(crs_wkt), transform=rasterio.Affine(*transform),
+                                 width=width, height=height, resampling=self.resampling, src_nodata=dataset.nodata)
+
+    def read(self, window):
+        kind = self.alignment[0]
+        if kind == 'identical':
+            return read_band(self.dataset, window=window)
+        if kind == 'warp':
+            return read_band(self.vrt, window=window)
+        _, x_factor, y_factor, col_offset, row_offset = self.alignment
+        source = Window(col_offset + window.col_off * x_factor, row_offset + window.row_off * y_factor,
+                        window.width * x_factor, window.height * y_factor)
+        boundless = source.col_off < 0 or source.row_off < 0 or \
+            source.col_off + source.width > self.dataset.width or source.row_off + source.height > self.dataset.height
+        height, width = int(window.height), int(window.width)
+        if x_factor >= 1 and y_factor >= 1 and not self.use_overviews:
+            # Block-average full-resolution pixels; letting GDAL downsample JPEG2000 would pick a wavelet level instead
+            x_step, y_step = round(x_factor), round(y_factor)
+            data = read_band(self.dataset, window=source, boundless=boundless)
+            return data.reshape(height, y_step, width, x_step).mean(axis=(1, 3), dtype=np.float32)
+        return read_band(self.dataset, window=source, out_shape=(height, width),
+                         resampling=self.resampling, boundless=boundless)
+
+    def close(self):
+        if self.vrt is not None:
+            self.vrt.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def target_band(sources, resolution=None):
+    """Band whose grid the others are aligned to: the coarsest by default (INDEX_TARGET_RESOLUTION)"""
+    resolution = resolution or INDEX_TARGET_RESOLUTION
+    pick = max if resolution == 'coarsest' else min
+    return pick(sorted(sources), key=lambda band: abs(sources[band].res[0]))
+
+def index_product(name):
+    """CogWriter product name for an index: built-ins keep their own storage scale, custom ones stay float32"""
+    return name if name in SPECTRAL_INDICES else 'index'
+
+def index_output_path(output_folder, name, year, reprojected=True):
+    prefix = 'Reprojected_' if reprojected else ''
+    return os.path.join(output_folder, f'{prefix}{name.upper()}_{year}.tif')
+
+class DecodedBand:
+    """An AlignedBand decoded once into tiles of NDBI_DECODE_TILE target pixels.
+
+    read() decodes the tiles under a window that are not held yet and assembles the window
+    from them. With cache, the tiles live in the array cache under the band's
+    identity (its content hash when known), so another request for an AOI of the same
+    granule maps them instead of decoding the JPEG2000 again; leases keep them from being
+    evicted until close(). Without it, only the most recently used strip of tiles (a few
+    block rows across the grid) is kept in memory, so large windows never have to fit.
+    """
+    def __init__(self, reader, identity, target_grid, cache=False):
+        self.reader = reader
+        self.identity = identity
+        self.target_grid = target_grid
+        self.cache = cache
+        self.tiles = OrderedDict()
+        self.leases = []
+        tiles_across = -(-target_grid[2] // NDBI_DECODE_TILE)
+        # Blocks are warped row by row, each from a source window about NDBI_BLOCK_SIZE across plus a margin
+        self.max_tiles = tiles_across * (-(-NDBI_BLOCK_SIZE // NDBI_DECODE_TILE) + 2)
+
+    def _tile_window(self, col, row):
+        _, _, width, height = self.target_grid
+        return Window(col, row, min(NDBI_DECODE_TILE, width - col), min(NDBI_DECODE_TILE, height - row))
+
+    def _tile_origins(self, window):
+        tile = NDBI_DECODE_TILE
+        col_start, row_start = int(window.col_off) // tile * tile, int(window.row_off) // tile * tile
+        for row in range(row_start, int(window.row_off + window.height), tile):
+            for col in range(col_start, int(window.col_off + window.width), tile):
+                yield col, row
+
+    def prefetch(self, window):
+        for origin in self._tile_origins(window):
+            if origin in self.tiles:
+                self.tiles.move_to_end(origin)
+                continue
+            tile_window = self._tile_window(*origin)
+            if not self.cache:
+                self.tiles[origin] = self.reader.read(tile_window)
+                continue
+            key = ArrayCache.key('decoded', self.identity, self.target_grid, *origin,
+                                 tile=NDBI_DECODE_TILE, overviews=self.reader.use_overviews)
+            self.leases.append(get_array_cache().acquire(key))
+            cached = get_array_cache().get(key)
+            if cached is None:
+                cached = get_array_cache().put(key, self.reader.read(tile_window))
+            self.tiles[origin] = cached[0]
+
+    def read(self, window):
+        self.prefetch(window)
+        col_off, row_off = int(window.col_off), int(window.row_off)
+        out = np.empty((int(window.height), int(window.width)), dtype=np.float32)
+        for col, row in self._tile_origins(window):
+            tile = self.tiles[(col, row)]
+            left, top = max(col, col_off), max(row, row_off)
+            right = min(col + tile.shape[1], col_off + out.shape[1])
+            bottom = min(row + tile.shape[0], row_off + out.shape[0])
+            out[top - row_off:bottom - row_off, left - col_off:right - col_off] = \
+                tile[top - row:bottom - row, left - col:right - col]
+        if not self.cache:
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return out
+
+    def close(self):
+        for lease in self.leases:
+            get_array_cache().release(lease)
+        self.leases = []
+        self.tiles = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def aoi_output_folder(output_folder, aoi_name=None, request_id=None):
+    """Where an AOI's rasters go: output_folder itself for the default (unnamed) AOI, else aois/<name> under it.
+
+    With a request_id, named AOIs go to aois/<request_id>/<name>, so requests that reuse a
+    name for different areas do not overwrite each other's rasters.
+    """
+    if aoi_name is None:
+        return output_folder
+    if request_id is None:
+        return os.path.join(output_folder, 'aois', aoi_name)
+    return os.path.join(output_folder, 'aois', request_id, aoi_name)
+
+def parse_bbox(value):
+    """(min lon, min lat, max lon, max lat) from 'a,b,c,d' or a list of four numbers; raises ValueError"""
+    if isinstance(value, str):
+        value = value.split(',')
+    try:
+        bbox = tuple(float(v) for v in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid bounding box: {value!r}")
+    if len(bbox) != 4 or not all(np.isfinite(bbox)):
+        raise ValueError("A bounding box needs four numbers: min_lon,min_lat,max_lon,max_lat")
+    if not (-180 <= bbox[0] < bbox[2] <= 180 and -90 <= bbox[1] < bbox[3] <= 90):
+        raise ValueError(f"Bounding box out of range or empty: {','.join(map(str, bbox))}")
+    return bbox
+
+def parse_aois(form):
+    """[(name, bbox)] from the aoi / aois form fields; raises ValueError with a message for the client.
+
+    aoi is one min_lon,min_lat,max_lon,max_lat box written to the usual output location.
+    aois is JSON, either {name: box} or a list of boxes (named aoi1, aoi2, ...), each written
+    under its own name. Without either, the default AOI (NDBI_AOI) is used.
+    """
+    aois = []
+    if form.get('aoi'):
+        aois.append((None, parse_bbox(form['aoi'])))
+    if form.get('aois'):
+        try:
+            named = json.loads(form['aois'])
+        except ValueError:
+            raise ValueError("aois must be JSON: {name: [min_lon, min_lat, max_lon, max_lat]} or a list of boxes")
+        if isinstance(named, list):
+            named = {f'aoi{index}': bbox for index, bbox in enumerate(named, 1)}
+        if not isinstance(named, dict) or not named:
+            raise ValueError("aois must be a non-empty JSON object or list")
+        for name, bbox in named.items():
+            if not AOI_NAME_PATTERN.fullmatch(name):
+                raise ValueError(f"Invalid AOI name: {name}")
+            aois.append((name, parse_bbox(bbox)))
+    if len(aois) > NDBI_MAX_AOIS:
+        raise ValueError(f"At most {NDBI_MAX_AOIS} AOIs per request")
+    return aois or [(None, DEFAULT_AOI)]
+
+def parse_resolution(form):
+    """Optional read resolution in metres; None reads full resolution"""
+    if not form.get('resolution'):
+        return None
+    try:
+        resolution = float(form['resolution'])
+    except ValueError:
+        raise ValueError("resolution must be a number of metres")
+    if not resolution > 0:
+        raise ValueError("resolution must be positive")
+    return resolution
+
+def write_index_window(evaluate, names, year, output_folder, src_crs, src_transform, window, dst_crs=TARGET_CRS,
+                       write_unprojected=NDBI_WRITE_UNPROJECTED):
+    """Writes the indices over one window of the source grid, warped to dst_crs block by block.
+
+    evaluate(source) returns one array per name for a window of the source grid. Each
+    destination block evaluates just the source pixels it covers (plus a margin for the
+    resampling kernel). Returns {name: path of Reprojected_<NAME>_<year>.tif}.
+    """
+    width, height = int(window.width), int(window.height)
+    if write_unprojected:
+        with ExitStack() as writers:
+            outputs = [writers.enter_context(CogWriter(
+                index_output_path(output_folder, name, year, reprojected=False), index_product(name),
+                width, height, src_crs, rasterio.windows.transform(window, src_transform))) for name in names]
+            for block in iter_block_windows(width, height):
+                source = Window(window.col_off + block.col_off, window.row_off + block.row_off,
+                                block.width, block.height)
+                for output, data in zip(outputs, evaluate(source)):
+                    output.write(data, window=block)
+
+    dst_transform, dst_width, dst_height = calculate_default_transform(
+        src_crs, dst_crs, width, height, *rasterio.windows.bounds(window, src_transform)
+    )
+    output_paths = {name: index_output_path(output_folder, name, year) for name in names}
+    with ExitStack() as writers:
+        outputs = [writers.enter_context(CogWriter(output_paths[name], index_product(name), dst_width, dst_height,
+                                                   dst_crs, dst_transform)) for name in names]
+        for block in iter_block_windows(dst_width, dst_height):
+            block_transform = rasterio.windows.transform(block, dst_transform)
+            destination = np.full((len(names), int(block.height), int(block.width)), np.nan, dtype=np.float32)
+            left, bottom, right, top = rasterio.warp.transform_bounds(
+                dst_crs, src_crs, *rasterio.windows.bounds(block, dst_transform))
+            source = from_bounds(left, bottom, right, top, src_transform)
+            source = source.round_offsets(op='floor').round_lengths(op='ceil')
+            # Two extra pixels keep bilinear sampling at block edges identical to a whole-window warp
+            source = Window(source.col_off - 2, source.row_off - 2, source.width + 4, source.height + 4)
+            try:
+                source = source.intersection(window)
+            except rasterio.errors.WindowError:
+                for output, data in zip(outputs, destination):
+                    output.write(data, window=block)
+                continue
+            reproject(
+                source=np.stack(evaluate(source)),
+                destination=destination,
+                src_transform=rasterio.windows.transform(source, src_transform),
+                src_crs=src_crs,
+                src_nodata=np.nan,
+                dst_transform=block_transform,
+                dst_crs=dst_crs,
+                dst_nodata=np.nan,
+                resampling=Resampling.bilinear
+            )
+            for output, data in zip(outputs, destination):
+                output.write(data, window=block)
+    return output_paths
+
+def process_index_scene(band_files, indices, year, output_folder, dst_crs=TARGET_CRS,
+                        aoi=DEFAULT_AOI, write_unprojected=NDBI_WRITE_UNPROJECTED):
+    """Reads the AOI of a scene's bands, evaluates indices and warps them to dst_crs in one streamed pass.
+
+    band_files maps band names to files; indices maps index names to BandExpressions.
+    Returns {name: path of Reprojected_<NAME>_<year>.tif}, or None when the AOI misses the
+    scene. See process_index_scene_aois.
+    """
+    return process_index_scene_aois(band_files, indices, year, [(None, aoi, output_folder)],
+                                    dst_crs, write_unprojected)[None]
+
+def process_index_scene_aois(band_files, indices, year, aois, dst_crs=TARGET_CRS,
+                             write_unprojected=NDBI_WRITE_UNPROJECTED, resolution=None, band_ids=None,
+                             decode_cache=False):
+    """Evaluates indices over several areas of interest of one scene, decoding each band once.
+
+    aois is a list of (name, (min lon, min lat, max lon, max lat), output folder). Bands at
+    other resolutions or on other grids are aligned onto the grid of the target band (see
+    AlignedBand). With resolution (metres), that grid is coarsened to the coarsest overview
+    level of the target band no finer than it, and every band is read from its overviews.
+    Each AOI is written by write_index_window, block by block; the tiles under a block are
+    decoded when it is first read and shared by every later block and AOI (see DecodedBand).
+    decode_cache keeps the decoded tiles in the array cache for later requests, under
+    band_ids (band name -> content hash) when given. Returns {name: {index name: output
+    path}, or None for an AOI missing the scene}.
+    """
+    needed = sorted(set().union(*(expression.bands for expression in indices.values())))
+    missing = [band for band in needed if band not in band_files]
+    if missing:
+        raise ValueError(f"Scene is missing bands: {', '.join(missing)}")
+    names = list(indices)
+    band_ids = band_ids or {}
+
+    with ExitStack() as stack:
+        sources = {band: stack.enter_context(rasterio.open(band_files[band], driver='JP2OpenJPEG')) for band in needed}
+        reference = sources[target_band(sources)]
+        factor = overview_factor(reference, resolution)
+        target_grid = coarsen_grid(dataset_grid(reference), factor)
+        src_crs, src_transform = reference.crs, rasterio.Affine(*target_grid[1])
+        decoded = {
+            band: stack.enter_context(DecodedBand(
+                stack.enter_context(AlignedBand(src, target_grid, use_overviews=factor > 1)),
+                band_ids.get(band) or ArrayCache.file_key(band_files[band]), target_grid, decode_cache))
+            for band, src in sources.items()
+        }
+        windows = [(name, grid_window(target_grid, aoi), folder) for name, aoi, folder in aois]
+
+        def evaluate(source):
+            bands = {band: reader.read(source) for band, reader in decoded.items()}
+            return [indices[name].evaluate(bands) for name in names]
+
+        outputs = {}
+        for name, window, folder in windows:
+            if window is None:
+                outputs[name] = None
+                continue
+            os.makedirs(folder, exist_ok=True)
+            outputs[name] = write_index_window(evaluate, names, year, folder, src_crs, src_transform, window,
+                                               dst_crs, write_unprojected)
+    return outputs
+
+def process_ndbi_scene(b11_file, b8a_file, year, output_folder, dst_crs=TARGET_CRS,
+                       aoi=DEFAULT_AOI, write_unprojected=NDBI_WRITE_UNPROJECTED):
+    """NDBI of one band pair; returns the path of Reprojected_NDBI_<year>.tif, or None when the AOI misses the scene"""
+    outputs = process_index_scene({'B11': b11_file, 'B8A': b8a_file}, {'ndbi': BandExpression(SPECTRAL_INDICES['ndbi'])},
+                                  year, output_folder, dst_crs, aoi, write_unprojected)
+    return outputs['ndbi'] if outputs else None
+
+def run_index_scene(scene, expressions, output_folder, aois=None, resolution=None, decode_cache=False,
+                    request_id=None):
+    """Worker entry point: processes one scene under the NDBI GDAL settings.
+
+    expressions maps index names to expression strings and aois is a list of (name, bbox)
+    (default: the unnamed DEFAULT_AOI), so only plain data crosses the process boundary.
+    decode_cache is passed to process_index_scene_aois, request_id to aoi_output_folder.
+    Returns {AOI name: {index name: output path} or None}, or None when every AOI misses the scene.
+    """
+    indices = {name: BandExpression(expression) for name, expression in expressions.items()}
+    aois = [(name, bbox, aoi_output_folder(output_folder, name, request_id))
+            for name, bbox in aois or [(None, DEFAULT_AOI)]]
+    with rasterio.Env(GDAL_NUM_THREADS=NDBI_GDAL_THREADS, GDAL_CACHEMAX=NDBI_GDAL_CACHEMAX):
+        outputs = process_index_scene_aois(scene['bands'], indices, scene['year'], aois,
+                                           resolution=resolution, band_ids=scene.get('band_ids'),
+                                           decode_cache=decode_cache)
+    return outputs if any(outputs.values()) else None
+
+_ndbi_pool = None
+_ndbi_pool_lock = threading.Lock()
+
+def get_ndbi_pool():
+    """Creates the shared scene pool on first use; follows ANALYSIS_EXECUTOR like the terrain scheduler"""
+    global _ndbi_pool
+    with _ndbi_pool_lock:
+        if _ndbi_pool is None:
+            if ANALYSIS_EXECUTOR == 'process':
+                _ndbi_pool = ProcessPoolExecutor(NDBI_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                _ndbi_pool = ThreadPoolExecutor(NDBI_WORKERS)
+        return _ndbi_pool
+
+def discard_ndbi_pool(broken):
+    """Shuts a broken scene pool down, once, so get_ndbi_pool creates a new one"""
+    global _ndbi_pool
+    with _ndbi_pool_lock:
+        if _ndbi_pool is not broken:
+            return
+        _ndbi_pool = None
+    broken.shutdown(wait=False)
+
+def process_index_scenes(scenes, indices, output_folder, on_scene_done=None, aois=None, resolution=None,
+                         request_id=None):
+    """Fans scenes out to the scene pool and waits for all of them.
+
+    aois, resolution and request_id are passed to run_index_scene; decoded tiles go to the array cache
+    when NDBI_DECODE_CACHE is on, as uploads are often re-read for other AOIs.
+    on_scene_done(scene, outputs, error) is called in completion order. Returns a list of
+    (scene, outputs, error) in the order of scenes.
+    """
+    expressions = {name: expression.expression for name, expression in indices.items()}
+    pool = get_ndbi_pool()
+    try:
+        futures = {pool.submit(run_index_scene, scene, expressions, output_folder, aois, resolution,
+                               NDBI_DECODE_CACHE, request_id): index
+                   for index, scene in enumerate(scenes)}
+    except BrokenExecutor:
+        # Broken under another batch before its failures were seen; the next batch gets a new pool
+        discard_ndbi_pool(pool)
+        raise
+    outcomes = [None] * len(scenes)
+    for future in as_completed(futures):
+        scene = scenes[futures[future]]
+        outputs, error = None, None
+        try:
+            outputs = future.result()
+        except BrokenExecutor as e:
+            # A worker died (e.g. out of memory); replace the pool so later batches still run
+            error = e
+            discard_ndbi_pool(pool)
+        except Exception as e:
+            error = e
+        outcomes[futures[future]] = (scene, outputs, error)
+        if on_scene_done:
+            on_scene_done(scene, outputs, error)
+    return outcomes
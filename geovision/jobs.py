@@ -0,0 +1,178 @@
+"""Job orchestration for the API: queueing pipelines, publishing previews, recording outcomes"""
+import traceback
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+import functools
+
+from .caches import get_result_cache
+from .events import job_events, job_results_path
+from .indices import DEFAULT_AOI, process_index_scenes
+from .metrics import JobProfile, record_job_metrics
+from .rasters import RENDER_MODE
+from .scheduler import get_scheduler
+from .stores import get_job_store
+from .terrain import PREVIEW_WORKERS, run_terrain_analysis, run_terrain_preview
+
+_preview_pool = None
+_preview_pool_lock = threading.Lock()
+# Held while a preview is published or a job finishes, so a late preview never outlives the full results
+_preview_publish_lock = threading.Lock()
+
+def get_preview_pool():
+    """Threads in this process: previews are short, and running beside the scheduler they never queue behind full jobs"""
+    global _preview_pool
+    with _preview_pool_lock:
+        if _preview_pool is None:
+            _preview_pool = ThreadPoolExecutor(PREVIEW_WORKERS)
+        return _preview_pool
+
+def _publish_preview(analysis_id, future):
+    """Stores a finished preview unless the job has already finished"""
+    try:
+        results, error = future.result(), None
+    except Exception as e:
+        results, error = None, e
+    with _preview_publish_lock:
+        job = get_job_store().get(analysis_id)
+        if job is None or job['status'] not in ('pending', 'running'):
+            return  # the full analysis finished first (and removed the upload), so the preview is moot
+        if error is not None:
+            print(f"Preview failed for {analysis_id}: {error}", file=sys.stderr)
+            record_job_metrics('terrain_preview', 'failed')
+        elif results is not None:
+            record_job_metrics('terrain_preview', 'completed', results.get('instrumentation'))
+            get_job_store().set_preview(analysis_id, results)
+            job_events.publish(analysis_id, 'preview', tier='preview', results=job_results_path('terrain', analysis_id))
+
+def mark_job_running(analysis_id):
+    get_job_store().set_status(analysis_id, 'running')
+    job_events.publish(analysis_id, 'running')
+
+def finish_analysis_job(analysis_id, results, error, cache_key=None, kind='terrain'):
+    """Stores a finished job's outcome; its instrumentation report also goes to the job's progress and the metrics"""
+    if error is not None:
+        error_trace = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        print(f"Analysis failed for {analysis_id}: {error}\n{error_trace}", file=sys.stderr)
+        report = getattr(error, 'instrumentation', None)
+        record_job_metrics(kind, 'failed', report)
+        with _preview_publish_lock:
+            get_job_store().set_status(analysis_id, 'failed', str(error))
+            get_job_store().clear_preview(analysis_id)
+        if report:
+            get_job_store().set_progress(analysis_id, report)
+        job_events.publish(analysis_id, 'failed', error=str(error))
+        return
+    report = results.get('instrumentation')
+    record_job_metrics(kind, 'completed', report)
+    if report:
+        get_job_store().set_progress(analysis_id, report)
+    with _preview_publish_lock:
+        # The full-resolution results replace any preview
+        get_job_store().set_results(analysis_id, results)
+        get_job_store().clear_preview(analysis_id)
+    job_events.publish(analysis_id, 'completed', results=job_results_path(kind, analysis_id))
+    if cache_key:
+        # Timings describe this run, not the cached answer
+        cached = {key: value for key, value in results.items() if key != 'instrumentation'}
+        get_result_cache().put(cache_key, cached, get_job_store().job_dir(analysis_id))
+
+def perform_full_analysis(analysis_id, file_path, clip_bounds, render_mode=RENDER_MODE):
+    """Runs the entire analysis workflow synchronously in the calling thread"""
+    mark_job_running(analysis_id)
+    output_dir = get_job_store().job_dir(analysis_id)
+    try:
+        results = run_terrain_analysis(file_path, clip_bounds, output_dir, render_mode, job_id=analysis_id)
+    except Exception as e:
+        finish_analysis_job(analysis_id, None, e)
+        return
+    finish_analysis_job(analysis_id, results, None)
+
+def schedule_analysis(analysis_id, file_path, clip_bounds, priority=0, cache_key=None, render_mode=RENDER_MODE,
+                      source_id=None, progressive=False):
+    """Queues a terrain analysis on the worker pool; raises QueueFullError under backpressure.
+
+    A progressive analysis also starts run_terrain_preview straight away on the preview pool.
+    """
+    output_dir = get_job_store().job_dir(analysis_id)
+    get_scheduler().submit(
+        analysis_id, run_terrain_analysis, (file_path, clip_bounds, output_dir, render_mode, source_id, analysis_id),
+        priority=priority, on_start=mark_job_running,
+        on_done=functools.partial(finish_analysis_job, cache_key=cache_key)
+    )
+    if progressive:
+        future = get_preview_pool().submit(run_terrain_preview, file_path, clip_bounds, output_dir, source_id)
+        future.add_done_callback(functools.partial(_publish_preview, analysis_id))
+
+def run_index_batch(job_id, scenes, indices, upload_dir, output_folder, aois=None, resolution=None):
+    """Runs a batch spectral-index job, recording per-scene progress in the job store.
+
+    Scenes run in the scene pool, so the batch's instrumentation times the whole fan-out;
+    each scene's progress entry records how long after the start it finished.
+    """
+    profile = JobProfile(sample=False, job_id=job_id)
+    started = time.perf_counter()
+    get_job_store().set_status(job_id, 'running')
+    job_events.publish(job_id, 'running')
+    progress_scenes = {scene['scene_id']: {'year': scene['year'], 'status': 'pending'} for scene in scenes}
+    progress = {'total': len(scenes), 'done': 0, 'scenes': progress_scenes}
+    get_job_store().set_progress(job_id, progress)
+
+    def scene_done(scene, outputs, error):
+        entry = progress_scenes[scene['scene_id']]
+        if error is not None:
+            print(f"Index scene {scene['scene_id']} failed: {error}", file=sys.stderr)
+            entry.update(status='failed', error=str(error))
+        elif outputs is None:
+            entry.update(status='skipped', error='Area of interest does not overlap the scene')
+        else:
+            entry['status'] = 'completed'
+            skipped = [name for name, paths in outputs.items() if paths is None]
+            if skipped:
+                entry['skipped_aois'] = skipped
+        entry['elapsed_seconds'] = time.perf_counter() - started
+        progress['done'] += 1
+        get_job_store().set_progress(job_id, progress)
+        job_events.publish(job_id, 'scene', scene_id=scene['scene_id'], year=scene['year'], status=entry['status'],
+                           done=progress['done'], total=progress['total'])
+
+    try:
+        with profile.stage('scenes'):
+            outcomes = process_index_scenes(scenes, indices, output_folder, scene_done, aois, resolution, job_id)
+    except Exception as e:
+        record_job_metrics('index', 'failed', profile.report())
+        get_job_store().set_status(job_id, 'failed', str(e))
+        job_events.publish(job_id, 'failed', error=str(e))
+        return
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    report = profile.report()
+    processed_years = sorted(scene['year'] for scene, outputs, error in outcomes if outputs is not None)
+    if not processed_years:
+        record_job_metrics('index', 'failed', report)
+        get_job_store().set_status(job_id, 'failed', 'No valid scenes could be processed')
+        job_events.publish(job_id, 'failed', error='No valid scenes could be processed')
+        return
+    record_job_metrics('index', 'completed', report)
+    get_job_store().set_results(job_id, {'indices': {name: indices[name].expression for name in indices},
+                                   'processed_years': processed_years,
+                                   'aois': aoi_results(aois or [(None, DEFAULT_AOI)], outcomes),
+                                   'resolution': resolution, 'instrumentation': report})
+    job_events.publish(job_id, 'completed', results=job_results_path('index', job_id))
+
+def finish_index_batch(job_id, result, error):
+    """Scheduler callback: run_index_batch records its own outcome, except for errors it did not catch"""
+    if error is not None:
+        print(f"Index job {job_id} failed: {error}", file=sys.stderr)
+        get_job_store().set_status(job_id, 'failed', str(error))
+        job_events.publish(job_id, 'failed', error=str(error))
+
+def aoi_results(aois, outcomes):
+    """[{name, bbox, processed_years}] per requested AOI, from (scene, outputs, error) outcomes"""
+    return [{'name': name, 'bbox': list(bbox),
+             'processed_years': sorted(scene['year'] for scene, outputs, error in outcomes
+                                       if outputs is not None and outputs.get(name) is not None)}
+            for name, bbox in aois]
@@ -0,0 +1,239 @@
+"""Instrumentation: per-job stage profiles and the Prometheus metrics registry"""
+import os
+import sys
+import threading
+import time
+import random
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from collections import defaultdict, OrderedDict
+try:
+    import resource
+except ImportError:  # not available on Windows; peak RSS is then left out of job reports
+    resource = None
+
+from .events import report_progress
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # fraction of jobs profiled in depth
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')  # or 'tracemalloc'
+PROFILE_TOP = 25  # functions (cProfile) or allocation sites (tracemalloc) kept per sampled job
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# cProfile and tracemalloc are process-wide, so at most one job per process is sampled at a time
+_profile_lock = threading.Lock()
+
+def process_io_bytes():
+    """(bytes read, bytes written) by this process so far, page-cache hits included; (None, None) without /proc"""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ', 1) for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def peak_rss_bytes():
+    """High-water resident set size of this process, or None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports kilobytes
+
+class JobProfile:
+    """Per-stage wall time, CPU time, peak RSS and I/O bytes of one job.
+
+    Repeated stages (e.g. one per block) accumulate. CPU time is the calling thread's;
+    peak RSS and I/O bytes are process-wide, so they are exact when the job has a worker
+    process to itself and approximate when jobs share a thread pool. A sampled job
+    (PROFILE_SAMPLE_RATE) also reports its hottest functions or largest allocation sites.
+    With a job_id, the first run of each stage is published as a 'stage' job event.
+    """
+    def __init__(self, sample=None, job_id=None):
+        self.job_id = job_id
+        self.stages = {}
+        self.caches = {}
+        self.failed_stage = None
+        self._started = (time.perf_counter(), time.thread_time())
+        self._profiler = None
+        self._sampling = None
+        if sample is None:
+            sample = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if sample and _profile_lock.acquire(blocking=False):
+            self._sampling = PROFILE_MODE
+            if PROFILE_MODE == 'tracemalloc':
+                tracemalloc.start()
+            else:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        if name not in self.stages:
+            report_progress(self.job_id, 'stage', stage=name)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        read, written = process_io_bytes()
+        if self._sampling == 'tracemalloc':
+            tracemalloc.reset_peak()
+        try:
+            yield
+        except BaseException:
+            self.failed_stage = self.failed_stage or name
+            raise
+        finally:
+            entry = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+            entry['wall_seconds'] += time.perf_counter() - wall
+            entry['cpu_seconds'] += time.thread_time() - cpu
+            entry['calls'] += 1
+            entry['peak_rss_bytes'] = peak_rss_bytes()
+            if read is not None:
+                read_after, written_after = process_io_bytes()
+                entry['read_bytes'] = entry.get('read_bytes', 0) + read_after - read
+                entry['written_bytes'] = entry.get('written_bytes', 0) + written_after - written
+            if self._sampling == 'tracemalloc':
+                entry['traced_peak_bytes'] = max(entry.get('traced_peak_bytes', 0), tracemalloc.get_traced_memory()[1])
+
+    def cache(self, name, hit):
+        self.caches[name] = 'hit' if hit else 'miss'
+
+    def report(self):
+        """JSON-serialisable report; ends a sampled profile, so call it once"""
+        report = {
+            'stages': self.stages,
+            'wall_seconds': time.perf_counter() - self._started[0],
+            'cpu_seconds': time.thread_time() - self._started[1],
+            'peak_rss_bytes': peak_rss_bytes()
+        }
+        if self.caches:
+            report['caches'] = self.caches
+        if self.failed_stage:
+            report['failed_stage'] = self.failed_stage
+        if self._sampling:
+            report['profile'] = {'mode': self._sampling, 'top': self._stop_sampling()}
+        return report
+
+    def _stop_sampling(self):
+        try:
+            if self._sampling == 'tracemalloc':
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                return [{'location': str(stat.traceback[0]), 'bytes': stat.size, 'count': stat.count}
+                        for stat in snapshot.statistics('lineno')[:PROFILE_TOP]]
+            self._profiler.disable()
+            stats = pstats.Stats(self._profiler).stats
+            hottest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP]
+            return [{'function': f'{os.path.basename(filename)}:{line}({function})', 'calls': calls,
+                     'total_seconds': total, 'cumulative_seconds': cumulative}
+                    for (filename, line, function), (_, calls, total, cumulative, _) in hottest]
+        finally:
+            self._sampling = None
+            _profile_lock.release()
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms, rendered in the Prometheus text format.
+
+    Gauges that mirror other objects (queue depth, cache sizes) are read at scrape time
+    by collector functions. Every process keeps its own registry, so with several
+    gunicorn workers each one has to be scraped.
+    """
+    def __init__(self):
+        self._definitions = OrderedDict()
+        self._values = defaultdict(dict)
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def define(self, name, kind, help_text, buckets=LATENCY_BUCKETS):
+        self._definitions[name] = (kind, help_text, buckets if kind == 'histogram' else None)
+
+    def collector(self, fn):
+        """Registers fn() -> iterable of (name, labels, value), called on every render"""
+        self._collectors.append(fn)
+        return fn
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self._definitions[name][2]
+        with self._lock:
+            state = self._values[name].setdefault(key, [[0] * len(buckets), 0.0, 0])
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._values[name].get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        collected = defaultdict(dict)
+        for fn in self._collectors:
+            for name, labels, value in fn():
+                collected[name][tuple(sorted(labels.items()))] = value
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._definitions.items():
+                samples = {**self._values.get(name, {}), **collected.get(name, {})}
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in samples.items():
+                    if kind != 'histogram':
+                        lines.append(f'{name}{format_labels(key)} {value}')
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{format_labels(key + (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{name}_bucket{format_labels(key + (("le", "+Inf"),))} {count}')
+                    lines.append(f'{name}_sum{format_labels(key)} {total}')
+                    lines.append(f'{name}_count{format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    """Prometheus label set for a tuple of (name, value) pairs"""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+metrics = MetricsRegistry()
+metrics.define('geovision_http_request_duration_seconds', 'histogram', 'HTTP request latency by route')
+metrics.define('geovision_jobs_total', 'counter', 'Finished jobs by kind and outcome')
+metrics.define('geovision_job_duration_seconds', 'histogram', 'Job run time in the worker, excluding queue wait')
+metrics.define('geovision_job_queue_wait_seconds', 'histogram', 'Time jobs spent queued before a worker took them')
+metrics.define('geovision_job_stage_seconds', 'histogram', 'Wall time per job stage')
+metrics.define('geovision_job_stage_cpu_seconds_total', 'counter', 'CPU time per job stage')
+metrics.define('geovision_job_read_bytes_total', 'counter', 'Bytes read by jobs')
+metrics.define('geovision_job_written_bytes_total', 'counter', 'Bytes written by jobs')
+metrics.define('geovision_cache_requests_total', 'counter', 'Cache lookups by cache and result')
+metrics.define('geovision_cache_hit_ratio', 'gauge', 'Hits over lookups since start, per cache')
+metrics.define('geovision_cache_bytes', 'gauge', 'Bytes held by in-memory caches')
+metrics.define('geovision_queue_depth', 'gauge', 'Jobs waiting for an analysis worker')
+metrics.define('geovision_active_jobs', 'gauge', 'Jobs currently running, by pool')
+metrics.define('geovision_event_streams', 'gauge', 'Open job event (SSE) streams')
+metrics.define('geovision_process_peak_rss_bytes', 'gauge', 'High-water resident set size of the API process')
+
+def record_job_metrics(kind, outcome, report=None):
+    """Folds a finished job's JobProfile report into the process metrics"""
+    metrics.inc('geovision_jobs_total', kind=kind, outcome=outcome)
+    if not report:
+        return
+    metrics.observe('geovision_job_duration_seconds', report['wall_seconds'], kind=kind)
+    for stage, entry in report['stages'].items():
+        metrics.observe('geovision_job_stage_seconds', entry['wall_seconds'], kind=kind, stage=stage)
+        metrics.inc('geovision_job_stage_cpu_seconds_total', entry['cpu_seconds'], kind=kind, stage=stage)
+        metrics.inc('geovision_job_read_bytes_total', entry.get('read_bytes', 0), kind=kind)
+        metrics.inc('geovision_job_written_bytes_total', entry.get('written_bytes', 0), kind=kind)
+    for cache, result in report.get('caches', {}).items():
+        metrics.inc('geovision_cache_requests_total', cache=cache, result=result)
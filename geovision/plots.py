@@ -0,0 +1,112 @@
+"""The /ndbi/plot figure: per-year panels and their composite, cached on disk"""
+import rasterio
+from PIL import Image, ImageDraw, ImageFont
+import os
+import uuid
+import io
+import glob
+import hashlib
+
+from .config import RESULTS_FOLDER
+from .rasters import PYPLOT_LOCK, pyplot, read_decimated
+
+# /ndbi/plot panels are rendered from overviews at display resolution and cached until their raster changes.
+# Requests may ask for a lower dpi (e.g. dpi=100 for screen previews), which renders about 9x fewer pixels
+NDBI_PLOT_DPI = int(os.environ.get('NDBI_PLOT_DPI', 300))
+NDBI_PANEL_INCHES = 6
+PLOT_CACHE_FOLDER = os.path.join(RESULTS_FOLDER, 'plots')
+
+def raster_fingerprint(path):
+    """Changes whenever the file is rewritten"""
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+def plot_cache_scope(aoi=None, request_id=None):
+    """Cached plot names of one AOI's folder; a new plot of it replaces only that folder's files"""
+    if aoi is None:
+        return 'default'
+    return f'{request_id}_{aoi}' if request_id else aoi
+
+def ndbi_plot_etag(ndbi_data_list, aoi=None, dpi=NDBI_PLOT_DPI):
+    parts = [f"{data['year']}:{raster_fingerprint(data['reprojected_path'])}" for data in ndbi_data_list]
+    return hashlib.sha256('|'.join(parts + [str(dpi), aoi or '']).encode()).hexdigest()[:32]
+
+def write_atomic(path, payload):
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(temp_path, path)
+
+def remove_stale(pattern, keep):
+    """Deletes files matching pattern other than keep; tolerates concurrent deletions"""
+    for stale in glob.glob(pattern):
+        if stale != keep:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+def render_ndbi_panel(year, reprojected_path, dpi=NDBI_PLOT_DPI):
+    """PNG bytes of one year's NDBI map, read from overviews at display size; callers must hold PYPLOT_LOCK"""
+    with rasterio.open(reprojected_path) as src:
+        bounds = src.bounds
+    ndbi = read_decimated(reprojected_path, NDBI_PANEL_INCHES * dpi)
+    transform = rasterio.transform.from_bounds(*bounds, ndbi.shape[1], ndbi.shape[0])
+
+    from rasterio import plot
+    plt = pyplot()
+    fig, ax = plt.subplots(figsize=(NDBI_PANEL_INCHES, NDBI_PANEL_INCHES))
+    img_plot = plot.show(ndbi, transform=transform, ax=ax, title=f'NDBI {year}', cmap='viridis')
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    ax.tick_params(axis='x', rotation=45)
+    if img_plot and hasattr(img_plot, 'get_images') and img_plot.get_images():
+        cbar = fig.colorbar(img_plot.get_images()[0], ax=ax, orientation='vertical', shrink=0.75)
+        cbar.set_label('NDBI Value')
+    fig.tight_layout()
+
+    img_bytes = io.BytesIO()
+    fig.savefig(img_bytes, format='png', dpi=dpi)
+    plt.close(fig)
+    return img_bytes.getvalue()
+
+def ndbi_panel_path(year, reprojected_path, aoi=None, request_id=None, dpi=NDBI_PLOT_DPI):
+    """Cached panel image for one year of an AOI, re-rendered only when that year's raster has changed"""
+    os.makedirs(PLOT_CACHE_FOLDER, exist_ok=True)
+    fingerprint = f'{os.path.realpath(reprojected_path)}|{raster_fingerprint(reprojected_path)}|{dpi}'
+    key = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+    prefix = f"panel_{plot_cache_scope(aoi, request_id)}_{year}_{dpi}"
+    panel_path = os.path.join(PLOT_CACHE_FOLDER, f'{prefix}_{key}.png')
+    if not os.path.exists(panel_path):
+        with PYPLOT_LOCK:
+            panel = render_ndbi_panel(year, reprojected_path, dpi)
+        write_atomic(panel_path, panel)
+        remove_stale(os.path.join(PLOT_CACHE_FOLDER, f'{prefix}_*.png'), panel_path)
+    return panel_path
+
+def render_ndbi_composite(ndbi_data_list, aoi=None, request_id=None, dpi=NDBI_PLOT_DPI):
+    """PNG bytes of the per-year NDBI grid, pasted together from the cached panels"""
+    panels = []
+    for data in ndbi_data_list:
+        with Image.open(ndbi_panel_path(data['year'], data['reprojected_path'], aoi, request_id, dpi)) as panel:
+            panels.append(panel.convert('RGB'))
+
+    num_images = len(panels)
+    cols = min(num_images, 3)
+    rows = (num_images + cols - 1) // cols
+    cell_width = max(panel.width for panel in panels)
+    cell_height = max(panel.height for panel in panels)
+    title_height = dpi // 2
+
+    composite = Image.new('RGB', (cols * cell_width, rows * cell_height + title_height), 'white')
+    for i, panel in enumerate(panels):
+        row, col = divmod(i, cols)
+        composite.paste(panel, (col * cell_width, title_height + row * cell_height))
+    draw = ImageDraw.Draw(composite)
+    font = ImageFont.load_default(size=dpi * 16 // 72)
+    title = f'Annual NDBI Composites ({aoi})' if aoi else 'Annual NDBI Composites'
+    draw.text((composite.width // 2, title_height // 2), title, fill='black', font=font, anchor='mm')
+
+    img_bytes = io.BytesIO()
+    composite.save(img_bytes, format='PNG', optimize=True)
+    return img_bytes.getvalue()
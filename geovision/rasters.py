@@ -0,0 +1,176 @@
+"""Raster I/O and rendering shared by the pipelines: COG writing, band reads, colour-mapped images"""
+import numpy as np
+import rasterio
+import rasterio.shutil
+from PIL import Image
+import os
+import uuid
+from io import BytesIO
+import threading
+from rasterio.warp import Resampling
+import functools
+
+# Result rendering: 'figure' is the matplotlib 2x2 panel as base64, 'direct' writes one
+# colour-mapped image per product and returns URLs to them
+RENDER_MODE = os.environ.get('RENDER_MODE', 'figure')
+RENDER_FORMAT = os.environ.get('RENDER_FORMAT', 'png')  # 'png' or 'webp'
+RENDER_MAX_SIZE = int(os.environ.get('RENDER_MAX_SIZE', 2048))
+
+PRODUCT_COLORMAPS = {'elevation': 'terrain', 'slope': 'YlOrRd', 'aspect': 'hsv', 'hillshade': 'gray',
+                     'curvature': 'RdBu_r', 'ndbi': 'viridis', 'ndvi': 'RdYlGn', 'ndwi': 'Blues'}
+# Fixed colour ranges; other products stretch to their data range
+PRODUCT_VALUE_RANGES = {'aspect': (0, 360), 'hillshade': (0, 255), 'ndbi': (-1, 1), 'ndvi': (-1, 1), 'ndwi': (-1, 1)}
+
+# Raster outputs are written as Cloud-Optimized GeoTIFFs
+COG_COMPRESS = os.environ.get('COG_COMPRESS', 'DEFLATE')  # or 'ZSTD'
+COG_STORAGE = os.environ.get('COG_STORAGE', 'float32')  # or 'int16', scaled by INT16_SCALES
+COG_BLOCKSIZE = 512
+COG_OVERVIEW_RESAMPLING = 'AVERAGE'
+INT16_NODATA = -32768
+INT16_SCALES = {'slope': 0.01, 'aspect': 0.02, 'curvature': 1e-5, 'ndbi': 1e-4, 'ndvi': 1e-4, 'ndwi': 1e-4,
+                'difference': 1e-4, 'trend': 1e-5}
+UINT8_PRODUCTS = {'hillshade': None, 'change_class': 0}  # product -> nodata
+CATEGORICAL_PRODUCTS = ('change_class',)  # overviews keep the most common class rather than averaging codes
+
+# pyplot keeps global state, so figures are rendered one at a time per process
+PYPLOT_LOCK = threading.Lock()
+
+def pyplot():
+    """matplotlib.pyplot on the Agg backend, imported on first use.
+
+    It is by far the slowest import here and only figure rendering needs it, so API
+    processes, batch runs and spawned workers that never draw a figure start without it.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    return matplotlib.pyplot
+
+@functools.lru_cache(maxsize=None)
+def colormap_lut(name):
+    """256-entry RGBA lookup table for a matplotlib colormap"""
+    import matplotlib
+    return (matplotlib.colormaps[name](np.linspace(0, 1, 256)) * 255).round().astype(np.uint8)
+
+def render_product(data, product, max_size=RENDER_MAX_SIZE, value_range=None):
+    """Colour-maps a product array to RGBA through its LUT, striding it down to max_size"""
+    step = max(1, -(-max(data.shape) // max_size))
+    data = data[::step, ::step]
+    valid = np.isfinite(data) if np.issubdtype(data.dtype, np.floating) else np.ones(data.shape, dtype=bool)
+    if value_range is not None:
+        low, high = value_range
+    elif product in PRODUCT_VALUE_RANGES:
+        low, high = PRODUCT_VALUE_RANGES[product]
+    elif valid.any():
+        low, high = float(data[valid].min()), float(data[valid].max())
+    else:
+        low, high = 0.0, 1.0
+    scale = 255 / (high - low) if high > low else 0.0
+    indices = np.subtract(data, low, dtype=np.float32)
+    indices *= scale
+    np.clip(indices, 0, 255, out=indices)
+    indices[~valid] = 0
+    rgba = colormap_lut(PRODUCT_COLORMAPS.get(product, 'viridis'))[indices.astype(np.uint8)]
+    rgba[~valid, 3] = 0
+    return rgba
+
+def encode_image(rgba, image_format=RENDER_FORMAT):
+    buffer = BytesIO()
+    if image_format == 'webp':
+        Image.fromarray(rgba, 'RGBA').save(buffer, format='WEBP', lossless=True, method=0)
+    else:
+        Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+def read_band(src, **read_kwargs):
+    """Band 1 as float32 with nodata as NaN and any stored scale/offset applied"""
+    data = src.read(1, **read_kwargs).astype(np.float32, copy=False)
+    if src.nodata is not None and not np.isnan(src.nodata):
+        data[data == src.nodata] = np.nan
+    scale, offset = src.scales[0], src.offsets[0]
+    if scale != 1 or offset != 0:
+        data *= scale
+        data += offset
+    return data
+
+def read_decimated(path, max_size=RENDER_MAX_SIZE):
+    """Reads band 1 at no more than max_size pixels on a side, using overviews when present"""
+    with rasterio.open(path) as src:
+        step = max(1, -(-max(src.width, src.height) // max_size))
+        out_shape = (max(src.height // step, 1), max(src.width // step, 1))
+        if src.dtypes[0] == 'uint8':
+            return src.read(1, out_shape=out_shape, resampling=Resampling.nearest)
+        return read_band(src, out_shape=out_shape, resampling=Resampling.nearest)
+
+class CogWriter:
+    """Writes one raster product as a Cloud-Optimized GeoTIFF.
+
+    Blocks are written (windowed, in any order) to a compressed tiled GeoTIFF next to the
+    target; on close GDAL's COG driver copies it into place, building the overviews and
+    putting them ahead of the full-resolution tiles. With COG_STORAGE='int16', float
+    products are stored as scaled integers, recorded as the band's scale so read_band
+    and GDAL clients recover physical values.
+    """
+    def __init__(self, path, product, width, height, crs, transform, storage=None):
+        storage = storage or COG_STORAGE
+        self.path = path
+        self.product = product
+        self.temp_path = f'{path}.{uuid.uuid4().hex}.tmp.tif'
+        self.scale = None
+        if product in UINT8_PRODUCTS:
+            dtype, nodata = 'uint8', UINT8_PRODUCTS[product]
+        elif storage == 'int16' and product in INT16_SCALES:
+            dtype, nodata = 'int16', INT16_NODATA
+            self.scale = INT16_SCALES[product]
+        else:
+            dtype, nodata = 'float32', np.nan
+        self.dtype = dtype
+        self.nodata = nodata
+        self.dataset = rasterio.open(
+            self.temp_path, 'w', driver='GTiff', width=width, height=height, count=1,
+            crs=crs, transform=transform, dtype=dtype, nodata=nodata, tiled=True,
+            blockxsize=COG_BLOCKSIZE, blockysize=COG_BLOCKSIZE, compress=COG_COMPRESS, bigtiff='IF_SAFER'
+        )
+        if self.scale is not None:
+            self.dataset.scales = (self.scale,)
+
+    def write(self, data, window=None):
+        if self.scale is not None:
+            valid = np.isfinite(data)
+            scaled = np.divide(data, self.scale, dtype=np.float32)
+            np.clip(scaled, INT16_NODATA + 1, np.iinfo(np.int16).max, out=scaled)
+            scaled = np.rint(scaled).astype(np.int16)
+            scaled[~valid] = INT16_NODATA
+            data = scaled
+        self.dataset.write(data.astype(self.dtype, copy=False), 1, window=window)
+
+    def close(self):
+        if self.dataset.closed:
+            return
+        self.dataset.close()
+        try:
+            predictor = 'FLOATING_POINT' if self.dtype == 'float32' else 'STANDARD'
+            overview_resampling = 'MODE' if self.product in CATEGORICAL_PRODUCTS else COG_OVERVIEW_RESAMPLING
+            rasterio.shutil.copy(
+                self.temp_path, self.path, driver='COG', compress=COG_COMPRESS, predictor=predictor,
+                blocksize=COG_BLOCKSIZE, overview_resampling=overview_resampling, bigtiff='IF_SAFER'
+            )
+        finally:
+            os.remove(self.temp_path)
+
+    def abort(self):
+        self.dataset.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def open_product_raster(path, product, width, height, crs, transform):
+    """Opens a COG writer for one terrain product"""
+    return CogWriter(path, product, width, height, crs, transform)
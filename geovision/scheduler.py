@@ -0,0 +1,131 @@
+"""The analysis job scheduler: a bounded priority queue in front of a worker pool"""
+import os
+import threading
+import time
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor
+
+from .events import init_progress_worker, get_progress_queue, job_events
+from .metrics import metrics
+
+# Analysis worker pool: 'process' isolates the GIL-bound NumPy/matplotlib work, 'thread' keeps it in-process
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get('ANALYSIS_QUEUE_SIZE', 32))
+ANALYSIS_EXECUTOR = os.environ.get('ANALYSIS_EXECUTOR', 'process')
+
+class QueueFullError(Exception):
+    pass
+
+class JobScheduler:
+    """Runs jobs on a fixed-size worker pool fed from a bounded priority queue.
+
+    Jobs wait in our own heap rather than in the executor, so queue positions can be
+    reported and a full queue can be refused. Higher priorities run first; ties run
+    in submission order.
+    """
+    def __init__(self, workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_SIZE, executor=ANALYSIS_EXECUTOR):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor_kind = executor
+        self._queue = []
+        self._sequence = 0
+        self._active = {}  # job_id -> local
+        self._condition = threading.Condition()
+        self._executor = self._create_executor()
+        for _ in range(workers):
+            threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def _create_executor(self):
+        if self.executor_kind == 'process':
+            # spawn avoids forking a multi-threaded server process
+            return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_progress_worker, initargs=(get_progress_queue(),))
+        return ThreadPoolExecutor(self.workers)
+
+    def submit(self, job_id, fn, args=(), priority=0, on_start=None, on_done=None, local=False):
+        """Queues fn(*args); on_done(job_id, result, error) runs once it finishes.
+
+        A local job runs in the dispatch thread rather than the executor, for jobs that fan
+        out to a pool of their own and report through the API process's job state.
+        """
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(f"Analysis queue is full ({self.max_queue} jobs waiting)")
+            self._sequence += 1
+            heapq.heappush(self._queue, (-priority, self._sequence, job_id, fn, args, on_start, on_done,
+                                         time.monotonic(), local))
+            self._condition.notify()
+        job_events.publish(job_id, 'queued', priority=priority)
+
+    def queue_position(self, job_id):
+        """1-based position of a waiting job, or None if it is not queued"""
+        with self._condition:
+            ordered = sorted(self._queue)
+            for position, entry in enumerate(ordered, start=1):
+                if entry[2] == job_id:
+                    return position
+        return None
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._queue)
+
+    def active_jobs(self, local=False):
+        """Running jobs: executor jobs, or with local=True the jobs running in dispatch threads"""
+        with self._condition:
+            return sum(1 for is_local in self._active.values() if is_local == local)
+
+    def _replace_executor(self, broken):
+        """Swaps in a new pool, once: every job running on the broken one fails with BrokenExecutor"""
+        with self._condition:
+            if self._executor is not broken:
+                return
+            self._executor = self._create_executor()
+        broken.shutdown(wait=False)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, job_id, fn, args, on_start, on_done, queued_at, local = heapq.heappop(self._queue)
+                self._active[job_id] = local
+            metrics.observe('geovision_job_queue_wait_seconds', time.monotonic() - queued_at)
+            result, error, executor = None, None, None
+            try:
+                if on_start:
+                    on_start(job_id)
+                if local:
+                    result = fn(*args)
+                else:
+                    with self._condition:
+                        executor = self._executor
+                    result = executor.submit(fn, *args).result()
+            except BrokenExecutor as e:
+                # A worker died (e.g. out of memory); replace the pool so later jobs still run
+                error = e
+                if executor is not None:
+                    self._replace_executor(executor)
+            except Exception as e:
+                error = e
+            finally:
+                with self._condition:
+                    self._active.pop(job_id, None)
+            if on_done:
+                on_done(job_id, result, error)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Creates the shared scheduler on first use, so importing the module starts no workers"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
+
+def current_scheduler():
+    """The shared scheduler, or None before its first use; reading it starts no workers"""
+    return _scheduler
@@ -0,0 +1,92 @@
+"""Mergeable per-product raster statistics"""
+import numpy as np
+
+# Per-product statistics: histogram bin edges (percentiles are read off them) and "above" thresholds
+STATISTICS_CONFIG = {
+    'elevation': {},
+    'slope': {'bins': np.linspace(0, 90, 19), 'thresholds': (30,)},
+    'aspect': {'bins': np.linspace(0, 360, 9)},
+    'curvature': {},
+}
+STATISTICS_PERCENTILES = (10, 50, 90)
+
+class StatsAccumulator:
+    """Mergeable statistics for one raster product, fed one block at a time.
+
+    Mean and variance are merged with Chan et al.'s pairwise update, so blocks, tiles and
+    worker results can be combined in any order. Non-finite pixels are ignored everywhere,
+    including the threshold percentages. Percentiles are interpolated from the histogram.
+    """
+    def __init__(self, bins=None, thresholds=()):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.bins = None if bins is None else np.asarray(bins, dtype=np.float64)
+        self.histogram = None if bins is None else np.zeros(len(self.bins) - 1, dtype=np.int64)
+        self.thresholds = tuple(thresholds)
+        self.above = np.zeros(len(self.thresholds), dtype=np.int64)
+
+    def update(self, block):
+        values = block[np.isfinite(block)] if np.issubdtype(block.dtype, np.floating) else block.ravel()
+        if values.size == 0:
+            return self
+        part = StatsAccumulator(self.bins, self.thresholds)
+        part.count = values.size
+        part.mean = float(values.mean(dtype=np.float64))
+        centred = np.subtract(values, part.mean, dtype=np.float64)
+        part.m2 = float(np.dot(centred, centred))
+        part.min = float(values.min())
+        part.max = float(values.max())
+        if self.bins is not None:
+            part.histogram = np.histogram(values, bins=self.bins)[0]
+        for i, threshold in enumerate(self.thresholds):
+            part.above[i] = np.count_nonzero(values > threshold)
+        return self.merge(part)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.histogram is not None:
+            self.histogram += other.histogram
+        self.above += other.above
+        return self
+
+    def percentile(self, q):
+        if self.histogram is None or self.histogram.sum() == 0:
+            return None
+        cumulative = np.cumsum(self.histogram)
+        target = q / 100 * cumulative[-1]
+        index = int(np.searchsorted(cumulative, target))
+        index = min(index, len(self.histogram) - 1)
+        below = cumulative[index - 1] if index > 0 else 0
+        fraction = (target - below) / self.histogram[index] if self.histogram[index] else 0.0
+        return float(self.bins[index] + fraction * (self.bins[index + 1] - self.bins[index]))
+
+    def summary(self, percentiles=STATISTICS_PERCENTILES):
+        if self.count == 0:
+            return {'min': None, 'max': None, 'mean': None, 'std': None, 'count': 0}
+        stats = {
+            'min': self.min, 'max': self.max, 'mean': self.mean,
+            'std': float(np.sqrt(self.m2 / self.count)), 'count': int(self.count)
+        }
+        if self.histogram is not None:
+            stats['histogram'] = {'edges': self.bins.tolist(), 'counts': self.histogram.tolist()}
+            stats['percentiles'] = {f'p{q:g}': self.percentile(q) for q in percentiles}
+        if self.thresholds:
+            stats['threshold_percentages'] = {
+                f'{threshold:g}': float(above / self.count * 100)
+                for threshold, above in zip(self.thresholds, self.above)
+            }
+        return stats
+
+def new_accumulators(names):
+    return {name: StatsAccumulator(**STATISTICS_CONFIG.get(name, {})) for name in names}
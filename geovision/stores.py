@@ -0,0 +1,226 @@
+"""Job status and result storage shared by the API and its workers"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import closing
+
+from .config import RESULTS_FOLDER
+
+# Job/result store: finished results live on disk and expire by age or, past the size budget, least recently read
+RESULT_STORE_PATH = os.environ.get('RESULT_STORE_PATH', os.path.join(RESULTS_FOLDER, 'jobs.sqlite3'))
+RESULT_TTL_SECONDS = int(os.environ.get('RESULT_TTL_SECONDS', 24 * 60 * 60))
+RESULT_STORE_MAX_BYTES = int(os.environ.get('RESULT_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+class ResultStore(ABC):
+    """Interface for job status and result storage shared by the API and its workers"""
+    @abstractmethod
+    def create(self, job_id, status='pending'):
+        pass
+
+    @abstractmethod
+    def set_status(self, job_id, status, error=None):
+        pass
+
+    @abstractmethod
+    def set_results(self, job_id, results):
+        pass
+
+    @abstractmethod
+    def set_progress(self, job_id, progress):
+        """Stores a JSON-serialisable progress report for a running job"""
+
+    @abstractmethod
+    def get(self, job_id):
+        """Job record ({'status': ..., 'error': ..., 'progress': ...}) or None"""
+
+    @abstractmethod
+    def get_results(self, job_id):
+        pass
+
+    @abstractmethod
+    def set_preview(self, job_id, results):
+        """Stores interim results of a progressive job; set_results does not remove them, clear_preview does"""
+
+    @abstractmethod
+    def get_preview(self, job_id):
+        pass
+
+    @abstractmethod
+    def has_preview(self, job_id):
+        pass
+
+    @abstractmethod
+    def clear_preview(self, job_id):
+        pass
+
+    @abstractmethod
+    def delete(self, job_id):
+        pass
+
+    @abstractmethod
+    def job_dir(self, job_id):
+        """Directory holding a job's results and the files its analysis writes"""
+
+    @abstractmethod
+    def evict(self):
+        """Removes expired jobs and, past the size budget, the least recently read ones"""
+
+class SQLiteResultStore(ResultStore):
+    """Job records in SQLite, result payloads as JSON blobs in a per-job directory.
+
+    The per-job directory is the same one the analysis writes its rasters to, so evicting
+    a job removes everything it produced. SQLite's locking makes the store safe to share
+    between threads, worker processes and gunicorn workers.
+    """
+    def __init__(self, db_path, blob_root, ttl=RESULT_TTL_SECONDS, max_bytes=RESULT_STORE_MAX_BYTES):
+        self.db_path = db_path
+        self.blob_root = blob_root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(blob_root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, status TEXT NOT NULL, error TEXT, '
+                'created REAL NOT NULL, updated REAL NOT NULL, accessed REAL NOT NULL, '
+                'size_bytes INTEGER NOT NULL DEFAULT 0, progress TEXT)'
+            )
+            try:
+                conn.execute('ALTER TABLE jobs ADD COLUMN progress TEXT')
+            except sqlite3.OperationalError:
+                pass  # column already present
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return closing(conn)
+
+    def job_dir(self, job_id):
+        return os.path.join(self.blob_root, job_id)
+
+    def _results_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'results.json')
+
+    def _preview_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'preview.json')
+
+    def create(self, job_id, status='pending'):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO jobs (job_id, status, created, updated, accessed) VALUES (?, ?, ?, ?, ?)',
+                (job_id, status, now, now, now)
+            )
+        # Also evict here, so expired jobs go even while none complete
+        self.evict()
+
+    def set_status(self, job_id, status, error=None):
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET status = ?, error = ?, updated = ? WHERE job_id = ?',
+                         (status, error, time.time(), job_id))
+
+    def set_progress(self, job_id, progress):
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET progress = ?, updated = ? WHERE job_id = ?',
+                         (json.dumps(progress), time.time(), job_id))
+
+    def set_results(self, job_id, results):
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        # Write-then-rename so readers in other processes never see a partial file
+        temp_path = self._results_path(job_id) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(results, f)
+        os.replace(temp_path, self._results_path(job_id))
+        size = sum(entry.stat().st_size for entry in os.scandir(job_dir) if entry.is_file())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET status = ?, size_bytes = ?, updated = ?, accessed = ? WHERE job_id = ?',
+                         ('completed', size, now, now, job_id))
+        self.evict()
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None or (row['status'] in ('completed', 'failed') and time.time() - row['updated'] > self.ttl):
+            return None
+        job = dict(row)
+        job['progress'] = json.loads(job['progress']) if job['progress'] else None
+        return job
+
+    def get_results(self, job_id):
+        try:
+            with open(self._results_path(job_id)) as f:
+                results = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET accessed = ? WHERE job_id = ?', (time.time(), job_id))
+        return results
+
+    def set_preview(self, job_id, results):
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        temp_path = self._preview_path(job_id) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(results, f)
+        os.replace(temp_path, self._preview_path(job_id))
+
+    def get_preview(self, job_id):
+        try:
+            with open(self._preview_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def has_preview(self, job_id):
+        return os.path.exists(self._preview_path(job_id))
+
+    def clear_preview(self, job_id):
+        try:
+            os.remove(self._preview_path(job_id))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(os.path.join(self.job_dir(job_id), 'preview'), ignore_errors=True)
+
+    def delete(self, job_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def evict(self):
+        """Drops expired jobs, then least recently read results until under the size budget.
+
+        Only finished (completed or failed) jobs are evicted: a queued job may wait longer
+        than the TTL, and a running one is still writing to its directory.
+        """
+        with self._connect() as conn:
+            expired = [row['job_id'] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('completed', 'failed') AND updated < ?",
+                (time.time() - self.ttl,))]
+            total = conn.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM jobs').fetchone()[0]
+            over_budget = []
+            if total > self.max_bytes:
+                for row in conn.execute("SELECT job_id, size_bytes FROM jobs WHERE size_bytes > 0 "
+                                        "AND status IN ('completed', 'failed') ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    over_budget.append(row['job_id'])
+                    total -= row['size_bytes']
+        for job_id in expired + over_budget:
+            self.delete(job_id)
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+def get_job_store():
+    """Opens the shared job store on first use, so importing the module touches no files"""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = SQLiteResultStore(RESULT_STORE_PATH, RESULTS_FOLDER)
+        return _job_store
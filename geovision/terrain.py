@@ -0,0 +1,598 @@
+"""Terrain analysis of DEMs: slope, aspect, hillshade and curvature, in memory or tile by tile"""
+import numpy as np
+import rasterio
+from rasterio.mask import mask
+from shapely.geometry import box
+import os
+import base64
+from io import BytesIO
+import json
+import sys
+from rasterio.windows import from_bounds, Window
+from rasterio.crs import CRS
+import hashlib
+from contextlib import ExitStack
+
+from .caches import ArrayCache, get_array_cache
+from .events import report_progress
+from .metrics import JobProfile
+from .rasters import (COG_COMPRESS, COG_STORAGE, PYPLOT_LOCK, RENDER_FORMAT, RENDER_MAX_SIZE, RENDER_MODE,
+                      encode_image, open_product_raster, pyplot, read_decimated, render_product)
+from .stats import new_accumulators
+
+# Terrain analysis tiling configuration
+MAX_IN_MEMORY_PIXELS = 10000 * 10000  # larger DEMs are streamed tile by tile
+TILE_SIZE = 1024
+TILE_HALO = 2  # curvature is a gradient of a gradient, so it reaches two pixels out
+TERRAIN_PRODUCTS = ('slope', 'aspect', 'hillshade', 'curvature')
+TERRAIN_RASTERS = ('elevation',) + TERRAIN_PRODUCTS  # saved per analysis for tiles and zonal statistics
+TERRAIN_DTYPE = np.float32  # working precision for elevation and derived products
+# Progressive analyses first publish a preview computed from a decimated read of at most
+# PREVIEW_MAX_PIXELS (served from overviews when the DEM has them), then the full-resolution results
+TERRAIN_PROGRESSIVE = os.environ.get('TERRAIN_PROGRESSIVE', '0') == '1'
+PREVIEW_MAX_PIXELS = int(os.environ.get('PREVIEW_MAX_PIXELS', 1024 * 1024))
+PREVIEW_RENDER_SIZE = int(os.environ.get('PREVIEW_RENDER_SIZE', 512))  # longest side of preview images, whose PNG encoding dominates
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+
+FIGURE_PANEL_SIZE = 1024  # pixels per side read for each panel of a tiled DEM's figure (about the panel's size at 150 dpi)
+RENDERED_PRODUCTS = ('elevation',) + TERRAIN_PRODUCTS
+
+# Everything besides the DEM bytes and clip bounds that shapes a result; bump 'version' when the pipeline changes
+TERRAIN_ANALYSIS_PARAMS = {
+    'azimuth': 315, 'altitude': 45, 'dtype': np.dtype(TERRAIN_DTYPE).name,
+    'storage': COG_STORAGE, 'compress': COG_COMPRESS, 'version': 3
+}
+
+def analysis_cache_key(content_hash, clip_bounds, params=TERRAIN_ANALYSIS_PARAMS):
+    """Cache key for a DEM (by content hash), its clip bounds and the analysis parameters"""
+    key_source = json.dumps({
+        'content': content_hash,
+        'clip_bounds': [repr(float(v)) for v in clip_bounds] if clip_bounds else None,
+        'params': params
+    }, sort_keys=True)
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def terrain_statistics(accumulators, shape, pixel_size):
+    """Statistics payload for the terrain API from per-product accumulators"""
+    stats = {name: accumulator.summary() for name, accumulator in accumulators.items()}
+    if 'elevation' in stats:
+        stats['elevation'].update(shape=tuple(shape), pixel_size=float(pixel_size))
+    if 'slope' in stats:
+        stats['slope']['steep_areas_percentage'] = stats['slope'].get('threshold_percentages', {}).get('30', 0.0)
+    return stats
+
+def iter_halo_windows(width, height, tile_size=TILE_SIZE, halo=TILE_HALO):
+    """Yields (inner, outer) windows covering the raster; outer adds a halo clamped to the edges"""
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            inner = Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+            row_start, col_start = max(row - halo, 0), max(col - halo, 0)
+            row_stop = min(row + inner.height + halo, height)
+            col_stop = min(col + inner.width + halo, width)
+            yield inner, Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+def compute_derivatives(elevation, pixel_size, second_order=True):
+    """First (and optionally second) elevation derivatives, keeping the input dtype"""
+    dy, dx = np.gradient(elevation, pixel_size, pixel_size)
+    derivatives = {'dx': dx, 'dy': dy}
+    if second_order:
+        add_second_derivatives(derivatives, pixel_size)
+    return derivatives
+
+def add_second_derivatives(derivatives, pixel_size):
+    # Curvature only needs the pure second derivatives, so differentiate each along one axis
+    derivatives['dyy'] = np.gradient(derivatives['dy'], pixel_size, axis=0)
+    derivatives['dxx'] = np.gradient(derivatives['dx'], pixel_size, axis=1)
+    return derivatives
+
+def slope_from_derivatives(derivatives, units='degrees', out=None):
+    out = np.hypot(derivatives['dx'], derivatives['dy'], out=out)
+    if units == 'percent':
+        out *= 100
+        return out
+    np.arctan(out, out=out)
+    if units == 'degrees':
+        np.degrees(out, out=out)
+    return out
+
+def aspect_from_derivatives(derivatives, units='degrees', out=None):
+    out = np.negative(derivatives['dy'], out=out)
+    np.arctan2(out, derivatives['dx'], out=out)
+    full_turn = 360 if units == 'degrees' else 2*np.pi
+    if units == 'degrees':
+        np.degrees(out, out=out)
+    out += full_turn
+    np.mod(out, full_turn, out=out)
+    return out
+
+def hillshade_from_derivatives(derivatives, azimuth=315, altitude=45):
+    """Hillshade straight from the gradients, with no per-pixel trigonometry.
+
+    With p = |grad z|: cos(slope) = 1/sqrt(1+p^2) and sin(slope)*cos(azimuth-aspect)
+    = (cos(az)*dx - sin(az)*dy)/sqrt(1+p^2), so the whole expression shares one denominator.
+    """
+    dx, dy = derivatives['dx'], derivatives['dy']
+    azimuth_rad = np.radians(azimuth)
+    altitude_rad = np.radians(altitude)
+    shade = np.multiply(dx, np.cos(altitude_rad) * np.cos(azimuth_rad))
+    norm = np.multiply(dy, np.cos(altitude_rad) * np.sin(azimuth_rad))
+    shade -= norm
+    shade += np.sin(altitude_rad)
+    np.hypot(dx, dy, out=norm)
+    norm *= norm
+    norm += 1
+    np.sqrt(norm, out=norm)
+    shade /= norm
+    del norm
+    shade *= 255
+    np.clip(shade, 0, 255, out=shade)
+    return shade.astype(np.uint8)
+
+def curvature_from_derivatives(derivatives, out=None):
+    return np.add(derivatives['dxx'], derivatives['dyy'], out=out)
+
+def compute_terrain_products(elevation, pixel_size, azimuth=315, altitude=45):
+    """Computes slope and aspect (degrees), hillshade and curvature for one elevation block"""
+    derivatives = compute_derivatives(elevation, pixel_size)
+    return {
+        'slope': slope_from_derivatives(derivatives),
+        'aspect': aspect_from_derivatives(derivatives),
+        'hillshade': hillshade_from_derivatives(derivatives, azimuth, altitude),
+        'curvature': curvature_from_derivatives(derivatives)
+    }
+
+class TerrainAnalyzer:
+    def __init__(self, dem_path, clip_bounds=None, dtype=TERRAIN_DTYPE, source_id=None, max_pixels=MAX_IN_MEMORY_PIXELS):
+        self.dem_path = dem_path
+        self.source_id = source_id  # content hash of the DEM; enables the decoded-array cache
+        self.dtype = dtype
+        self.max_pixels = max_pixels  # load_dem decimates larger DEMs to about this many pixels
+        self.elevation = None
+        self.metadata = None
+        self.pixel_size = None
+        self.clip_bounds = clip_bounds
+        self.original_transform = None
+        self.clipped_transform = None
+        self.slope = None
+        self.aspect = None
+        self.hillshade = None
+        self.curvature = None
+        self.product_paths = {}
+        self._derivatives = None
+        self._array_lease = None
+        self.array_cache_hit = None  # set by load_dem when the array cache was consulted
+    
+    def load_dem(self):
+        """Loads the (clipped, possibly decimated) elevation, from the array cache when the DEM was seen before.
+
+        A DEM is only written to the cache on its second read: most uploads are analysed
+        once (and a repeat of the same analysis is answered by the result cache), so
+        caching every first read would write a full float32 copy that is never read back.
+        """
+        key = None
+        if self.source_id:
+            key = ArrayCache.key('dem', self.source_id, self.clip_bounds, np.dtype(self.dtype).name, self.max_pixels)
+            self._array_lease = get_array_cache().acquire(key)
+            cached = get_array_cache().get(key)
+            self.array_cache_hit = cached is not None
+            if cached is not None:
+                self._restore_dem(*cached)
+                return True
+        if not self._read_dem():
+            return False
+        if key and get_array_cache().seen(key):
+            try:
+                get_array_cache().put(key, self.elevation, {
+                    'crs': self.metadata['crs'].to_wkt() if self.metadata['crs'] else None,
+                    'transform': list(self.clipped_transform)[:6],
+                    'original_transform': list(self.original_transform)[:6]
+                })
+            except OSError as e:
+                print(f"Could not cache DEM array: {e}", file=sys.stderr)
+        return True
+
+    def _restore_dem(self, elevation, meta):
+        self.elevation = elevation
+        self.clipped_transform = rasterio.Affine(*meta['transform'])
+        self.original_transform = rasterio.Affine(*meta['original_transform'])
+        self.pixel_size = abs(self.clipped_transform[0])
+        self.metadata = {
+            'crs': CRS.from_wkt(meta['crs']) if meta['crs'] else None, 'dtype': str(elevation.dtype),
+            'height': elevation.shape[0], 'width': elevation.shape[1], 'transform': self.clipped_transform
+        }
+        self._derivatives = None
+
+    def release_cached_arrays(self):
+        if self._array_lease:
+            get_array_cache().release(self._array_lease)
+            self._array_lease = None
+
+    def _read_dem(self):
+        try:
+            with rasterio.open(self.dem_path) as src:
+                self.original_transform = src.transform
+                region = self._clip_window(src)
+                total_pixels = int(region.width) * int(region.height)
+                downsample_factor = 1
+                if total_pixels > self.max_pixels:
+                    downsample_factor = int(np.sqrt(total_pixels / self.max_pixels)) + 1
+                if self.clip_bounds:
+                    min_x, min_y, max_x, max_y = self.clip_bounds
+                    if downsample_factor > 1:
+                        # Decimated windowed read, so the full-resolution crop never sits in memory
+                        clipped_data = src.read(
+                            1,
+                            window=region,
+                            out_shape=(
+                                max(int(region.height) // downsample_factor, 1),
+                                max(int(region.width) // downsample_factor, 1)
+                            ),
+                            resampling=rasterio.enums.Resampling.average
+                        )
+                        self.clipped_transform = rasterio.transform.from_bounds(
+                            *src.window_bounds(region),
+                            clipped_data.shape[1], clipped_data.shape[0]
+                        )
+                    else:
+                        bbox_geom = box(min_x, min_y, max_x, max_y)
+                        clipped_data, clipped_transform = mask(src, [bbox_geom], crop=True)
+                        clipped_data = clipped_data[0]
+                        self.clipped_transform = clipped_transform
+                    self.elevation = clipped_data.astype(self.dtype, copy=False)
+                    self.metadata = src.meta.copy()
+                    self.metadata.update({
+                        'height': self.elevation.shape[0],
+                        'width': self.elevation.shape[1],
+                        'transform': self.clipped_transform
+                    })
+                else:
+                    if downsample_factor > 1:
+                        self.elevation = src.read(
+                            1, 
+                            out_shape=(
+                                src.height // downsample_factor,
+                                src.width // downsample_factor
+                            ),
+                            resampling=rasterio.enums.Resampling.average
+                        ).astype(self.dtype, copy=False)
+                        self.clipped_transform = rasterio.transform.from_bounds(
+                            *src.bounds,
+                            self.elevation.shape[1],
+                            self.elevation.shape[0]
+                        )
+                    else:
+                        self.elevation = src.read(1).astype(self.dtype, copy=False)
+                        self.clipped_transform = src.transform
+                    self.metadata = src.meta.copy()
+                    self.metadata.update({
+                        'height': self.elevation.shape[0],
+                        'width': self.elevation.shape[1],
+                        'transform': self.clipped_transform
+                    })
+                transform = self.clipped_transform
+                self.pixel_size = abs(transform[0])
+                if src.nodata is not None:
+                    self.elevation[self.elevation == src.nodata] = np.nan
+                self._derivatives = None
+                return True
+        except Exception:
+            return False
+
+    def _clip_window(self, src):
+        """Pixel window covering clip_bounds (or the whole raster), snapped to whole pixels"""
+        full = Window(0, 0, src.width, src.height)
+        if not self.clip_bounds:
+            return full
+        region = from_bounds(*self.clip_bounds, transform=src.transform)
+        region = region.round_offsets().round_lengths()
+        return region.intersection(full)
+
+    def region_pixels(self):
+        """Full-resolution pixel count of the (clipped) DEM, or 0 when it cannot be read"""
+        try:
+            with rasterio.open(self.dem_path) as src:
+                region = self._clip_window(src)
+                return int(region.width) * int(region.height)
+        except Exception:
+            return 0
+
+    def needs_tiling(self):
+        """True when the (clipped) DEM is too large to analyse in memory at full resolution"""
+        return self.region_pixels() > MAX_IN_MEMORY_PIXELS
+
+    def analyze_tiled(self, output_dir, tile_size=TILE_SIZE, azimuth=315, altitude=45, on_tile=None):
+        """Streams the DEM through halo'd windows, writing every product to a tiled GeoTIFF.
+
+        Peak memory is bounded by the tile size; statistics are accumulated per tile, and
+        on_tile(done, total) is called after each one. Returns the statistics and records
+        the written rasters in self.product_paths.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        with rasterio.open(self.dem_path) as src:
+            self.original_transform = src.transform
+            region = self._clip_window(src)
+            width, height = int(region.width), int(region.height)
+            self.clipped_transform = src.window_transform(region)
+            self.pixel_size = abs(self.clipped_transform[0])
+            accumulators = new_accumulators(('elevation', 'slope', 'aspect', 'curvature'))
+            with ExitStack() as stack:
+                outputs = {}
+                for name in TERRAIN_RASTERS:
+                    path = os.path.join(output_dir, f'{name}.tif')
+                    dst = open_product_raster(path, name, width, height, src.crs, self.clipped_transform)
+                    outputs[name] = stack.enter_context(dst)
+                    self.product_paths[name] = path
+
+                windows = list(iter_halo_windows(width, height, tile_size, TILE_HALO))
+                for done, (inner, outer) in enumerate(windows, start=1):
+                    read_window = Window(region.col_off + outer.col_off, region.row_off + outer.row_off,
+                                         outer.width, outer.height)
+                    block = src.read(1, window=read_window).astype(self.dtype, copy=False)
+                    if src.nodata is not None:
+                        block[block == src.nodata] = np.nan
+                    products = compute_terrain_products(block, self.pixel_size, azimuth, altitude)
+
+                    rows = slice(inner.row_off - outer.row_off, inner.row_off - outer.row_off + inner.height)
+                    cols = slice(inner.col_off - outer.col_off, inner.col_off - outer.col_off + inner.width)
+                    accumulators['elevation'].update(block[rows, cols])
+                    outputs['elevation'].write(block[rows, cols], window=inner)
+                    for name, data in products.items():
+                        core = data[rows, cols]
+                        outputs[name].write(core, window=inner)
+                        if name in accumulators:
+                            accumulators[name].update(core)
+                    if on_tile:
+                        on_tile(done, len(windows))
+
+        return terrain_statistics(accumulators, (height, width), self.pixel_size)
+
+    def get_derivatives(self, second_order=False):
+        """Elevation derivatives, computed once and cached for every terrain product"""
+        if self.elevation is None: return None
+        if self._derivatives is None:
+            self._derivatives = compute_derivatives(self.elevation, self.pixel_size, second_order)
+        elif second_order and 'dxx' not in self._derivatives:
+            add_second_derivatives(self._derivatives, self.pixel_size)
+        return self._derivatives
+
+    def release_derivatives(self):
+        """Drops the cached derivatives once every product has been computed"""
+        self._derivatives = None
+
+    def calculate_slope(self, units='degrees'):
+        if self.elevation is None: return None
+        self.slope = slope_from_derivatives(self.get_derivatives(), units)
+        return self.slope
+    
+    def calculate_aspect(self, units='degrees'):
+        if self.elevation is None: return None
+        self.aspect = aspect_from_derivatives(self.get_derivatives(), units)
+        return self.aspect
+    
+    def calculate_hillshade(self, azimuth=315, altitude=45):
+        if self.elevation is None: return None
+        self.hillshade = hillshade_from_derivatives(self.get_derivatives(), azimuth, altitude)
+        return self.hillshade
+    
+    def calculate_curvature(self):
+        if self.elevation is None: return None
+        self.curvature = curvature_from_derivatives(self.get_derivatives(second_order=True))
+        return self.curvature
+        
+    def generate_visualization(self):
+        return base64.b64encode(self.render_figure()).decode('utf-8')
+
+    def render_figure(self):
+        """PNG bytes of the 2x2 product figure"""
+        with PYPLOT_LOCK:
+            return self._render_figure()
+
+    def save_products(self, output_dir):
+        """Writes the elevation and in-memory products to tiled GeoTIFFs for map tiles and zonal statistics"""
+        os.makedirs(output_dir, exist_ok=True)
+        for name in TERRAIN_RASTERS:
+            data = getattr(self, name)
+            if data is None:
+                continue
+            path = os.path.join(output_dir, f'{name}.tif')
+            height, width = data.shape
+            with open_product_raster(path, name, width, height, self.metadata['crs'], self.clipped_transform) as dst:
+                dst.write(data)
+            self.product_paths[name] = path
+
+    def render_images(self, output_dir, image_format=RENDER_FORMAT, max_size=RENDER_MAX_SIZE):
+        """Writes one colour-mapped image per product to output_dir/images without pyplot.
+
+        Products held in memory are used directly; products that only exist as tiled
+        rasters are read back decimated. Returns {product: filename}.
+        """
+        images_dir = os.path.join(output_dir, 'images')
+        os.makedirs(images_dir, exist_ok=True)
+        images = {}
+        for product in RENDERED_PRODUCTS:
+            data = getattr(self, product)
+            if data is None and product in self.product_paths:
+                data = read_decimated(self.product_paths[product], max_size)
+            if data is None:
+                continue
+            filename = f'{product}.{image_format}'
+            with open(os.path.join(images_dir, filename), 'wb') as f:
+                f.write(encode_image(render_product(data, product, max_size), image_format))
+            images[product] = filename
+        return images
+
+    def load_written_products(self, max_size=RENDER_MAX_SIZE):
+        """Reads the rasters written by analyze_tiled back at display size, for render_figure.
+
+        Memory stays bounded by max_size rather than by the DEM; clipped_transform is
+        rescaled to the decimated arrays so the figure keeps its map extent.
+        """
+        for name in RENDERED_PRODUCTS:
+            if name in self.product_paths:
+                setattr(self, name, read_decimated(self.product_paths[name], max_size))
+        with rasterio.open(self.product_paths['elevation']) as src:
+            self.clipped_transform = rasterio.transform.from_bounds(
+                *src.bounds, self.elevation.shape[1], self.elevation.shape[0])
+
+    def _render_figure(self):
+        plt = pyplot()
+        fig, axes = plt.subplots(2, 2, figsize=(15, 12))
+        fig.suptitle('Terrain Analysis Results', fontsize=24, fontweight='bold')
+        if self.clipped_transform:
+            extent = rasterio.transform.array_bounds(
+                self.elevation.shape[0], self.elevation.shape[1], self.clipped_transform
+            )
+        else:
+            extent = None
+        if self.elevation is not None:
+            im1 = axes[0, 0].imshow(self.elevation, cmap='terrain', extent=extent)
+            axes[0, 0].set_title('Digital Elevation Model', fontsize=20, fontweight='bold')
+            axes[0, 0].set_xlabel('Longitude', fontsize=16, fontweight='bold')
+            axes[0, 0].set_ylabel('Latitude', fontsize=16, fontweight='bold')
+            axes[0, 0].tick_params(axis='both', which='major', labelsize=14)
+            cbar1 = plt.colorbar(im1, ax=axes[0, 0])
+            cbar1.set_label('Elevation (m)', fontsize=16, fontweight='bold')
+            cbar1.ax.tick_params(labelsize=14)
+        if self.slope is not None:
+            im2 = axes[0, 1].imshow(self.slope, cmap='YlOrRd', extent=extent)
+            axes[0, 1].set_title('Slope (degrees)', fontsize=20, fontweight='bold')
+            axes[0, 1].set_xlabel('Longitude', fontsize=16, fontweight='bold')
+            axes[0, 1].set_ylabel('Latitude', fontsize=16, fontweight='bold')
+            axes[0, 1].tick_params(axis='both', which='major', labelsize=14)
+            cbar2 = plt.colorbar(im2, ax=axes[0, 1])
+            cbar2.set_label('Degrees', fontsize=16, fontweight='bold')
+            cbar2.ax.tick_params(labelsize=14)
+        if self.aspect is not None:
+            im3 = axes[1, 0].imshow(self.aspect, cmap='hsv', extent=extent)
+            axes[1, 0].set_title('Aspect (degrees)', fontsize=20, fontweight='bold')
+            axes[1, 0].set_xlabel('Longitude', fontsize=16, fontweight='bold')
+            axes[1, 0].set_ylabel('Latitude', fontsize=16, fontweight='bold')
+            axes[1, 0].tick_params(axis='both', which='major', labelsize=14)
+            cbar3 = plt.colorbar(im3, ax=axes[1, 0])
+            cbar3.set_label('Degrees', fontsize=16, fontweight='bold')
+            cbar3.ax.tick_params(labelsize=14)
+        if self.hillshade is not None:
+            axes[1, 1].imshow(self.hillshade, cmap='gray', extent=extent)
+            axes[1, 1].set_title('Hillshade', fontsize=20, fontweight='bold')
+            axes[1, 1].set_xlabel('Longitude', fontsize=16, fontweight='bold')
+            axes[1, 1].set_ylabel('Latitude', fontsize=16, fontweight='bold')
+            axes[1, 1].tick_params(axis='both', which='major', labelsize=14)
+        plt.tight_layout()
+        img_buffer = BytesIO()
+        plt.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
+        plt.close()
+        
+        return img_buffer.getvalue()
+    
+    def get_statistics(self):
+        products = {'elevation': self.elevation, 'slope': self.slope,
+                    'aspect': self.aspect, 'curvature': self.curvature}
+        products = {name: data for name, data in products.items() if data is not None}
+        accumulators = new_accumulators(products)
+        for name, data in products.items():
+            accumulators[name].update(data)
+        shape = self.elevation.shape if self.elevation is not None else ()
+        return terrain_statistics(accumulators, shape, self.pixel_size or 0)
+
+def run_terrain_analysis(file_path, clip_bounds, output_dir, render_mode=RENDER_MODE, source_id=None, job_id=None,
+                         remove_input=True):
+    """Runs the terrain pipeline on one DEM and returns its statistics and rendering.
+
+    Touches no shared state, so it can execute in a worker process. source_id (the DEM's
+    content hash) lets the decoded elevation be reused from the array cache. With a job_id,
+    stages and tiles are reported as job events. render_mode 'none' writes the rasters and
+    statistics only. The uploaded DEM is deleted afterwards unless remove_input is false.
+    The results carry a JobProfile report under 'instrumentation'; on failure it is
+    attached to the exception instead.
+    """
+    profile = JobProfile(job_id=job_id)
+    analyzer = TerrainAnalyzer(file_path, clip_bounds, source_id=source_id)
+    try:
+        tiled_statistics = None
+        if analyzer.needs_tiling():
+            # Full-resolution products and statistics are streamed to disk, and renders are
+            # made from display-size reads of those rasters, so memory is bounded by the tile size
+            with profile.stage('tiled'):
+                tiled_statistics = analyzer.analyze_tiled(
+                    output_dir, on_tile=lambda done, total: report_progress(job_id, 'tiles', done=done, total=total))
+            if render_mode == 'figure':
+                with profile.stage('load'):
+                    analyzer.load_written_products(FIGURE_PANEL_SIZE)
+        else:
+            with profile.stage('load'):
+                if not analyzer.load_dem():
+                    raise Exception("Failed to load DEM file.")
+            if analyzer.array_cache_hit is not None:
+                profile.cache('dem_array', analyzer.array_cache_hit)
+            with profile.stage('gradients'):
+                analyzer.get_derivatives(second_order=True)
+            with profile.stage('products'):
+                analyzer.calculate_slope()
+                analyzer.calculate_aspect()
+                analyzer.calculate_hillshade()
+                analyzer.calculate_curvature()
+                analyzer.release_derivatives()
+        
+        with profile.stage('statistics'):
+            statistics = tiled_statistics or analyzer.get_statistics()
+        if tiled_statistics is None:
+            with profile.stage('write'):
+                analyzer.save_products(output_dir)
+        if render_mode == 'none':
+            results = {'statistics': statistics}
+        elif render_mode == 'direct':
+            # In tiled mode no products are held in memory, so the written rasters are read back decimated
+            with profile.stage('render'):
+                results = {'statistics': statistics, 'images': analyzer.render_images(output_dir)}
+        else:
+            with profile.stage('render'):
+                figure = analyzer.render_figure()
+            with profile.stage('encode'):
+                results = {'statistics': statistics, 'visualization': base64.b64encode(figure).decode('utf-8')}
+    except Exception as e:
+        e.instrumentation = profile.report()
+        raise
+    finally:
+        analyzer.release_cached_arrays()
+    
+    if remove_input:
+        os.remove(file_path)
+
+    results['instrumentation'] = profile.report()
+    return results
+
+def run_terrain_preview(file_path, clip_bounds, output_dir, source_id=None):
+    """Quick terrain pass over a decimated read of the DEM for progressive analyses.
+
+    The DEM is read at no more than PREVIEW_MAX_PIXELS and analysed as in run_terrain_analysis,
+    except that no rasters are written. Whatever the render mode, the preview is rendered
+    directly (no pyplot) to output_dir/preview; the figure only comes with the full tier.
+    Returns None when the DEM is small enough that the preview would be the full analysis.
+    """
+    profile = JobProfile(sample=False)
+    analyzer = TerrainAnalyzer(file_path, clip_bounds, source_id=source_id, max_pixels=PREVIEW_MAX_PIXELS)
+    if analyzer.region_pixels() <= PREVIEW_MAX_PIXELS:
+        return None
+    try:
+        with profile.stage('load'):
+            if not analyzer.load_dem():
+                raise Exception("Failed to load DEM file.")
+        if analyzer.array_cache_hit is not None:
+            profile.cache('dem_array', analyzer.array_cache_hit)
+        with profile.stage('gradients'):
+            analyzer.get_derivatives(second_order=True)
+        with profile.stage('products'):
+            analyzer.calculate_slope()
+            analyzer.calculate_aspect()
+            analyzer.calculate_hillshade()
+            analyzer.calculate_curvature()
+            analyzer.release_derivatives()
+        with profile.stage('statistics'):
+            results = {'statistics': analyzer.get_statistics()}
+        with profile.stage('render'):
+            results['images'] = analyzer.render_images(os.path.join(output_dir, 'preview'), max_size=PREVIEW_RENDER_SIZE)
+        results.update(tier='preview', pixel_size=analyzer.pixel_size, shape=list(analyzer.elevation.shape))
+    finally:
+        analyzer.release_cached_arrays()
+    results['instrumentation'] = profile.report()
+    return results
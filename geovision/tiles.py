@@ -0,0 +1,125 @@
+"""XYZ map tiles of terrain products and spectral indices, rendered on demand"""
+import numpy as np
+import rasterio
+import os
+import threading
+from rasterio.windows import from_bounds, Window
+from rasterio.warp import reproject, Resampling
+import hashlib
+import functools
+from collections import OrderedDict
+
+from .rasters import encode_image, render_product
+from .stores import get_job_store
+
+TILE_PIXELS = 256
+TILE_CACHE_MAX_BYTES = int(os.environ.get('TILE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+TILE_MAX_AGE = 3600
+
+class BytesLRU:
+    """Thread-safe in-memory LRU of bytes values, bounded by their total size"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+tile_cache = BytesLRU(TILE_CACHE_MAX_BYTES)
+
+WEB_MERCATOR_EXTENT = 20037508.342789244
+
+def mercator_tile_bounds(z, x, y):
+    """Web Mercator bounds (left, bottom, right, top) of XYZ tile z/x/y"""
+    size = 2 * WEB_MERCATOR_EXTENT / (2 ** z)
+    left = -WEB_MERCATOR_EXTENT + x * size
+    top = WEB_MERCATOR_EXTENT - y * size
+    return left, top - size, left + size, top
+
+def read_tile(path, z, x, y, pixels=TILE_PIXELS):
+    """Warps the part of a raster under an XYZ tile into a pixels x pixels float array (NaN outside)"""
+    bounds = mercator_tile_bounds(z, x, y)
+    destination = np.full((pixels, pixels), np.nan, dtype=np.float32)
+    dst_transform = rasterio.transform.from_bounds(*bounds, pixels, pixels)
+    with rasterio.open(path) as src:
+        left, bottom, right, top = rasterio.warp.transform_bounds('EPSG:3857', src.crs, *bounds)
+        try:
+            # One pixel of margin so bilinear sampling at the tile edge has neighbours
+            window = from_bounds(left, bottom, right, top, src.transform)
+            col_off, row_off = int(np.floor(window.col_off)) - 1, int(np.floor(window.row_off)) - 1
+            window = Window(col_off, row_off, int(np.ceil(window.col_off + window.width)) + 1 - col_off,
+                            int(np.ceil(window.row_off + window.height)) + 1 - row_off)
+            window = window.intersection(Window(0, 0, src.width, src.height))
+        except rasterio.errors.WindowError:
+            return destination  # the tile misses the raster
+        # A read averaged down to about the tile's resolution makes GDAL use the overviews, if any
+        factor = max(1.0, (right - left) / pixels / abs(src.transform[0]))
+        out_shape = (max(1, int(np.ceil(window.height / factor))), max(1, int(np.ceil(window.width / factor))))
+        data = src.read(1, window=window, out_shape=out_shape, masked=True,
+                        resampling=Resampling.average).astype(np.float32).filled(np.nan)
+        src_transform = src.window_transform(window) * rasterio.Affine.scale(window.width / out_shape[1],
+                                                                                window.height / out_shape[0])
+        reproject(
+            source=data,
+            destination=destination,
+            src_transform=src_transform,
+            src_crs=src.crs,
+            src_nodata=np.nan,
+            dst_transform=dst_transform,
+            dst_crs='EPSG:3857',
+            dst_nodata=np.nan,
+            resampling=Resampling.bilinear
+        )
+        scale, offset = src.scales[0], src.offsets[0]
+    if scale != 1 or offset != 0:
+        destination *= scale
+        destination += offset
+    return destination
+
+def tile_etag(path, z, x, y):
+    stat = os.stat(path)
+    return hashlib.sha1(f'{path}:{stat.st_mtime_ns}:{stat.st_size}:{z}/{x}/{y}'.encode('utf-8')).hexdigest()
+
+def render_tile(path, product, z, x, y, etag, value_range=None):
+    """PNG bytes for one tile, served from the in-memory LRU when already rendered"""
+    key = (etag, value_range)
+    png = tile_cache.get(key)
+    if png is None:
+        data = read_tile(path, z, x, y)
+        png = encode_image(render_product(data, product, TILE_PIXELS, value_range), 'png')
+        tile_cache.put(key, png)
+    return png
+
+def terrain_value_range(analysis_id, product, path):
+    """(min, max) of a product from a completed job's statistics, for consistent tile colours, or None"""
+    stat = os.stat(path)
+    return _terrain_value_range(analysis_id, product, path, stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=256)
+def _terrain_value_range(analysis_id, product, path, mtime_ns, size):
+    # Keyed on the raster's mtime and size, so a job rewritten under the same id is looked up again
+    stats = (get_job_store().get_results(analysis_id) or {}).get('statistics', {}).get(product, {})
+    if stats.get('min') is None or stats.get('max') is None:
+        return None
+    return stats['min'], stats['max']
@@ -0,0 +1,167 @@
+"""Uploaded files: streamed single-request uploads and resumable chunked upload sessions"""
+from werkzeug.utils import secure_filename
+import os
+import uuid
+import json
+import threading
+import time
+import re
+import glob
+import hashlib
+from contextlib import contextmanager
+from collections import defaultdict
+try:
+    import fcntl
+except ImportError:  # not available on Windows; upload sessions then lock within this process only
+    fcntl = None
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def save_upload(file_storage, dest_path):
+    """Streams an uploaded file to disk, hashing it on the way; returns the SHA-256 hex digest"""
+    digest = hashlib.sha256()
+    with open(dest_path, 'wb') as out:
+        while True:
+            chunk = file_storage.stream.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 60 * 60))  # idle uploads older than this are removed
+
+class UploadRangeError(Exception):
+    """A chunk whose length disagrees with its Content-Range or runs past the declared size"""
+
+class UploadSession:
+    """A resumable upload written chunk by chunk straight into an upload folder.
+
+    Chunks must arrive in order; the SHA-256 is updated as they are written. Writers hold an
+    flock on the session's .upload.json, so workers of a multi-process server serialise too.
+    The running digest lives in this process only, so a session resumed elsewhere (another
+    worker, a restart) re-hashes the bytes received so far once and carries on.
+    """
+    _digests = {}
+    _locks = defaultdict(threading.Lock)
+
+    def __init__(self, folder, upload_id, filename, total_size=None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.total_size = total_size
+        self.final_path = os.path.join(folder, f'{upload_id}_{filename}')
+        self.part_path = self.final_path + '.part'
+        self.meta_path = os.path.join(folder, f'{upload_id}.upload.json')
+
+    @classmethod
+    def create(cls, folder, filename, total_size=None):
+        cls.sweep(folder)
+        session = cls(folder, uuid.uuid4().hex, secure_filename(filename), total_size)
+        open(session.part_path, 'wb').close()
+        with open(session.meta_path, 'w') as f:
+            json.dump({'filename': session.filename, 'total_size': total_size}, f)
+        return session
+
+    @classmethod
+    def load(cls, folder, upload_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+            return None
+        try:
+            with open(os.path.join(folder, f'{upload_id}.upload.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(folder, upload_id, meta['filename'], meta['total_size'])
+
+    @classmethod
+    def sweep(cls, folder, max_age=UPLOAD_SESSION_TTL):
+        """Removes uploads that received nothing for max_age seconds; sessions being written are skipped"""
+        cutoff = time.time() - max_age
+        for meta_path in glob.glob(os.path.join(folder, '*.upload.json')):
+            session = cls.load(folder, os.path.basename(meta_path)[:-len('.upload.json')])
+            if session is None:
+                continue
+            try:
+                if max(os.path.getmtime(session.part_path), os.path.getmtime(meta_path)) > cutoff:
+                    continue
+                with session._locked(blocking=False):
+                    os.remove(session.part_path)
+                    os.remove(meta_path)
+            except (BlockingIOError, FileNotFoundError):
+                continue
+            cls._digests.pop(session.upload_id, None)
+            cls._locks.pop(session.upload_id, None)
+
+    @contextmanager
+    def _locked(self, blocking=True):
+        """Holds this session's lock: the thread lock, then an flock on the metadata file.
+
+        Raises FileNotFoundError when the session was finalised or swept meanwhile, and
+        BlockingIOError when not blocking and another writer holds it.
+        """
+        lock = self._locks[self.upload_id]
+        if not lock.acquire(blocking):
+            raise BlockingIOError(f'Upload {self.upload_id} is busy')
+        try:
+            with open(self.meta_path, 'rb') as meta:
+                if fcntl is not None:
+                    fcntl.flock(meta, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if not os.path.exists(self.meta_path):
+                    raise FileNotFoundError(self.meta_path)  # removed while we waited for the lock
+                yield
+        finally:
+            lock.release()
+
+    @property
+    def received(self):
+        return os.path.getsize(self.part_path)
+
+    def _digest_at(self, offset):
+        cached = self._digests.get(self.upload_id)
+        if cached and cached[0] == offset:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(self.part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest
+
+    def write_chunk(self, stream, offset, length=None):
+        """Appends a request body at offset; returns the new size.
+
+        Raises ValueError on a gap/overlap, and UploadRangeError (leaving the upload as it
+        was) when the body is not length bytes long or runs past total_size.
+        """
+        with self._locked():
+            received = self.received
+            if offset != received:
+                raise ValueError(f'Expected offset {received}, got {offset}')
+            digest = self._digest_at(received)
+            with open(self.part_path, 'r+b') as out:
+                out.seek(received)
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                end = out.tell()
+                error = None
+                if length is not None and end - received != length:
+                    error = f'Content-Range covers {length} bytes but the body has {end - received}'
+                elif self.total_size is not None and end > self.total_size:
+                    error = f'Upload would grow to {end} bytes, past its total_size of {self.total_size}'
+                if error:
+                    out.truncate(received)
+                    self._digests.pop(self.upload_id, None)  # it has hashed the rejected bytes
+                    raise UploadRangeError(error)
+            os.utime(self.meta_path)
+            self._digests[self.upload_id] = (end, digest)
+            return end
+
+    def finalize(self):
+        """Moves the completed upload into place; returns (path, sha256)"""
+        with self._locked():
+            digest = self._digest_at(self.received).hexdigest()
+            os.replace(self.part_path, self.final_path)
+            os.remove(self.meta_path)
+            self._digests.pop(self.upload_id, None)
+        self._locks.pop(self.upload_id, None)
+        return self.final_path, digest
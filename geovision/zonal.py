@@ -0,0 +1,236 @@
+"""Zonal statistics of rasters over GeoJSON or GeoPackage zones"""
+import numpy as np
+import rasterio
+from shapely.geometry import box, shape, mapping
+import shapely.errors
+from shapely import STRtree, wkb
+import os
+import json
+from rasterio.crs import CRS
+from rasterio.features import rasterize
+import sqlite3
+from contextlib import ExitStack, closing
+from collections import defaultdict
+
+from .caches import cached_band
+from .indices import dataset_grid, iter_block_windows
+from .rasters import read_band
+from .terrain import MAX_IN_MEMORY_PIXELS
+
+ZONE_EXTENSIONS = {'geojson', 'json', 'gpkg'}
+ZONAL_STATISTICS = ('count', 'sum', 'mean', 'std', 'min', 'max')
+ZONAL_MAX_ZONES = int(os.environ.get('ZONAL_MAX_ZONES', 100000))
+ZONAL_BLOCK_SIZE = 2048
+GEOPACKAGE_ENVELOPE_BYTES = (0, 32, 48, 48, 64)  # by the envelope indicator in the blob header flags
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def geopackage_geometry(blob):
+    """Shapely geometry from a GeoPackage geometry blob (header, then WKB); None for empty geometries"""
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if blob[:2] != b'GP':
+        raise ValueError('Not a GeoPackage geometry')
+    flags = blob[3]
+    if flags & 0x10:
+        return None
+    return wkb.loads(blob[8 + GEOPACKAGE_ENVELOPE_BYTES[(flags >> 1) & 0x07]:])
+
+def read_geopackage_zones(path, layer=None):
+    """(geometries, properties, crs) of one feature table of a GeoPackage, read with sqlite3 and shapely"""
+    with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as conn:
+        layers = conn.execute(
+            "SELECT c.table_name, g.column_name, g.srs_id FROM gpkg_contents c "
+            "JOIN gpkg_geometry_columns g ON g.table_name = c.table_name WHERE c.data_type = 'features'"
+        ).fetchall()
+        if layer is not None:
+            layers = [entry for entry in layers if entry[0] == layer]
+        if not layers:
+            raise ValueError(f"No feature layer {layer!r} in the GeoPackage" if layer else 'GeoPackage has no feature layers')
+        table, column, srs_id = layers[0]
+        srs = conn.execute('SELECT organization, organization_coordsys_id, definition FROM gpkg_spatial_ref_sys '
+                           'WHERE srs_id = ?', (srs_id,)).fetchone()
+        crs = None
+        if srs and srs_id > 0:
+            organization, code, definition = srs
+            crs = f'{organization.upper()}:{code}' if organization and organization.upper() == 'EPSG' else definition
+        cursor = conn.execute(f'SELECT * FROM {quote_identifier(table)}')
+        names = [description[0] for description in cursor.description]
+        geometries, properties = [], []
+        for row in cursor:
+            record = dict(zip(names, row))
+            geometries.append(geopackage_geometry(record.pop(column)))
+            properties.append(record)
+    return geometries, properties, crs
+
+def read_geojson_zones(path):
+    """(geometries, properties, crs) of a GeoJSON FeatureCollection, Feature or bare geometry"""
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError('GeoJSON must be an object')
+    # RFC 7946 GeoJSON is always WGS84; older files may still name their CRS
+    crs = ((data.get('crs') or {}).get('properties') or {}).get('name') or 'EPSG:4326'
+    if data.get('type') == 'FeatureCollection':
+        features = data.get('features') or []
+    elif data.get('type') == 'Feature':
+        features = [data]
+    else:
+        features = [{'type': 'Feature', 'geometry': data, 'properties': {}}]
+    geometries, properties = [], []
+    for feature in features:
+        geometries.append(shape(feature['geometry']) if feature.get('geometry') else None)
+        record = dict(feature.get('properties') or {})
+        if feature.get('id') is not None:
+            record.setdefault('id', feature['id'])
+        properties.append(record)
+    return geometries, properties, crs
+
+def load_zones(path, layer=None):
+    """(geometries, properties, crs) from a GeoJSON or GeoPackage file; raises ValueError on unreadable input"""
+    try:
+        if path.lower().endswith('.gpkg'):
+            return read_geopackage_zones(path, layer)
+        return read_geojson_zones(path)
+    except (sqlite3.DatabaseError, json.JSONDecodeError, KeyError, TypeError, IndexError, shapely.errors.GEOSException) as e:
+        raise ValueError(f'Could not read zones: {e}')
+
+def zone_ids(properties, id_field=None):
+    """One identifier per zone: id_field's value, else the feature id, else the 1-based feature number"""
+    if id_field:
+        missing = [number for number, record in enumerate(properties, start=1) if record.get(id_field) is None]
+        if missing:
+            raise ValueError(f"Zone {missing[0]} has no '{id_field}' value")
+        return [record[id_field] for record in properties]
+    return [record.get('id', number) for number, record in enumerate(properties, start=1)]
+
+def project_zones(geometries, zone_crs, raster_crs):
+    """Zone geometries in the raster's CRS; None stays None. Zones without a CRS are taken to be in the raster's"""
+    present = [index for index, geometry in enumerate(geometries) if geometry is not None and not geometry.is_empty]
+    projected = [None] * len(geometries)
+    if not present:
+        return projected
+    if zone_crs is None or CRS.from_user_input(zone_crs) == CRS.from_user_input(raster_crs):
+        for index in present:
+            projected[index] = geometries[index]
+        return projected
+    transformed = rasterio.warp.transform_geom(zone_crs, raster_crs, [mapping(geometries[index]) for index in present])
+    for index, geometry in zip(present, transformed):
+        projected[index] = shape(geometry)
+    return projected
+
+class ZonalAccumulator:
+    """Per-zone count, sum, mean, standard deviation, min and max, merged block by block.
+
+    An update costs a few bincount and reduceat passes over the block whatever the
+    number of zones. Label 0 is outside every zone. Variances merge with Chan's
+    parallel formula, so they are exact across blocks.
+    """
+    def __init__(self, zones):
+        size = zones + 1
+        self.count = np.zeros(size, dtype=np.int64)
+        self.sum = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+    def update(self, labels, values):
+        valid = (labels > 0) & np.isfinite(values)
+        labels = labels[valid]
+        if not labels.size:
+            return
+        values = values[valid].astype(np.float64)
+        size = len(self.count)
+        count = np.bincount(labels, minlength=size)
+        sums = np.bincount(labels, weights=values, minlength=size)
+        mean = np.divide(sums, count, out=np.zeros(size), where=count > 0)
+        m2 = np.bincount(labels, weights=(values - mean[labels]) ** 2, minlength=size)
+
+        order = np.argsort(labels, kind='stable')
+        ordered_labels, ordered_values = labels[order], values[order]
+        starts = np.flatnonzero(np.r_[True, ordered_labels[1:] != ordered_labels[:-1]])
+        zones = ordered_labels[starts]
+        self.min[zones] = np.minimum(self.min[zones], np.minimum.reduceat(ordered_values, starts))
+        self.max[zones] = np.maximum(self.max[zones], np.maximum.reduceat(ordered_values, starts))
+
+        total = self.count + count
+        weight = np.divide(count, total, out=np.zeros(size), where=total > 0)
+        delta = mean - self.mean
+        self.m2 += m2 + delta ** 2 * self.count * weight
+        self.mean += delta * weight
+        self.count = total
+        self.sum += sums
+
+    def rows(self):
+        """One {statistic: value} dict per zone, in zone order; empty zones have only a zero count"""
+        rows = []
+        for zone in range(1, len(self.count)):
+            count = int(self.count[zone])
+            if not count:
+                rows.append({name: 0 if name == 'count' else None for name in ZONAL_STATISTICS})
+                continue
+            rows.append({
+                'count': count, 'sum': float(self.sum[zone]), 'mean': float(self.mean[zone]),
+                'std': float(np.sqrt(self.m2[zone] / count)),
+                'min': float(self.min[zone]), 'max': float(self.max[zone])
+            })
+        return rows
+
+def zonal_statistics(geometries, zone_crs, sources, all_touched=False):
+    """Per-zone statistics of every raster in sources ({name: path}); returns {name: ZonalAccumulator}.
+
+    Rasters are streamed in ZONAL_BLOCK_SIZE blocks. Zones are rasterized once per block
+    into a label grid shared by every raster on that grid, so a request over several
+    terrain products rasterizes the polygons only once. Rasters small enough to analyse
+    in memory are read through the array cache, so repeated queries skip the decode.
+    Where zones overlap, a pixel counts for the later zone.
+    """
+    accumulators = {}
+    with ExitStack() as stack:
+        datasets = {name: stack.enter_context(rasterio.open(path)) for name, path in sources.items()}
+        grids = defaultdict(list)
+        for name, dataset in datasets.items():
+            grids[dataset_grid(dataset)].append(name)
+
+        for grid, names in grids.items():
+            crs_wkt, transform, width, height = grid
+            transform = rasterio.Affine(*transform)
+            shapes = project_zones(geometries, zone_crs, crs_wkt)
+            tree = STRtree(shapes)
+            readers = {}
+            for name in names:
+                accumulators[name] = ZonalAccumulator(len(geometries))
+                if width * height <= MAX_IN_MEMORY_PIXELS:
+                    array, _ = stack.enter_context(cached_band(sources[name]))
+                    readers[name] = lambda window, array=array: array[window.toslices()]
+                else:
+                    readers[name] = lambda window, dataset=datasets[name]: read_band(dataset, window=window)
+
+            for block in iter_block_windows(width, height, ZONAL_BLOCK_SIZE):
+                hits = tree.query(box(*rasterio.windows.bounds(block, transform)))
+                if not len(hits):
+                    continue
+                labels = rasterize(
+                    ((shapes[index], int(index) + 1) for index in sorted(hits)),
+                    out_shape=(int(block.height), int(block.width)),
+                    transform=rasterio.windows.transform(block, transform),
+                    fill=0, dtype='int32', all_touched=all_touched
+                )
+                for name in names:
+                    accumulators[name].update(labels, readers[name](block))
+    return accumulators
+
+def zonal_table(ids, accumulators):
+    """Flat rows for CSV: zone, then <source>_<statistic> columns"""
+    columns = ['zone'] + [f'{name}_{statistic}' for name in accumulators for statistic in ZONAL_STATISTICS]
+    per_source = {name: accumulator.rows() for name, accumulator in accumulators.items()}
+    rows = []
+    for index, zone in enumerate(ids):
+        row = [zone]
+        for name in accumulators:
+            row.extend(per_source[name][index][statistic] for statistic in ZONAL_STATISTICS)
+        rows.append(row)
+    return columns, rows
@@ -0,0 +1,61 @@
+"""Shared fixtures: small synthetic rasters, and an app whose folders live in a scratch directory"""
+import os
+import tempfile
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+# Before geovision is imported: its folders default to the temp directory, and jobs run in threads
+tempfile.tempdir = tempfile.mkdtemp(prefix='geovision-tests-')
+os.environ.setdefault('ANALYSIS_EXECUTOR', 'thread')
+
+DEM_NODATA = -9999
+SCENE_NAME = 'T31NEJ_20230115T101301'
+
+
+def write_dem(path, width, height, seed=0):
+    """Rolling hills plus noise, with a nodata corner, on a 30 m UTM grid"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    elevation = 500 + 200 * np.sin(x / 23) * np.cos(y / 31) + 15 * np.sin(x / 7 + y / 5)
+    elevation += rng.normal(0, 1, (height, width)).astype(np.float32)
+    elevation[:5, :7] = DEM_NODATA
+    with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=1, dtype='float32',
+                       crs='EPSG:32631', transform=from_origin(500000, 900000, 30, 30), nodata=DEM_NODATA) as dst:
+        dst.write(elevation.astype(np.float32), 1)
+    return path
+
+
+@pytest.fixture
+def dem_path(tmp_path):
+    return write_dem(str(tmp_path / 'dem.tif'), 150, 110)
+
+
+@pytest.fixture
+def band_files(tmp_path):
+    """Lossless JPEG2000 B11/B8A pair at 20 m, named like a Sentinel-2 granule"""
+    rng = np.random.default_rng(1)
+    y, x = np.mgrid[0:200, 0:240].astype(np.float32)
+    files = {}
+    for band, base in (('B11', 1800), ('B8A', 2200)):
+        data = (base + 600 * np.sin(x / 13 + y / 17) + rng.integers(0, 300, x.shape)).astype(np.uint16)
+        path = str(tmp_path / f'{SCENE_NAME}_{band}_20m.jp2')
+        with rasterio.open(path, 'w', driver='JP2OpenJPEG', width=240, height=200, count=1, dtype='uint16',
+                           crs='EPSG:32631', transform=from_origin(654000, 874000, 20, 20),
+                           QUALITY=100, REVERSIBLE=True) as dst:
+            dst.write(data, 1)
+        files[band] = path
+    return files
+
+
+@pytest.fixture
+def app(tmp_path):
+    from geovision.app import create_app
+    return create_app({'UPLOAD_FOLDER': str(tmp_path / 'uploads'), 'OUTPUT_FOLDER': str(tmp_path / 'output')})
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
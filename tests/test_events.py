@@ -0,0 +1,69 @@
+import json
+import uuid
+
+import pytest
+
+from geovision.events import JobEvents, job_events
+from geovision.stores import get_job_store
+
+
+def parse_frames(body):
+    """[(id or None, event, data)] of an SSE body, skipping keep-alive comments"""
+    frames = []
+    for chunk in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in chunk.split('\n') if not line.startswith(':'))
+        if fields:
+            event_id = int(fields['id']) if 'id' in fields else None
+            frames.append((event_id, fields['event'], json.loads(fields['data'])))
+    return frames
+
+
+@pytest.fixture
+def finished_job():
+    """A terrain job whose events are all published, ending with 'completed'"""
+    job_id = str(uuid.uuid4())
+    get_job_store().create(job_id, 'running')
+    job_events.publish(job_id, 'running')
+    for done in (1, 2, 3):
+        job_events.publish(job_id, 'tiles', done=done, total=3)
+    job_events.publish(job_id, 'completed', results=f'/api/analysis/{job_id}/results')
+    return job_id
+
+
+def test_stream_replays_every_event_after_the_status(client, finished_job):
+    frames = parse_frames(client.get(f'/api/analysis/{finished_job}/events').get_data(as_text=True))
+    assert frames[0] == (None, 'status', {'status': 'running'})
+    assert [(event_id, event) for event_id, event, _ in frames[1:]] == \
+        [(1, 'running'), (2, 'tiles'), (3, 'tiles'), (4, 'tiles'), (5, 'completed')]
+    assert frames[-1][2]['results'] == f'/api/analysis/{finished_job}/results'
+
+
+@pytest.mark.parametrize('last_event_id', [1, 3, 4])
+def test_stream_resumes_after_last_event_id(client, finished_job, last_event_id):
+    response = client.get(f'/api/analysis/{finished_job}/events', headers={'Last-Event-ID': str(last_event_id)})
+    frames = parse_frames(response.get_data(as_text=True))
+    assert [event_id for event_id, _, _ in frames] == list(range(last_event_id + 1, 6))
+    assert frames[-1][1] == 'completed'
+
+
+def test_stream_of_a_job_finished_elsewhere_ends_with_its_stored_outcome(client):
+    job_id = str(uuid.uuid4())
+    get_job_store().create(job_id, 'running')
+    get_job_store().set_status(job_id, 'failed', error='boom')
+    frames = parse_frames(client.get(f'/api/analysis/{job_id}/events').get_data(as_text=True))
+    assert [event for _, event, _ in frames] == ['status', 'failed']
+    assert frames[-1][2] == {'event': 'failed', 'error': 'boom'}
+
+
+def test_stream_rejects_unknown_jobs_and_bad_event_ids(client, finished_job):
+    assert client.get(f'/api/analysis/{uuid.uuid4()}/events').status_code == 404
+    assert client.get(f'/api/analysis/{finished_job}/events', headers={'Last-Event-ID': 'x'}).status_code == 400
+
+
+def test_history_is_bounded_and_numbering_continues():
+    events = JobEvents(history=3)
+    for number in range(5):
+        events.publish('job', 'tiles', done=number)
+    assert [number for number, _ in events.wait('job', 0, timeout=0)] == [3, 4, 5]
+    assert events.wait('job', 5, timeout=0) == []
+    assert events.wait('other', 0, timeout=0) is None
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+import rasterio.warp
+import rasterio.windows
+
+from geovision import indices
+from geovision.caches import get_array_cache
+from geovision.indices import (SPECTRAL_INDICES, BandExpression, index_output_path, parse_aois, parse_index_specs,
+                               process_index_scene_aois)
+
+NDBI = {'ndbi': BandExpression(SPECTRAL_INDICES['ndbi'])}
+
+
+@pytest.fixture
+def aoi(band_files):
+    """A lon/lat box well inside the synthetic scene"""
+    with rasterio.open(band_files['B11']) as src:
+        left, bottom, right, top = rasterio.warp.transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+    width, height = right - left, top - bottom
+    return (left + 0.15 * width, bottom + 0.2 * height, right - 0.1 * width, top - 0.15 * height)
+
+
+def run(band_files, aoi, folder, **kwargs):
+    outputs = process_index_scene_aois(band_files, NDBI, 2023, [(None, aoi, str(folder))], **kwargs)
+    with rasterio.open(outputs[None]['ndbi']) as src:
+        return src.read(1), src.profile
+
+
+@pytest.fixture
+def small_tiles(monkeypatch):
+    """Tiles and blocks much smaller than the scene, so reads span tiles and the uncached strip evicts"""
+    monkeypatch.setattr(indices, 'NDBI_DECODE_TILE', 48)
+    monkeypatch.setattr(indices, 'NDBI_BLOCK_SIZE', 40)
+
+
+@pytest.mark.parametrize('tiling', ['default', 'small'])
+def test_decode_cache_does_not_change_the_output(band_files, aoi, tmp_path, request, tiling):
+    if tiling == 'small':
+        request.getfixturevalue('small_tiles')
+    uncached, profile = run(band_files, aoi, tmp_path / 'uncached', decode_cache=False)
+    band_ids = {'B11': f'b11-{tiling}', 'B8A': f'b8a-{tiling}'}
+    cold, _ = run(band_files, aoi, tmp_path / 'cold', decode_cache=True, band_ids=band_ids)
+    hits = get_array_cache().hits
+    warm, _ = run(band_files, aoi, tmp_path / 'warm', decode_cache=True, band_ids=band_ids)
+    assert get_array_cache().hits > hits
+    assert profile['crs'] == indices.TARGET_CRS
+    assert np.isfinite(uncached).mean() > 0.9
+    for output in (cold, warm):
+        assert output.dtype == uncached.dtype
+        assert output.tobytes() == uncached.tobytes()
+
+
+def test_decode_tile_size_does_not_change_the_output(band_files, aoi, tmp_path, monkeypatch):
+    default, _ = run(band_files, aoi, tmp_path / 'default')
+    monkeypatch.setattr(indices, 'NDBI_DECODE_TILE', 48)
+    small, _ = run(band_files, aoi, tmp_path / 'small')
+    assert small.tobytes() == default.tobytes()
+
+
+def test_unprojected_ndbi_matches_the_band_formula(band_files, aoi, tmp_path):
+    run(band_files, aoi, tmp_path, write_unprojected=True)
+    with rasterio.open(index_output_path(str(tmp_path), 'ndbi', 2023, reprojected=False)) as out:
+        ndbi, bounds = out.read(1), out.bounds
+    bands = {}
+    for band, path in band_files.items():
+        with rasterio.open(path) as src:
+            window = rasterio.windows.from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths()
+            bands[band] = src.read(1, window=window).astype(np.float32)
+    expected = (bands['B11'] - bands['B8A']) / (bands['B11'] + bands['B8A'])
+    np.testing.assert_allclose(ndbi, expected, rtol=1e-6)
+
+
+def test_aoi_missing_the_scene_is_reported_as_none(band_files, tmp_path):
+    folder = tmp_path / 'away'
+    outputs = process_index_scene_aois(band_files, NDBI, 2023, [('away', (-10, -10, -9, -9), str(folder))])
+    assert outputs == {'away': None}
+    assert not os.path.exists(folder)
+
+
+def test_request_parsing():
+    assert list(parse_index_specs('ndbi, ndvi')) == ['ndbi', 'ndvi']
+    assert parse_index_specs('ratio=B11/B8A')['ratio'].bands == {'B11', 'B8A'}
+    with pytest.raises(ValueError):
+        parse_index_specs('ndbi=B11-B8A')
+    assert parse_aois({'aois': '{"site": [4.1, 7.6, 4.6, 8.0]}'}) == [('site', (4.1, 7.6, 4.6, 8.0))]
+    with pytest.raises(ValueError):
+        parse_aois({'aoi': '4.6,7.6,4.1,8.0'})
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from geovision.stats import StatsAccumulator, new_accumulators
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(3)
+    data = rng.normal(1e4, 25, 20000).astype(np.float32)  # a large mean makes a naive sum-of-squares lose precision
+    data[::97] = np.nan
+    return data
+
+
+def test_update_matches_numpy(values):
+    summary = StatsAccumulator().update(values).summary()
+    finite = values[np.isfinite(values)].astype(np.float64)
+    assert summary['count'] == finite.size
+    assert summary['mean'] == pytest.approx(finite.mean(), rel=1e-12)
+    assert summary['std'] == pytest.approx(finite.std(), rel=1e-9)
+    assert (summary['min'], summary['max']) == (finite.min(), finite.max())
+
+
+def test_chan_merge_is_independent_of_the_split(values):
+    whole = StatsAccumulator(bins=np.linspace(9900, 10100, 21), thresholds=(10000,)).update(values).summary()
+    rng = np.random.default_rng(4)
+    for _ in range(5):
+        cuts = np.sort(rng.choice(values.size, 6, replace=False))
+        parts = [StatsAccumulator(bins=np.linspace(9900, 10100, 21), thresholds=(10000,)).update(part)
+                 for part in np.split(values, cuts)]
+        rng.shuffle(parts)
+        merged = parts[0]
+        for part in parts[1:]:
+            merged.merge(part)
+        summary = merged.summary()
+        assert summary['count'] == whole['count']
+        assert summary['mean'] == pytest.approx(whole['mean'], rel=1e-12)
+        assert summary['std'] == pytest.approx(whole['std'], rel=1e-9)
+        assert (summary['min'], summary['max']) == (whole['min'], whole['max'])
+        assert summary['histogram'] == whole['histogram']
+        assert summary['threshold_percentages'] == whole['threshold_percentages']
+
+
+def test_empty_blocks_and_accumulators_merge_cleanly(values):
+    accumulator = StatsAccumulator().update(np.full(10, np.nan, dtype=np.float32))
+    assert accumulator.summary() == {'min': None, 'max': None, 'mean': None, 'std': None, 'count': 0}
+    accumulator.merge(StatsAccumulator()).update(values)
+    assert accumulator.summary() == StatsAccumulator().update(values).summary()
+
+
+def test_new_accumulators_use_the_product_config():
+    accumulators = new_accumulators(('slope', 'elevation'))
+    slope = accumulators['slope'].update(np.array([10.0, 20.0, 40.0, 80.0])).summary()
+    assert slope['threshold_percentages'] == {'30': 50.0}
+    assert sum(slope['histogram']['counts']) == 4
+    assert 'histogram' not in accumulators['elevation'].update(np.arange(4.0)).summary()
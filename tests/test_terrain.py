@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import rasterio
+
+from geovision.terrain import TERRAIN_PRODUCTS, TerrainAnalyzer
+
+
+@pytest.fixture
+def in_memory(dem_path):
+    analyzer = TerrainAnalyzer(dem_path)
+    assert analyzer.load_dem()
+    analyzer.calculate_slope()
+    analyzer.calculate_aspect()
+    analyzer.calculate_hillshade()
+    analyzer.calculate_curvature()
+    return analyzer
+
+
+@pytest.mark.parametrize('tile_size', [32, 47, 1024])
+def test_tiled_products_match_in_memory(dem_path, in_memory, tmp_path, tile_size):
+    tiled = TerrainAnalyzer(dem_path)
+    tiled.analyze_tiled(str(tmp_path / 'tiled'), tile_size=tile_size)
+    for name in ('elevation',) + TERRAIN_PRODUCTS:
+        with rasterio.open(tiled.product_paths[name]) as src:
+            written = src.read(1, masked=True).filled(np.nan)
+        np.testing.assert_allclose(written, getattr(in_memory, name), rtol=1e-6, atol=1e-6, equal_nan=True,
+                                   err_msg=name)
+
+
+def test_tiled_statistics_match_in_memory(dem_path, in_memory, tmp_path):
+    tiled = TerrainAnalyzer(dem_path).analyze_tiled(str(tmp_path / 'tiled'), tile_size=32)
+    expected = in_memory.get_statistics()
+    assert tiled.keys() == expected.keys()
+    for name, stats in expected.items():
+        assert tiled[name]['count'] == stats['count'], name
+        for key in ('min', 'max', 'mean', 'std'):
+            assert tiled[name][key] == pytest.approx(stats[key], rel=1e-6, abs=1e-9), (name, key)
+        if 'histogram' in stats:
+            assert tiled[name]['histogram'] == stats['histogram'], name
+    assert tiled['elevation']['shape'] == expected['elevation']['shape'] == (110, 150)
+    assert tiled['slope']['steep_areas_percentage'] == pytest.approx(expected['slope']['steep_areas_percentage'])
+
+
+def test_clipped_tiled_analysis_covers_the_clip_window(dem_path, tmp_path):
+    clip_bounds = (500000 + 30 * 20, 900000 - 30 * 80, 500000 + 30 * 100, 900000 - 30 * 10)
+    tiled = TerrainAnalyzer(dem_path, clip_bounds=clip_bounds)
+    stats = tiled.analyze_tiled(str(tmp_path / 'tiled'), tile_size=32)
+    assert stats['elevation']['shape'] == (70, 80)
+    with rasterio.open(tiled.product_paths['slope']) as src:
+        assert (src.width, src.height) == (80, 70)
+        assert src.bounds == pytest.approx(clip_bounds)
@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+import pytest
+
+from geovision.uploads import UploadSession
+
+PAYLOAD = os.urandom(200000)
+
+
+def create(client, total_size=len(PAYLOAD), filename='dem.tif'):
+    response = client.post('/api/uploads', data={'filename': filename, 'total_size': str(total_size)})
+    assert response.status_code == 201
+    return response.json['upload_id']
+
+
+def put(client, upload_id, start, data, total=len(PAYLOAD)):
+    headers = {'Content-Range': f'bytes {start}-{start + len(data) - 1}/{total}'}
+    return client.put(f'/api/uploads/{upload_id}', data=data, headers=headers)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4096, 65536, len(PAYLOAD)])
+def test_chunks_assemble_into_the_original_file(client, chunk_size):
+    payload = PAYLOAD[:5000] if chunk_size == 1 else PAYLOAD
+    upload_id = create(client, len(payload))
+    for start in range(0, len(payload), chunk_size):
+        response = put(client, upload_id, start, payload[start:start + chunk_size], len(payload))
+        assert response.status_code == 200
+        assert response.json['received'] == min(start + chunk_size, len(payload))
+    response = client.post(f'/api/uploads/{upload_id}/complete',
+                           data={'sha256': hashlib.sha256(payload).hexdigest()})
+    assert response.status_code == 200
+    assert response.json['size'] == len(payload)
+    assert response.json['sha256'] == hashlib.sha256(payload).hexdigest()
+
+
+def test_upload_resumes_after_rejected_chunks_and_lost_digest_state(client, app):
+    upload_id = create(client)
+    assert put(client, upload_id, 0, PAYLOAD[:70000]).status_code == 200
+    assert put(client, upload_id, 80000, PAYLOAD[80000:90000]).status_code == 409  # a gap
+    short = client.put(f'/api/uploads/{upload_id}', data=PAYLOAD[70000:70010],
+                       headers={'Content-Range': 'bytes 70000-70019/200000', 'Content-Length': '20'})
+    assert short.status_code == 400
+    assert put(client, upload_id, 70000, PAYLOAD[70000:]).status_code == 200
+    assert client.get(f'/api/uploads/{upload_id}').json['received'] == len(PAYLOAD)
+
+    UploadSession._digests.clear()  # as in another API process: the hash is rebuilt from the part file
+    response = client.post(f'/api/uploads/{upload_id}/complete')
+    assert response.status_code == 200
+    assert response.json['sha256'] == hashlib.sha256(PAYLOAD).hexdigest()
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], f'{upload_id}_dem.tif'), 'rb') as f:
+        assert f.read() == PAYLOAD
+
+
+def test_incomplete_or_oversized_uploads_are_refused(client):
+    upload_id = create(client, 100)
+    assert put(client, upload_id, 0, PAYLOAD[:100], total=200).status_code == 416
+    assert put(client, upload_id, 0, PAYLOAD[:50], total=100).status_code == 200
+    assert client.put(f'/api/uploads/{upload_id}', data=PAYLOAD[:60]).status_code == 416
+    assert client.post(f'/api/uploads/{upload_id}/complete').status_code == 409
+    assert client.post('/api/uploads/missing/complete').status_code == 404
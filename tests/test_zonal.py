@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import rasterio
+import rasterio.warp
+from rasterio.features import rasterize
+from shapely.geometry import Polygon, box
+
+from geovision import zonal
+from geovision.zonal import ZONAL_STATISTICS, zonal_statistics, zonal_table
+
+
+@pytest.fixture
+def zones():
+    """Overlapping boxes, a triangle, one zone off the raster and one missing geometry"""
+    return [
+        box(500000 + 30 * 10, 900000 - 30 * 60, 500000 + 30 * 70, 900000 - 30 * 5),
+        box(500000 + 30 * 50, 900000 - 30 * 100, 500000 + 30 * 140, 900000 - 30 * 40),
+        Polygon([(500000, 900000 - 30 * 110), (500000 + 30 * 60, 900000 - 30 * 110), (500000, 900000 - 30 * 50)]),
+        box(400000, 800000, 401000, 801000),
+        None,
+    ]
+
+
+def brute_force(zones, path):
+    """Per-zone statistics from one whole-raster rasterization, later zones winning overlaps"""
+    with rasterio.open(path) as src:
+        values = src.read(1, masked=True).filled(np.nan).astype(np.float64)
+        labels = rasterize(((zone, index) for index, zone in enumerate(zones, start=1) if zone is not None),
+                           out_shape=values.shape, transform=src.transform, fill=0, dtype='int32')
+    rows = []
+    for index in range(1, len(zones) + 1):
+        selected = values[(labels == index) & np.isfinite(values)]
+        if not selected.size:
+            rows.append({'count': 0, 'sum': None, 'mean': None, 'std': None, 'min': None, 'max': None})
+            continue
+        rows.append({'count': selected.size, 'sum': selected.sum(), 'mean': selected.mean(), 'std': selected.std(),
+                     'min': selected.min(), 'max': selected.max()})
+    return rows
+
+
+def assert_rows_match(rows, expected):
+    for zone, (row, want) in enumerate(zip(rows, expected), start=1):
+        assert row['count'] == want['count'], zone
+        for statistic in ZONAL_STATISTICS[1:]:
+            if want[statistic] is None:
+                assert row[statistic] is None, (zone, statistic)
+            else:
+                assert row[statistic] == pytest.approx(want[statistic], rel=1e-9), (zone, statistic)
+
+
+@pytest.mark.parametrize('block_size', [16, 37, 4096])
+@pytest.mark.parametrize('in_memory', [True, False])
+def test_blockwise_matches_single_pass(dem_path, zones, monkeypatch, block_size, in_memory):
+    monkeypatch.setattr(zonal, 'ZONAL_BLOCK_SIZE', block_size)
+    if not in_memory:
+        monkeypatch.setattr(zonal, 'MAX_IN_MEMORY_PIXELS', 0)
+    accumulators = zonal_statistics(zones, 'EPSG:32631', {'elevation': dem_path})
+    assert_rows_match(accumulators['elevation'].rows(), brute_force(zones, dem_path))
+
+
+def test_zones_are_reprojected_to_the_raster(dem_path, zones):
+    geographic = [None if zone is None else Polygon(rasterio.warp.transform_geom(
+        'EPSG:32631', 'EPSG:4326', zone.__geo_interface__)['coordinates'][0]) for zone in zones[:2]]
+    projected = zonal_statistics(geographic, 'EPSG:4326', {'elevation': dem_path})['elevation'].rows()
+    native = zonal_statistics(zones[:2], 'EPSG:32631', {'elevation': dem_path})['elevation'].rows()
+    for row, want in zip(projected, native):
+        assert abs(row['count'] - want['count']) <= 0.05 * want['count']
+        assert row['mean'] == pytest.approx(want['mean'], rel=1e-2)
+
+
+def test_zonal_table_has_a_column_per_source_statistic(dem_path, zones):
+    accumulators = zonal_statistics(zones, None, {'a': dem_path, 'b': dem_path})
+    columns, rows = zonal_table(['z1', 'z2', 'z3', 'z4', 'z5'], accumulators)
+    assert columns == ['zone'] + [f'{name}_{statistic}' for name in 'ab' for statistic in ZONAL_STATISTICS]
+    assert [row[0] for row in rows] == ['z1', 'z2', 'z3', 'z4', 'z5']
+    assert all(row[1:7] == row[7:] for row in rows)